@@ -0,0 +1,278 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# Analyses run at once; further requests wait in the queue. 0 matches the
+# concurrency of the API client the server uses
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 0))
+# Requests waiting in total, and from any one client (0 for no separate
+# bound), before new ones are turned away
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 32))
+ADMISSION_MAX_QUEUE_PER_CLIENT = int(os.environ.get("ADMISSION_MAX_QUEUE_PER_CLIENT", 0))
+# Longest a request waits for a slot before it is turned away
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10))
+# Request header identifying the client, e.g. X-Forwarded-For behind a proxy;
+# unset uses the peer address
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER", "")
+
+# Weight of the newest service time in the moving average
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a request is turned away; retry_after is the suggested wait in whole seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """The slot of an admitted request; release it once the request's work is done."""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._start = time.monotonic()
+        self._released = False
+
+    def release(self):
+        """Give the slot to the next waiting request. Releasing twice has no effect."""
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _Waiter:
+    """A queued request, woken through a threading.Event or, for asyncio, a future on its loop."""
+
+    def __init__(self, client, loop=None):
+        self.client = client
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.admitted = False
+        self.rejected = False
+        self.queued_at = time.monotonic()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Bounds the analyses in flight and queues the overflow fairly between clients.
+
+    Up to ``max_in_flight`` requests run at once. Others wait in a queue per
+    client, and freed slots go to the clients in turn, so one client
+    uploading many files cannot starve the rest. When the queue is full, the
+    newest request of the client with the most queued is turned away, and
+    a client at ``max_queue_per_client`` is turned away itself. Rejected and
+    timed-out requests get an Overloaded error with a Retry-After estimate
+    from a moving average of recent service times.
+
+    Both threads (admit) and asyncio tasks (admit_async) can wait on the
+    same controller.
+    """
+
+    def __init__(self, max_in_flight=8, max_queue=32, max_queue_per_client=0, queue_timeout=10,
+                 initial_service_seconds=5.0):
+        """
+        Initialize the controller.
+
+        Args:
+            max_in_flight (int): Requests admitted at the same time
+            max_queue (int): Requests waiting in total
+            max_queue_per_client (int): Requests waiting from any one client, or 0 for no separate bound
+            queue_timeout (float): Seconds a request waits before it is turned away
+            initial_service_seconds (float): Service time assumed until requests have completed
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout
+        self._service_seconds = initial_service_seconds
+        self._in_flight = 0
+        self._queued = 0
+        # Clients with waiting requests, in the order they are next served
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, client):
+        """
+        Wait for a slot for a request from client.
+
+        Args:
+            client (str): Identifies the client for fair queuing
+
+        Returns:
+            Ticket: The slot, to be released when the request is done
+
+        Raises:
+            Overloaded: If the queue is full or no slot became free in time
+        """
+        with self._lock:
+            waiter = self._enqueue(_Waiter(client))
+        if waiter is None:
+            return Ticket(self)
+        waiter.event.wait(self.queue_timeout)
+        return self._settle(waiter)
+
+    async def admit_async(self, client):
+        """The asyncio form of admit; waiting holds no thread."""
+        with self._lock:
+            waiter = self._enqueue(_Waiter(client, asyncio.get_running_loop()))
+        if waiter is None:
+            return Ticket(self)
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # The request went away while queued; give back a slot it may have just been granted
+            ticket = self._settle(waiter, cancelled=True)
+            if ticket is not None:
+                ticket.release()
+            raise
+        return self._settle(waiter)
+
+    def stats(self):
+        """Return the current load and the service time estimate."""
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'clients_queued': len(self._queues),
+                'service_seconds': round(self._service_seconds, 3),
+            }
+
+    def _retry_after(self):
+        """Return the whole seconds a turned-away client should wait: the time to work off the current load."""
+        backlog = self._in_flight + self._queued
+        return max(1, math.ceil(backlog * self._service_seconds / self.max_in_flight))
+
+    def _enqueue(self, waiter):
+        """Admit waiter at once and return None, or queue it and return it; the lock must be held."""
+        if self._in_flight < self.max_in_flight and not self._queued:
+            self._in_flight += 1
+            ADMISSION_WAIT_SECONDS.observe(0.0)
+            return None
+
+        queue = self._queues.get(waiter.client)
+        queued = len(queue) if queue else 0
+        if self.max_queue_per_client and queued >= self.max_queue_per_client:
+            self._reject('client_queue_full')
+        if self._queued >= self.max_queue:
+            # Make room by turning away the newest request of the busiest client
+            busiest = max(self._queues.values(), key=len, default=())
+            if len(busiest) <= queued:
+                self._reject('queue_full')
+            evicted = busiest.pop()
+            self._queued -= 1
+            if not busiest:
+                del self._queues[evicted.client]
+            evicted.rejected = True
+            evicted.wake()
+
+        if queue is None:
+            queue = self._queues[waiter.client] = deque()
+        queue.append(waiter)
+        self._queued += 1
+        return waiter
+
+    def _reject(self, reason):
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise Overloaded("The server is busy; please retry shortly", self._retry_after())
+
+    def _settle(self, waiter, cancelled=False):
+        """Return a ticket if waiter was admitted, or leave the queue and raise (or return None if cancelled)."""
+        with self._lock:
+            if waiter.admitted:
+                ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.queued_at)
+                return Ticket(self)
+            if waiter.rejected:
+                reason = 'queue_full'
+            else:
+                queue = self._queues[waiter.client]
+                queue.remove(waiter)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[waiter.client]
+                reason = 'timeout'
+            if cancelled:
+                return None
+            ADMISSION_REJECTED.inc(reason=reason)
+            raise Overloaded("The server is busy; please retry shortly", self._retry_after())
+
+    def _release(self, seconds):
+        with self._lock:
+            self._service_seconds += _SERVICE_TIME_ALPHA * (seconds - self._service_seconds)
+            if not self._queues:
+                self._in_flight -= 1
+                return
+            # The slot passes straight to the next client in turn
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            waiter.admitted = True
+            waiter.wake()
+
+
+def client_key(forwarded, peer):
+    """
+    Return the key a request is queued under.
+
+    Args:
+        forwarded (str): Value of ADMISSION_CLIENT_HEADER, or None; the first of several addresses is used
+        peer (str): Address of the connecting client
+
+    Returns:
+        str: The client key
+    """
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return peer or ''
+
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_admission_controller(default_max_in_flight=8):
+    """
+    Return the process-wide admission controller, configured from the environment.
+
+    Args:
+        default_max_in_flight (int): In-flight bound used when ADMISSION_MAX_IN_FLIGHT
+            is not set; the server creating the controller passes its API client's concurrency
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        with _admission_controller_lock:
+            if _admission_controller is None:
+                _admission_controller = AdmissionController(
+                    max_in_flight=ADMISSION_MAX_IN_FLIGHT or default_max_in_flight,
+                    max_queue=ADMISSION_MAX_QUEUE,
+                    max_queue_per_client=ADMISSION_MAX_QUEUE_PER_CLIENT,
+                    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                )
+    return _admission_controller
@@ -1,14 +1,88 @@
-from anthropic import Anthropic, APIError, APITimeoutError
+import asyncio
 import os
 import json
-import traceback
+import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Get API key from environment variable
-# Set your ANTHROPIC_API_KEY_MAUDE environment variable in your hosting platform
-API_KEY = os.environ.get("ANTHROPIC_API_KEY_MAUDE", "")
+from app.cache import AnalysisCache, create_analysis_cache
+from app.chunking import estimate_tokens, merge_analyses, split_into_chunks
+from app.client import API_KEY, RateLimitTimeout, get_api_client, get_async_api_client
+from app.hedging import get_hedger, stream_text, stream_text_async
+from app.metrics import ANALYSIS_ERRORS, MODEL_ROUTES, STAGE_SECONDS, timed_stage
+from app.rules import get_rule_engine
+from app.streaming import IncrementalJSONParser
 
-print(">>> API configuration loaded")
+# Model and prompt version are part of the analysis cache key; bump
+# PROMPT_VERSION whenever the prompt changes so stale results are not reused
+MODEL = os.environ.get("ANALYSIS_MODEL", "claude-3-7-sonnet-20250219")
+PROMPT_VERSION = "2"
+
+# Records estimated at up to FAST_MODEL_MAX_TOKENS tokens are analyzed with
+# the faster FAST_MODEL; 0 sends every record to MODEL
+FAST_MODEL = os.environ.get("ANALYSIS_FAST_MODEL", "claude-3-5-haiku-20241022")
+FAST_MODEL_MAX_TOKENS = int(os.environ.get("ANALYSIS_FAST_MODEL_MAX_TOKENS", 0))
+
+# Records estimated above TOKEN_BUDGET tokens are split into parts of at most
+# CHUNK_TOKENS, analyzed in parallel, and merged. At most MAX_CHUNKS parts are
+# analyzed, so a record never costs more than about MAX_CHUNKS / CHUNK_CONCURRENCY
+# rounds of calls however long it is
+TOKEN_BUDGET = int(os.environ.get("ANALYSIS_TOKEN_BUDGET", 30000))
+CHUNK_TOKENS = int(os.environ.get("ANALYSIS_CHUNK_TOKENS", 12000))
+MAX_CHUNKS = int(os.environ.get("ANALYSIS_MAX_CHUNKS", 16))
+CHUNK_CONCURRENCY = int(os.environ.get("ANALYSIS_CHUNK_CONCURRENCY", 8))
+
+# Static instructions and output schema, sent as a cacheable prefix ahead of
+# the patient data
+SYSTEM_PROMPT = """You are a medical diagnostic assistant that produces structured analysis in JSON format.
+
+Based on the patient data provided by the user, please identify potential diagnoses and recommend appropriate medications.
+Include reasoning for each diagnosis and medication.
+
+INSTRUCTIONS:
+1. Analyze the patient's symptoms, history, and any test results
+2. List potential diagnoses in order of likelihood
+3. For each diagnosis, provide recommended medications
+4. Include any warnings, contraindications, or further tests needed
+
+YOUR RESPONSE MUST BE VALID JSON WITH THIS EXACT STRUCTURE:
+{
+    "diagnoses": [
+        {
+            "condition": "Name of condition",
+            "likelihood": "High/Medium/Low",
+            "reasoning": "Reasoning based on patient data",
+            "medications": [
+                {
+                    "name": "Medication name",
+                    "dosage": "Recommended dosage",
+                    "frequency": "How often to take",
+                    "duration": "How long to take",
+                    "notes": "Any special instructions"
+                }
+            ],
+            "additional_tests": ["Test 1", "Test 2"]
+        }
+    ],
+    "warnings": ["Warning 1", "Warning 2"],
+    "disclaimer": "This analysis is not a substitute for professional medical advice."
+}"""
+
+logger = logging.getLogger(__name__)
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """Return the process-wide analysis cache, creating it on first use."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = create_analysis_cache()
+    return _analysis_cache
 
 class MedicalAnalyzer:
     """
@@ -20,7 +94,6 @@ class MedicalAnalyzer:
         """
         Initialize the MedicalAnalyzer with the predefined Anthropic API key. 
         """
-        print(">>> Initializing Anthropic client")
         self.client = None
         
         # Create client only if we have a valid API key
@@ -29,15 +102,13 @@ class MedicalAnalyzer:
                 # We'll create the client when needed for each request
                 # This avoids initialization issues
                 self.has_valid_key = True
-                print(">>> API key validated successfully")
-            except Exception as e:
-                print(f">>> ERROR with API key: {str(e)}")
-                traceback.print_exc()
+            except Exception:
+                logger.exception("Could not validate the API key")
                 # We'll continue without a client and use mock responses
                 self.has_valid_key = False
         else:
             self.has_valid_key = False
-            print(">>> No valid API key found, will use mock responses")
+            logger.debug("No valid API key found, will use mock responses")
     
     def analyze_patient_data(self, patient_data):
         """
@@ -48,10 +119,104 @@ class MedicalAnalyzer:
             
         Returns:
             str: JSON string containing diagnoses and medication recommendations
+            
+        Raises:
+            RateLimitTimeout: If the API rate limit would hold the analysis too
+                long; unlike other errors, this is not an error result, so
+                the caller can answer with a retryable error
+        """
+        return self._with_extraction_warnings(self._analyze(patient_data), patient_data)
+    
+    def _analyze(self, patient_data):
+        """Analyze patient data, leaving out warnings from its extraction."""
+        immediate = self._immediate_result(patient_data)
+        if immediate is not None:
+            return immediate
+        
+        estimated_tokens = estimate_tokens(patient_data)
+        logger.info("Analyzing patient data",
+                    extra={'chars': len(patient_data), 'estimated_tokens': estimated_tokens, 'token_budget': TOKEN_BUDGET})
+        
+        # Identical documents analyzed with the same model and prompt share a
+        # result; for a record analyzed in parts that is the merged result
+        model = self._route(estimated_tokens)
+        cache_key = AnalysisCache.make_key(patient_data, model, PROMPT_VERSION)
+        
+        try:
+            if estimated_tokens > TOKEN_BUDGET:
+                return get_analysis_cache().get_or_compute(cache_key, lambda: self._analyze_in_parts(patient_data))
+            return get_analysis_cache().get_or_compute(cache_key, lambda: self._call_api(patient_data, model))
+            
+        except RateLimitTimeout:
+            raise
+        except Exception as e:
+            logger.exception("Analysis failed")
+            return self._error_response(e)
+    
+    async def analyze_patient_data_async(self, patient_data):
+        """
+        The asyncio form of analyze_patient_data, for the ASGI entry point.
+        
+        Args:
+            patient_data (str): String containing patient medical information
+            
+        Returns:
+            str: JSON string containing diagnoses and medication recommendations
+        """
+        return self._with_extraction_warnings(await self._analyze_async(patient_data), patient_data)
+    
+    async def _analyze_async(self, patient_data):
+        """The asyncio form of _analyze."""
+        immediate = self._immediate_result(patient_data)
+        if immediate is not None:
+            return immediate
+        
+        estimated_tokens = estimate_tokens(patient_data)
+        logger.info("Analyzing patient data",
+                    extra={'chars': len(patient_data), 'estimated_tokens': estimated_tokens, 'token_budget': TOKEN_BUDGET})
+        model = self._route(estimated_tokens)
+        cache_key = AnalysisCache.make_key(patient_data, model, PROMPT_VERSION)
+        
+        try:
+            if estimated_tokens > TOKEN_BUDGET:
+                return await get_analysis_cache().get_or_compute_async(
+                    cache_key, lambda: self._analyze_in_parts_async(patient_data))
+            return await get_analysis_cache().get_or_compute_async(
+                cache_key, lambda: self._call_api_async(patient_data, model))
+            
+        except RateLimitTimeout:
+            raise
+        except Exception as e:
+            logger.exception("Analysis failed")
+            return self._error_response(e)
+    
+    def _with_extraction_warnings(self, analysis, patient_data):
+        """
+        Add the warnings raised while extracting patient_data, such as truncation, to a JSON analysis.
+        
+        The warnings are added after the analysis is cached, since the same
+        text can be extracted from documents that were truncated or not.
+        """
+        warnings = getattr(patient_data, 'warnings', ())
+        if not warnings:
+            return analysis
+        try:
+            result = json.loads(analysis)
+        except ValueError:
+            return analysis
+        existing = result.setdefault("warnings", [])
+        existing.extend(warning for warning in warnings if warning not in existing)
+        return json.dumps(result)
+    
+    def _immediate_result(self, patient_data):
+        """
+        Return the result for input that needs no API call, or None.
+        
+        Empty input gets an error result; without a valid API key the mock
+        analysis is returned.
         """
-        print(">>> Starting patient data analysis")
         if not patient_data or len(patient_data.strip()) == 0:
-            print(">>> ERROR: Empty patient data")
+            logger.warning("Empty patient data")
             return json.dumps({
                 "error": "Empty patient data provided",
                 "diagnoses": [],
@@ -59,238 +224,420 @@ class MedicalAnalyzer:
                 "disclaimer": "This analysis could not be completed due to missing data."
             })
         
-        print(f">>> Patient data length: {len(patient_data)}")
-        
         # Check if we have a valid API key
         if not self.has_valid_key or API_KEY == "your_api_key_here" or not API_KEY:
-            print(">>> WARNING: No valid API key or client found! Using mock response.")
+            logger.warning("No valid API key found; returning a mock response")
             # Return a mock response for testing purposes
             return self._generate_mock_response(patient_data)
+        return None
+    
+    def stream_patient_data(self, patient_data):
+        """
+        Analyze patient data, yielding each diagnosis as soon as it is complete.
         
-        # Prepare prompt for Claude
-        system_prompt = "You are a medical diagnostic assistant that produces structured analysis in JSON format."
-        
-        user_prompt = f"""
-        Based on the following patient data, please identify potential diagnoses and recommend appropriate medications. 
-        Include reasoning for each diagnosis and medication.
-        
-        PATIENT DATA:
-        {patient_data}
-        
-        INSTRUCTIONS:
-        1. Analyze the patient's symptoms, history, and any test results
-        2. List potential diagnoses in order of likelihood
-        3. For each diagnosis, provide recommended medications
-        4. Include any warnings, contraindications, or further tests needed
-        
-        YOUR RESPONSE MUST BE VALID JSON WITH THIS EXACT STRUCTURE:
-        {{
-            "diagnoses": [
-                {{
-                    "condition": "Name of condition",
-                    "likelihood": "High/Medium/Low",
-                    "reasoning": "Reasoning based on patient data",
-                    "medications": [
-                        {{
-                            "name": "Medication name",
-                            "dosage": "Recommended dosage",
-                            "frequency": "How often to take",
-                            "duration": "How long to take",
-                            "notes": "Any special instructions"
-                        }}
-                    ],
-                    "additional_tests": ["Test 1", "Test 2"]
-                }}
-            ],
-            "warnings": ["Warning 1", "Warning 2"],
-            "disclaimer": "This analysis is not a substitute for professional medical advice."
-        }}
+        Args:
+            patient_data (str): String containing patient medical information
+            
+        Yields:
+            tuple: ("diagnosis", dict) for every diagnosis as it arrives, then
+                ("complete", str) with the full JSON analysis, exactly as
+                analyze_patient_data would have returned it
         """
+        for event, payload in self._stream(patient_data):
+            if event == "complete":
+                payload = self._with_extraction_warnings(payload, patient_data)
+            yield event, payload
+    
+    def _stream(self, patient_data):
+        """Stream the analysis of patient data, leaving out warnings from its extraction."""
+        if (not patient_data or len(patient_data.strip()) == 0 or not self.has_valid_key or not API_KEY
+                or estimate_tokens(patient_data) > TOKEN_BUDGET):
+            # Empty input, mock mode, and records analyzed in parts have
+            # nothing to stream incrementally
+            analysis = self._analyze(patient_data)
+            yield from self._replay(analysis)
+            return
+        
+        model = self._route(estimate_tokens(patient_data))
+        cache_key = AnalysisCache.make_key(patient_data, model, PROMPT_VERSION)
+        cache = get_analysis_cache()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Streaming cached analysis")
+            yield from self._replay(cached)
+            return
+        
+        with timed_stage('prompt_build'):
+            system_blocks, user_prompt = self._build_prompts(patient_data)
+        parser = IncrementalJSONParser('diagnoses')
+        chunks = []
+        emitted = 0
         
-        # Call the Anthropic API
         try:
-            print(">>> Making API call to Anthropic...")
+            start_time = time.perf_counter()
             
-            # Add retries for API call robustness
-            max_retries = 3
-            retry_delay = 2  # seconds
+            # Opening the stream is retried by the client; once diagnoses have
+            # been sent to the browser they cannot be retracted, so errors
+            # after that point end the analysis
+            MODEL_ROUTES.inc(model=model)
+            message_args = self._message_args(model, system_blocks, user_prompt)
+            for text in stream_text(get_api_client(), get_hedger(), **message_args):
+                chunks.append(text)
+                for diagnosis in parser.feed(text):
+                    if emitted == 0:
+                        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage='first_diagnosis')
+                    emitted += 1
+                    yield "diagnosis", diagnosis
             
-            for attempt in range(max_retries):
-                try:
-                    print(f">>> API call attempt {attempt + 1} of {max_retries}")
-                    start_time = time.time()
-                    
-                    # Use the standard Anthropic client
-                    import anthropic
-                    
-                    # Create a fresh client for each request without extra parameters
-                    # Using only the API key to avoid 'proxies' error
-                    client = anthropic.Anthropic(api_key=API_KEY)
-                    
-                    response = client.messages.create(
-                        model="claude-3-7-sonnet-20250219",
-                        max_tokens=4000,
-                        system=system_prompt,
-                        messages=[
-                            {"role": "user", "content": user_prompt}
-                        ]
-                    )
-                    
-                    print(f">>> API call completed in {time.time() - start_time:.2f} seconds")
-                    break  # Success - exit retry loop
-                    
-                except (APIError, APITimeoutError) as api_err:
-                    print(f">>> API error on attempt {attempt + 1}: {str(api_err)}")
-                    if attempt < max_retries - 1:
-                        print(f">>> Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                    else:
-                        raise  # Re-raise on last attempt
+            api_seconds = time.perf_counter() - start_time
+            STAGE_SECONDS.observe(api_seconds, stage='api')
+            logger.info("Streaming API call completed", extra={'seconds': round(api_seconds, 3), 'diagnoses': emitted})
             
-            # Extract the content from the response
-            try:
-                print(">>> Extracting content from response")
-                # Access Anthropic API response correctly
-                analysis = response.content[0].text if isinstance(response.content, list) else response.content
-                print(f">>> Content extracted, length: {len(analysis)}")
-                
-                # Try to clean up any potential issues with the JSON
-                analysis = analysis.strip()
-                if analysis.startswith('```json'):
-                    print(">>> Detected code block format, cleaning up")
-                    analysis = analysis.replace('```json', '', 1)
-                    if analysis.endswith('```'):
-                        analysis = analysis[:-3]
-                    analysis = analysis.strip()
-                
-                # Validate that the response is valid JSON
-                print(">>> Validating JSON format")
-                json_data = json.loads(analysis)
-                print(">>> JSON validation successful")
-                return analysis
-                
-            except (KeyError, AttributeError) as err:
-                print(f">>> Error accessing response content: {str(err)}")
-                traceback.print_exc()
-                raise Exception(f"Error processing API response: {str(err)}")
+            with timed_stage('parse'):
+                analysis = self._clean_analysis(''.join(chunks))
+                json.loads(analysis)
+            cache.set(cache_key, analysis)
+            yield "complete", analysis
             
         except Exception as e:
-            print(f">>> ERROR during API call: {str(e)}")
-            traceback.print_exc()
+            logger.exception("Streaming analysis failed")
+            yield "complete", self._error_response(e)
+    
+    async def stream_patient_data_async(self, patient_data):
+        """
+        The asyncio form of stream_patient_data, for the ASGI entry point.
+        
+        Args:
+            patient_data (str): String containing patient medical information
             
-            # Create a clean error response
-            error_response = {
-                "error": str(e),
-                "diagnoses": [],
-                "warnings": ["An error occurred during analysis"],
-                "disclaimer": "This system encountered an error and could not complete the analysis."
-            }
+        Yields:
+            tuple: ("diagnosis", dict) for every diagnosis as it arrives, then
+                ("complete", str) with the full JSON analysis
+        """
+        async for event, payload in self._stream_async(patient_data):
+            if event == "complete":
+                payload = self._with_extraction_warnings(payload, patient_data)
+            yield event, payload
+    
+    async def _stream_async(self, patient_data):
+        """The asyncio form of _stream."""
+        if (not patient_data or len(patient_data.strip()) == 0 or not self.has_valid_key or not API_KEY
+                or estimate_tokens(patient_data) > TOKEN_BUDGET):
+            for item in self._replay(await self._analyze_async(patient_data)):
+                yield item
+            return
+        
+        model = self._route(estimate_tokens(patient_data))
+        cache_key = AnalysisCache.make_key(patient_data, model, PROMPT_VERSION)
+        cache = get_analysis_cache()
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            for item in self._replay(cached):
+                yield item
+            return
+        
+        with timed_stage('prompt_build'):
+            system_blocks, user_prompt = self._build_prompts(patient_data)
+        parser = IncrementalJSONParser('diagnoses')
+        chunks = []
+        emitted = 0
+        
+        try:
+            start_time = time.perf_counter()
+            MODEL_ROUTES.inc(model=model)
+            message_args = self._message_args(model, system_blocks, user_prompt)
+            async for text in stream_text_async(get_async_api_client(), get_hedger(), **message_args):
+                chunks.append(text)
+                for diagnosis in parser.feed(text):
+                    if emitted == 0:
+                        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage='first_diagnosis')
+                    emitted += 1
+                    yield "diagnosis", diagnosis
             
-            try:
-                return json.dumps(error_response)
-            except Exception as json_err:
-                print(f">>> ERROR creating error JSON: {str(json_err)}")
-                # Last resort fallback
-                return json.dumps({
-                    "error": "Multiple errors occurred",
-                    "diagnoses": [],
-                    "warnings": ["Critical system error"],
-                    "disclaimer": "System failure"
-                })
+            api_seconds = time.perf_counter() - start_time
+            STAGE_SECONDS.observe(api_seconds, stage='api')
+            logger.info("Streaming API call completed", extra={'seconds': round(api_seconds, 3), 'diagnoses': emitted})
+            
+            with timed_stage('parse'):
+                analysis = self._clean_analysis(''.join(chunks))
+                json.loads(analysis)
+            await asyncio.to_thread(cache.set, cache_key, analysis)
+            yield "complete", analysis
+            
+        except Exception as e:
+            logger.exception("Streaming analysis failed")
+            yield "complete", self._error_response(e)
     
-    def _generate_mock_response(self, patient_data):
+    def _analyze_in_parts(self, patient_data):
         """
-        Generate a mock response for testing when no valid API key is available.
+        Analyze a record too long for one call by splitting it into parts.
+        
+        Parts are analyzed in parallel and their findings merged into a
+        single result. Each part is cached on its own, so retrying a record
+        after a partial failure only repeats the parts that failed.
         
         Args:
-            patient_data (str): The patient data that was submitted
+            patient_data (str): String containing patient medical information
             
         Returns:
-            str: A JSON string with mock analysis results
+            str: JSON string containing the merged diagnoses and warnings
+            
+        Raises:
+            Exception: If the analysis of any part fails
+        """
+        chunks, total = self._split_record(patient_data)
+        cache = get_analysis_cache()
+        
+        def analyze_part(chunk):
+            model = self._route(estimate_tokens(chunk))
+            key = AnalysisCache.make_key(chunk, model, f"{PROMPT_VERSION}-part")
+            return cache.get_or_compute(key, lambda: self._call_api(chunk, model, part=True))
+        
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(CHUNK_CONCURRENCY, len(chunks))) as executor:
+            analyses = list(executor.map(analyze_part, chunks))
+        logger.info("All parts analyzed", extra={'seconds': round(time.perf_counter() - start_time, 3)})
+        return self._merge_parts(analyses, total)
+    
+    async def _analyze_in_parts_async(self, patient_data):
+        """The asyncio form of _analyze_in_parts."""
+        chunks, total = self._split_record(patient_data)
+        cache = get_analysis_cache()
+        slots = asyncio.Semaphore(CHUNK_CONCURRENCY)
+        
+        async def analyze_part(chunk):
+            model = self._route(estimate_tokens(chunk))
+            key = AnalysisCache.make_key(chunk, model, f"{PROMPT_VERSION}-part")
+            async with slots:
+                return await cache.get_or_compute_async(key, lambda: self._call_api_async(chunk, model, part=True))
+        
+        start_time = time.perf_counter()
+        analyses = await asyncio.gather(*(analyze_part(chunk) for chunk in chunks))
+        logger.info("All parts analyzed", extra={'seconds': round(time.perf_counter() - start_time, 3)})
+        return self._merge_parts(analyses, total)
+    
+    def _split_record(self, patient_data):
         """
-        print(">>> Generating mock response for testing")
+        Split a long record into at most MAX_CHUNKS parts.
         
-        # Extract some basic data from the patient info to make the mock response somewhat relevant
-        patient_data_lower = patient_data.lower()
-        has_fever = "fever" in patient_data_lower or "temperature" in patient_data_lower
-        has_headache = "headache" in patient_data_lower
-        has_cough = "cough" in patient_data_lower
-        has_sore_throat = "sore throat" in patient_data_lower or "throat pain" in patient_data_lower
-        has_fatigue = "fatigue" in patient_data_lower or "tired" in patient_data_lower
+        Returns:
+            tuple: (parts to analyze, total number of parts the record needed)
+        """
+        chunks = split_into_chunks(patient_data, CHUNK_TOKENS)
+        if len(chunks) > MAX_CHUNKS:
+            # Use fewer, larger parts, up to what a single call may take
+            chunk_tokens = min(TOKEN_BUDGET, -(-estimate_tokens(patient_data) // MAX_CHUNKS))
+            chunks = split_into_chunks(patient_data, chunk_tokens)
+        total = len(chunks)
+        logger.info("Record over token budget, analyzing in parts",
+                    extra={'parts': min(total, MAX_CHUNKS), 'total_parts': total})
+        return chunks[:MAX_CHUNKS], total
+    
+    def _merge_parts(self, analyses, total):
+        """Merge the JSON analyses of a record's parts, noting any parts left out."""
+        merged = merge_analyses([json.loads(analysis) for analysis in analyses])
+        if total > len(analyses):
+            merged["warnings"].append(
+                f"The record was too long to analyze in full; only the first {len(analyses)} of {total} parts were analyzed."
+            )
+        return json.dumps(merged)
+    
+    def _replay(self, analysis):
+        """Yield the diagnoses of a finished analysis in streaming form."""
+        try:
+            diagnoses = json.loads(analysis).get("diagnoses", [])
+        except (ValueError, AttributeError):
+            diagnoses = []
+        for diagnosis in diagnoses:
+            yield "diagnosis", diagnosis
+        yield "complete", analysis
+    
+    def _error_response(self, error):
+        """
+        Build the JSON error result returned when an analysis fails.
+        
+        Args:
+            error (Exception): The error that stopped the analysis
+            
+        Returns:
+            str: JSON string with an empty diagnoses list and the error message
+        """
+        ANALYSIS_ERRORS.inc(error=type(error).__name__)
         
-        # Build the mock response based on symptoms found
-        mock_response = {
+        # Create a clean error response
+        error_response = {
+            "error": str(error),
             "diagnoses": [],
-            "warnings": ["This is a mock response for testing only. No actual medical analysis was performed."],
-            "disclaimer": "This analysis is not a substitute for professional medical advice. API key was not provided or invalid."
+            "warnings": ["An error occurred during analysis"],
+            "disclaimer": "This system encountered an error and could not complete the analysis."
         }
         
-        # Add potential diagnoses based on symptoms
-        if has_fever and (has_cough or has_sore_throat):
-            mock_response["diagnoses"].append({
-                "condition": "Common Cold or Upper Respiratory Infection",
-                "likelihood": "High",
-                "reasoning": "Patient reports symptoms consistent with viral upper respiratory infection including fever and respiratory symptoms.",
-                "medications": [
-                    {
-                        "name": "Acetaminophen (Tylenol)",
-                        "dosage": "500-1000 mg",
-                        "frequency": "Every 6 hours as needed",
-                        "duration": "Until symptoms resolve",
-                        "notes": "For fever and pain relief. Do not exceed 4000 mg per day."
-                    },
-                    {
-                        "name": "Guaifenesin (Mucinex)",
-                        "dosage": "400 mg",
-                        "frequency": "Every 12 hours as needed",
-                        "duration": "Until symptoms resolve",
-                        "notes": "To help thin mucus secretions. Drink plenty of fluids."
-                    }
-                ],
-                "additional_tests": ["If symptoms worsen or persist beyond 7 days, consider COVID-19 testing"]
+        try:
+            return json.dumps(error_response)
+        except Exception as json_err:
+            logger.error("Could not serialize the error response", extra={'error': str(json_err)})
+            # Last resort fallback
+            return json.dumps({
+                "error": "Multiple errors occurred",
+                "diagnoses": [],
+                "warnings": ["Critical system error"],
+                "disclaimer": "System failure"
             })
+    
+    def _call_api(self, patient_data, model, part=False):
+        """
+        Send patient data to Claude and return the validated JSON analysis.
         
-        if has_headache and has_fatigue:
-            mock_response["diagnoses"].append({
-                "condition": "Tension Headache",
-                "likelihood": "Medium",
-                "reasoning": "Patient reports headache with fatigue, consistent with tension headache possibly due to stress or dehydration.",
-                "medications": [
-                    {
-                        "name": "Ibuprofen (Advil, Motrin)",
-                        "dosage": "400-600 mg",
-                        "frequency": "Every 6-8 hours as needed",
-                        "duration": "Until symptoms resolve",
-                        "notes": "Take with food to minimize gastrointestinal side effects."
-                    }
-                ],
-                "additional_tests": ["If headaches are recurrent or worsening, consider neurological evaluation"]
-            })
+        Args:
+            patient_data (str): String containing patient medical information
+            model (str): Model to analyze with, as chosen by _route
+            part (bool): Whether patient_data is one part of a longer record
+            
+        Returns:
+            str: JSON string containing diagnoses and medication recommendations
+            
+        Raises:
+            Exception: If the API call fails or the response is not valid JSON
+        """
+        with timed_stage('prompt_build'):
+            system_blocks, user_prompt = self._build_prompts(patient_data, part)
+        message_args = self._message_args(model, system_blocks, user_prompt)
+        MODEL_ROUTES.inc(model=model)
         
-        # If no specific symptoms were found, add a generic response
-        if len(mock_response["diagnoses"]) == 0:
-            mock_response["diagnoses"].append({
-                "condition": "Nonspecific Symptoms",
-                "likelihood": "Medium",
-                "reasoning": "Based on the limited information provided, a specific diagnosis cannot be determined with certainty.",
-                "medications": [
-                    {
-                        "name": "Supportive care",
-                        "dosage": "N/A",
-                        "frequency": "As needed",
-                        "duration": "Until symptoms resolve",
-                        "notes": "Rest, hydration, and monitoring of symptoms"
-                    }
-                ],
-                "additional_tests": [
-                    "Complete blood count (CBC)",
-                    "Basic metabolic panel (BMP)",
-                    "Follow up with primary care physician for further evaluation"
-                ]
-            })
+        # Call the Anthropic API. The shared client pools connections and
+        # handles rate limiting, retries with backoff, and circuit breaking
+        start_time = time.perf_counter()
+        with timed_stage('api'):
+            if get_hedger().enabled:
+                # Hedging is decided by the time to the first token, so the call is streamed
+                analysis = ''.join(stream_text(get_api_client(), get_hedger(), **message_args))
+            else:
+                analysis = self._response_text(get_api_client().create_message(**message_args))
+        logger.info("API call completed", extra={'model': model, 'seconds': round(time.perf_counter() - start_time, 3)})
+        return self._validate_analysis(analysis)
+    
+    async def _call_api_async(self, patient_data, model, part=False):
+        """The asyncio form of _call_api."""
+        with timed_stage('prompt_build'):
+            system_blocks, user_prompt = self._build_prompts(patient_data, part)
+        message_args = self._message_args(model, system_blocks, user_prompt)
+        MODEL_ROUTES.inc(model=model)
         
-        # Add a development mode warning
-        mock_response["warnings"].append("Development mode active: No API key provided or using test mode.")
+        start_time = time.perf_counter()
+        with timed_stage('api'):
+            if get_hedger().enabled:
+                chunks = [text async for text in stream_text_async(get_async_api_client(), get_hedger(), **message_args)]
+                analysis = ''.join(chunks)
+            else:
+                analysis = self._response_text(await get_async_api_client().create_message(**message_args))
+        logger.info("API call completed", extra={'model': model, 'seconds': round(time.perf_counter() - start_time, 3)})
+        return self._validate_analysis(analysis)
+    
+    @staticmethod
+    def _response_text(response):
+        """
+        Return the text content of an API response.
         
-        return json.dumps(mock_response)
\ No newline at end of file
+        Raises:
+            Exception: If the response has no text content
+        """
+        # Extract the content from the response
+        try:
+            # Access Anthropic API response correctly
+            return response.content[0].text if isinstance(response.content, list) else response.content
+            
+        except (KeyError, AttributeError) as err:
+            logger.exception("Could not read the API response content")
+            raise Exception(f"Error processing API response: {str(err)}")
+    
+    def _validate_analysis(self, analysis):
+        """
+        Return the cleaned model output as a validated JSON analysis.
+        
+        Raises:
+            Exception: If the output is not valid JSON
+        """
+        with timed_stage('parse'):
+            analysis = self._clean_analysis(analysis)
+            
+            # Validate that the response is valid JSON
+            json.loads(analysis)
+        return analysis
+    
+    @staticmethod
+    def _route(estimated_tokens):
+        """
+        Return the model to analyze a record of estimated_tokens tokens with.
+        
+        Short records go to FAST_MODEL when routing is configured; everything
+        else goes to MODEL.
+        """
+        if 0 < estimated_tokens <= FAST_MODEL_MAX_TOKENS:
+            return FAST_MODEL
+        return MODEL
+    
+    @staticmethod
+    def _message_args(model, system_blocks, user_prompt):
+        """Return the messages.create arguments for an analysis."""
+        return {
+            "model": model,
+            "max_tokens": 4000,
+            "system": system_blocks,
+            "messages": [
+                {"role": "user", "content": user_prompt}
+            ]
+        }
+    
+    def _build_prompts(self, patient_data, part=False):
+        """
+        Build the system and user prompts for a patient data analysis.
+        
+        The instructions and JSON schema never change, so they form a system
+        prompt marked for provider-side prompt caching; the patient data is
+        the only part that varies between requests.
+        
+        Args:
+            patient_data (str): String containing patient medical information
+            part (bool): Whether patient_data is one part of a longer record
+            
+        Returns:
+            tuple: (system_blocks, user_prompt)
+        """
+        system_blocks = [
+            {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+        ]
+        if part:
+            # The shared system prompt stays identical so parts reuse the prompt cache
+            user_prompt = ("PATIENT DATA (one part of a longer record; report only findings "
+                           f"supported by this part):\n{patient_data}")
+        else:
+            user_prompt = f"PATIENT DATA:\n{patient_data}"
+        return system_blocks, user_prompt
+    
+    @staticmethod
+    def _clean_analysis(analysis):
+        """Strip whitespace and a surrounding ```json code fence from model output."""
+        # Try to clean up any potential issues with the JSON
+        analysis = analysis.strip()
+        if analysis.startswith('```json'):
+            analysis = analysis.replace('```json', '', 1)
+            if analysis.endswith('```'):
+                analysis = analysis[:-3]
+            analysis = analysis.strip()
+        return analysis
+    
+    def _generate_mock_response(self, patient_data):
+        """
+        Generate a mock response for testing when no valid API key is available.
+        
+        The response comes from the offline rule engine (see app.rules),
+        which scans the record once against the symptom and rule tables.
+        
+        Args:
+            patient_data (str): The patient data that was submitted
+            
+        Returns:
+            str: A JSON string with mock analysis results
+        """
+        logger.debug("Generating mock response for testing")
+        return get_rule_engine().analyze(patient_data)
\ No newline at end of file
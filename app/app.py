@@ -1,128 +1,568 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
+import functools
 import os
+import re
 import json
+import logging
 from werkzeug.utils import secure_filename
 import secrets
+import shutil
+import tempfile
+import time
 
+from app.admission import ADMISSION_CLIENT_HEADER, Overloaded, client_key, get_admission_controller
 from app.file_processor import FileProcessor
-from app.analyzer import MedicalAnalyzer
+from app.analyzer import MedicalAnalyzer, get_analysis_cache
+from app.cache import LRUCache
+from app.result_store import get_result_store
+from app.history import get_analysis_history, record_analysis
+from app.streaming import sse_event
+from app.jobs import JobQueueFull, get_job_queue
+from app.batch import BatchAnalyzer, expand_zip, failed_entry
+from app.uploads import InvalidUpload, SpooledRequest, detach_upload
+from app.usage import get_usage_tracker
+from app.client import MAX_CONCURRENCY, RateLimitTimeout, get_api_client_stats
+from app.log import configure_logging
+from app.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, REGISTRY, StageTimer, timed_stage
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
+app.request_class = SpooledRequest
 app.secret_key = secrets.token_hex(16)
 app.config['UPLOAD_FOLDER'] = '/tmp/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+# Uploads up to this size never touch the filesystem
+app.config['UPLOAD_MEMORY_LIMIT'] = int(os.environ.get('UPLOAD_MEMORY_LIMIT', 4 * 1024 * 1024))
+# How the browser submits uploads: "stream" (Server-Sent Events), "job"
+# (queued, polled via /jobs/<id>) or "sync"
+app.config['ANALYZE_MODE'] = os.environ.get('ANALYZE_MODE', 'stream')
 
 # Create uploads directory in /tmp (works on serverless)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Batch uploads: simultaneous LLM calls and documents accepted per request
+app.config['BATCH_CONCURRENCY'] = int(os.environ.get('BATCH_CONCURRENCY', 4))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 50))
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
 
+# Extracted text of recent uploads by content hash, so re-uploads skip parsing
+extraction_cache = LRUCache(int(os.environ.get('EXTRACTION_CACHE_SIZE', 32)))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/analyze', methods=['POST'])
-def analyze():
-    print(">>> ANALYZE ENDPOINT CALLED")
+def get_upload():
+    """
+    Validate the uploaded file of the current request.
+    
+    Returns:
+        tuple: (file, None) on success, or (None, error_response) otherwise
+    """
+    # The first access to request.files receives, validates and spools the
+    # upload; a file that does not match its type stops it at the first chunk
+    try:
+        with timed_stage('upload'):
+            files = request.files
+    except InvalidUpload as e:
+        logger.info("Rejected upload: invalid contents", extra={'reason': str(e)})
+        return None, (jsonify({'error': str(e)}), 400)
+    
     # Check if a file was uploaded
-    if 'file' not in request.files:
-        print(">>> ERROR: No file part in request")
-        return jsonify({'error': 'No file part'}), 400
+    if 'file' not in files:
+        logger.info("Rejected upload: no file part")
+        return None, (jsonify({'error': 'No file part'}), 400)
     
-    file = request.files['file']
-    print(f">>> Received file: {file.filename}")
+    file = files['file']
     
     if file.filename == '':
-        print(">>> ERROR: Empty filename")
-        return jsonify({'error': 'No selected file'}), 400
+        logger.info("Rejected upload: empty filename")
+        return None, (jsonify({'error': 'No selected file'}), 400)
     
     if not allowed_file(file.filename):
-        print(f">>> ERROR: File type not allowed: {file.filename}")
-        return jsonify({'error': f'File type not allowed. Allowed types are: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
-    
-    # Save the uploaded file
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    print(f">>> Saving file to: {file_path}")
-    file.save(file_path)
+        logger.info("Rejected upload: file type not allowed", extra={'extension': os.path.splitext(file.filename)[1]})
+        return None, (jsonify({'error': f'File type not allowed. Allowed types are: {", ".join(ALLOWED_EXTENSIONS)}'}), 400)
     
     try:
-        # Process the file to extract patient data
-        print(">>> Processing file to extract text")
-        patient_data = FileProcessor.process_file(file_path)
-        print(f">>> Extracted text of length: {len(patient_data)}")
-        print(f">>> Sample of text: {patient_data[:100]}...")
+        file.stream.verify()
+    except InvalidUpload as e:
+        logger.info("Rejected upload: invalid contents", extra={'reason': str(e)})
+        return None, (jsonify({'error': str(e)}), 400)
+    
+    return file, None
+
+def extract_text(source, filename, digest):
+    """
+    Extract the text of an upload, reusing the text of an identical earlier upload.
+    
+    Args:
+        source: Upload contents as a stream, bytes, or path
+        filename (str): Name of the uploaded file
+        digest (str): SHA-256 of the contents, computed while they were received
+    
+    Returns:
+        str: The extracted text
+    """
+    key = f"{digest}:{os.path.splitext(filename)[1].lower()}"
+    patient_data = extraction_cache.get(key)
+    if patient_data is None:
+        patient_data = FileProcessor.process_file(source, filename=filename)
+        extraction_cache.set(key, patient_data)
+    else:
+        logger.info("Reused extracted text of an identical upload")
+    return patient_data
+
+def history_owner():
+    """Return the key the current session's analyses are recorded under in the history, assigning one if needed."""
+    owner = session.get('history_owner')
+    if owner is None:
+        owner = session['history_owner'] = secrets.token_urlsafe(16)
+    return owner
+
+def overloaded_response(error):
+    """Return the 429 response for a request turned away by the admission controller or the API rate limit."""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admission_controlled(view):
+    """
+    Run an analysis view only once the admission controller has a slot for it.
+    
+    A request that cannot be queued gets an immediate 429 with Retry-After,
+    before its upload is read. The slot is held until the response has been
+    sent, including the whole of a streamed response. A batch holds one
+    slot while its own BATCH_CONCURRENCY analyses run. Job submissions
+    bypass the controller on purpose: they return at once, and the job
+    queue's max_pending bounds them while its workers bound the analyses.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get('mode') == 'job':
+            return view(*args, **kwargs)
         
-        # Analyze the patient data
-        print(">>> Initializing MedicalAnalyzer")
-        analyzer = MedicalAnalyzer()
-        print(">>> Calling analyze_patient_data")
-        analysis_result = analyzer.analyze_patient_data(patient_data)
-        print(f">>> Analysis complete. Result length: {len(analysis_result)}")
-        print(f">>> Sample of result: {analysis_result[:100]}...")
+        try:
+            ticket = get_admission_controller(MAX_CONCURRENCY).admit(admission_client())
+        except Overloaded as e:
+            logger.info("Rejected request: server busy", extra={'retry_after': e.retry_after})
+            return overloaded_response(e)
         
-        # Clean up - remove the uploaded file after processing
-        print(">>> Removing uploaded file")
-        os.remove(file_path)
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            ticket.release()
+            raise
+        return release_when_sent(response, ticket)
+    return wrapper
+
+def admission_client():
+    """Return the key the admission controller queues the current request under."""
+    forwarded = request.headers.get(ADMISSION_CLIENT_HEADER) if ADMISSION_CLIENT_HEADER else None
+    return client_key(forwarded, request.remote_addr)
+
+def release_when_sent(response, ticket):
+    """Release an admission ticket once response has been sent, which for a streamed response is when it closes."""
+    if response.is_streamed:
+        response.call_on_close(ticket.release)
+    else:
+        ticket.release()
+    return response
+
+@app.before_request
+def start_request():
+    g.request_id = request.headers.get('X-Request-ID') or secrets.token_hex(8)
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def finish_request(response):
+    """Count and time every request, and log one line per request."""
+    seconds = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    HTTP_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    logger.info("Request handled", extra={
+        'method': request.method, 'endpoint': endpoint, 'status': response.status_code, 'seconds': round(seconds, 4)})
+    return response
+
+@app.route('/')
+def index():
+    return render_template('index.html', analyze_mode=app.config['ANALYZE_MODE'])
+
+@app.route('/analyze', methods=['POST'])
+@admission_controlled
+def analyze():
+    # Per-stage durations, reported in the Server-Timing response header
+    timer = StageTimer()
+    with timer.activate():
+        file, error_response = get_upload()
+        if error_response:
+            return error_response
         
-        # Store the result in session for the results page
-        print(">>> Storing result in session")
-        session['analysis_result'] = analysis_result
+        if request.args.get('mode') == 'job':
+            return enqueue_analysis(file)
         
-        # Return the analysis result
-        print(">>> Preparing JSON response")
         try:
-            parsed_result = json.loads(analysis_result)
-            print(">>> JSON parsed successfully")
-            return jsonify({'success': True, 'result': parsed_result})
-        except json.JSONDecodeError as json_err:
-            print(f">>> ERROR parsing JSON: {str(json_err)}")
-            return jsonify({'error': f'Error parsing analysis result: {str(json_err)}'}), 500
-    
-    except Exception as e:
-        print(f">>> EXCEPTION in analyze endpoint: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        # Clean up in case of error
-        if os.path.exists(file_path):
-            print(">>> Cleaning up file after error")
-            os.remove(file_path)
-        return jsonify({'error': str(e)}), 500
+            # Process the upload straight from the request stream
+            with timed_stage('extract'):
+                patient_data = extract_text(file.stream, file.filename, file.stream.sha256)
+            logger.info("Extracted text", extra={'chars': len(patient_data)})
+            
+            # Analyze the patient data
+            with timed_stage('analyze'):
+                analysis_result = MedicalAnalyzer().analyze_patient_data(patient_data)
+            
+            # Store the result server-side; the session only carries its id
+            with timed_stage('store'):
+                result_id = get_result_store().save(analysis_result)
+                record_analysis(result_id, analysis_result, patient_data, history_owner(), file.filename)
+            session['result_id'] = result_id
+            
+            # Return the analysis result
+            try:
+                with timed_stage('parse'):
+                    parsed_result = json.loads(analysis_result)
+                with timed_stage('render'):
+                    response = jsonify({
+                        'success': True,
+                        'result': parsed_result,
+                        'result_id': result_id,
+                        'results_url': url_for('result_by_id', result_id=result_id)
+                    })
+                response.headers['Server-Timing'] = timer.server_timing()
+                return response
+            except json.JSONDecodeError as json_err:
+                logger.error("Analysis result is not valid JSON", extra={'error': str(json_err)})
+                return jsonify({'error': f'Error parsing analysis result: {str(json_err)}'}), 500
+        
+        except RateLimitTimeout as e:
+            return overloaded_response(e)
+        except Exception as e:
+            logger.exception("Analysis request failed")
+            return jsonify({'error': str(e)}), 500
+
+def enqueue_analysis(file):
+    """Queue an upload on the job queue and return its job id right away."""
+    # Queued uploads outlive this request's stream
+    result_store = get_result_store()
+    result_id = result_store.new_id()
+    with timed_stage('upload_save'):
+        source = detach_upload(file.stream, secure_filename(file.filename),
+                               app.config['UPLOAD_FOLDER'], app.config['UPLOAD_MEMORY_LIMIT'])
+    
+    try:
+        job = get_job_queue().submit(source, file.filename, result_id, history_owner())
+    except JobQueueFull as e:
+        if isinstance(source, str):
+            os.remove(source)
+        return jsonify({'error': str(e)}), 503
+    
+    session['result_id'] = result_id
+    logger.info("Queued analysis job", extra={'job_id': job.id})
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Report the state of a queued analysis.
+    
+    With ?wait=<seconds> the request long-polls until the job finishes or
+    the wait (capped at 30 seconds) runs out.
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    wait = min(request.args.get('wait', 0, type=float), 30)
+    if wait > 0:
+        job.finished.wait(wait)
+    
+    status = job.to_dict()
+    if status['result_id']:
+        status['results_url'] = url_for('result_by_id', result_id=status['result_id'])
+    return jsonify(status)
+
+@app.route('/analyze/batch', methods=['POST'])
+@admission_controlled
+def analyze_batch():
+    """
+    Analyze several uploaded files, or the documents inside ZIP archives.
+    
+    Results are returned per file, with failures isolated to their own entry.
+    With ?format=ndjson (or an Accept: application/x-ndjson header) each
+    result is streamed as one JSON line as soon as it finishes.
+    """
+    # Invalid files are reported in their own entry rather than failing the batch
+    request.reject_invalid_uploads = False
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    batch_dir = tempfile.mkdtemp(prefix='batch-', dir=app.config['UPLOAD_FOLDER'])
+    documents = []
+    failures = []
+    max_files = app.config['BATCH_MAX_FILES']
+    try:
+        for index, upload in enumerate(uploads):
+            filename = secure_filename(upload.filename)
+            try:
+                upload.stream.verify()
+            except InvalidUpload as e:
+                failures.append(failed_entry(upload.filename, str(e)))
+                continue
+            if filename.lower().endswith('.zip'):
+                member_dir = tempfile.mkdtemp(dir=batch_dir)
+                try:
+                    members, skipped = expand_zip(upload.stream, member_dir, allowed_file,
+                                                  max_members=max(0, max_files - len(documents)),
+                                                  memory_limit=app.config['UPLOAD_MEMORY_LIMIT'])
+                except ValueError as e:
+                    failures.append(failed_entry(upload.filename, str(e)))
+                    continue
+                documents.extend((f"{upload.filename}/{name}", path) for name, path in members)
+                failures.extend(failed_entry(f"{upload.filename}/{name}", reason) for name, reason in skipped)
+            elif not allowed_file(upload.filename):
+                failures.append(failed_entry(upload.filename, 'File type not allowed'))
+            elif len(documents) >= max_files:
+                failures.append(failed_entry(upload.filename, f'Batch holds more than {max_files} documents'))
+            else:
+                documents.append((upload.filename, detach_upload(
+                    upload.stream, f"{index}-{filename}", batch_dir, app.config['UPLOAD_MEMORY_LIMIT'])))
+    except Exception:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+    
+    logger.info("Starting batch", extra={'documents': len(documents), 'rejected': len(failures)})
+    batch = BatchAnalyzer(concurrency=app.config['BATCH_CONCURRENCY'])
+    # Read before a streamed response has sent the session
+    owner = history_owner()
+    
+    def results():
+        try:
+            yield from failures
+            for entry in batch.run(documents, owner):
+                if entry['result_id']:
+                    entry['results_url'] = url_for('result_by_id', result_id=entry['result_id'])
+                yield entry
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+    
+    wants_ndjson = (request.args.get('format') == 'ndjson'
+                    or request.accept_mimetypes.best == 'application/x-ndjson')
+    if wants_ndjson:
+        return Response(
+            stream_with_context(json.dumps(entry) + '\n' for entry in results()),
+            mimetype='application/x-ndjson'
+        )
+    
+    entries = list(results())
+    succeeded = sum(1 for entry in entries if entry['status'] == 'done')
+    return jsonify({
+        'success': succeeded > 0,
+        'summary': {'total': len(entries), 'done': succeeded, 'failed': len(entries) - succeeded},
+        'results': entries
+    })
+
+@app.route('/analyze/stream', methods=['POST'])
+@admission_controlled
+def analyze_stream():
+    """Analyze an upload, sending each diagnosis as a Server-Sent Event as soon as it is complete."""
+    timer = StageTimer()
+    with timer.activate():
+        file, error_response = get_upload()
+        if error_response:
+            return error_response
+        
+        try:
+            # Extraction happens before the stream starts so that errors get a normal response
+            with timed_stage('extract'):
+                patient_data = extract_text(file.stream, file.filename, file.stream.sha256)
+            logger.info("Extracted text", extra={'chars': len(patient_data)})
+        except Exception as e:
+            logger.exception("Extracting streamed upload failed")
+            return jsonify({'error': str(e)}), 500
+    
+    # The session is sent with the response headers, before the result exists
+    result_store = get_result_store()
+    result_id = result_store.new_id()
+    session['result_id'] = result_id
+    owner = history_owner()
+    results_url = url_for('result_by_id', result_id=result_id)
+    filename = file.filename
+    
+    def generate():
+        analyzer = MedicalAnalyzer()
+        for event, payload in analyzer.stream_patient_data(patient_data):
+            if event == 'diagnosis':
+                yield sse_event('diagnosis', payload)
+                continue
+            
+            result_store.save(payload, result_id=result_id)
+            record_analysis(result_id, payload, patient_data, owner, filename)
+            result = json.loads(payload)
+            if result.get('error'):
+                yield sse_event('error', {'error': result['error'], 'results_url': results_url})
+            else:
+                yield sse_event('done', {'result_id': result_id, 'results_url': results_url})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                 'Server-Timing': timer.server_timing()}
+    )
 
 @app.route('/results')
 def results():
-    print(">>> Results page requested")
-    # Get the analysis result from the session
-    analysis_result = session.get('analysis_result')
-    if not analysis_result:
-        print(">>> No analysis results found in session")
+    # Look up the most recent result for this session
+    result_id = session.get('result_id')
+    if not result_id:
         return render_template('error.html', error='No analysis results found. Please upload a file first.')
+    return redirect(url_for('result_by_id', result_id=result_id))
+
+@app.route('/results/<result_id>')
+def result_by_id(result_id):
+    # Get the analysis result from the result store, or once it has expired
+    # there, from the history of the session that made it
+    analysis_result = get_result_store().load(result_id)
+    owner = session.get('history_owner')
+    if not analysis_result and owner and get_analysis_history() is not None:
+        analysis_result = get_analysis_history().load(result_id, owner)
+    if not analysis_result:
+        logger.info("No analysis result found for id")
+        return render_template('error.html', error='No analysis results found. They may have expired; please upload the file again.'), 404
     
     # Parse the JSON result
     try:
-        print(f">>> Parsing analysis result of length: {len(analysis_result)}")
-        print(f">>> Analysis result sample: {analysis_result[:100]}...")
-        result = json.loads(analysis_result)
-        print(">>> JSON parsed successfully")
+        with timed_stage('parse'):
+            result = json.loads(analysis_result)
         
         # Check if there's an error in the result
         if 'error' in result and result['error']:
-            print(f">>> Error found in analysis result: {result['error']}")
             return render_template('error.html', 
                                  error=f"Analysis Error: {result['error']}", 
                                  additional_info=result.get('disclaimer', ''))
         
-        return render_template('results.html', result=result)
+        with timed_stage('render'):
+            return render_template('results.html', result=result)
     except json.JSONDecodeError as e:
-        print(f">>> JSON parsing error: {str(e)}")
-        print(f">>> Raw content that failed parsing: {analysis_result}")
+        # The stored text is derived from patient data, so it is never logged
+        logger.error("Stored analysis result is not valid JSON", extra={'error': str(e)})
         return render_template('error.html', 
                              error='Invalid result format. The analysis produced malformed data.', 
                              additional_info='Please try again with a different file.')
 
+def history_page(search=None):
+    """Respond with one page of the session's analysis history, optionally filtered by a search."""
+    history = get_analysis_history()
+    if history is None:
+        return jsonify({'error': 'Analysis history is disabled'}), 404
+    owner = session.get('history_owner')
+    if owner is None:
+        return jsonify({'entries': [], 'next': None})
+    
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    page = {
+        'before': request.args.get('before', type=int),
+        'since': request.args.get('since', type=float),
+        'until': request.args.get('until', type=float),
+    }
+    with timed_stage('history'):
+        if search is None:
+            entries, cursor = history.list(owner, limit, **page)
+        else:
+            entries, cursor = history.search(owner, search, limit, **page)
+    for entry in entries:
+        entry['results_url'] = url_for('result_by_id', result_id=entry['result_id'])
+    
+    next_url = None
+    if cursor is not None:
+        args = request.args.to_dict()
+        args['before'] = cursor
+        next_url = url_for(request.endpoint, **args)
+    return jsonify({'entries': entries, 'next': next_url})
+
+@app.route('/history')
+def history_list():
+    """
+    List the session's past analyses, newest first.
+    
+    Query parameters: limit (default 20, at most 100), since and until
+    (Unix times), and before, the cursor carried by the "next" URL.
+    """
+    return history_page()
+
+@app.route('/history/search')
+def history_search():
+    """Search the session's past analyses by document text, condition, or medication (?q=...), newest first."""
+    query = request.args.get('q', '')
+    if not re.search(r'\w', query):
+        return jsonify({'error': 'Missing search text'}), 400
+    return history_page(search=query)
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Report hit/miss counters for the analysis cache."""
+    return jsonify(get_analysis_cache().stats())
+
+@app.route('/usage')
+def usage_stats():
+    """Report token usage, including prompt-cache reads and writes, per model."""
+    return jsonify(get_usage_tracker().stats())
+
+def collect_runtime_metrics():
+    """Expose the analysis cache, token usage, API client, and admission state as metrics."""
+    cache = get_analysis_cache().stats()
+    yield ('maude_analysis_cache_hits_total', 'counter', 'Analysis cache hits, by tier.',
+           [({'tier': 'memory'}, cache['memory_hits']), ({'tier': 'disk'}, cache['disk_hits'])])
+    yield ('maude_analysis_cache_misses_total', 'counter', 'Analysis cache misses.', [({}, cache['misses'])])
+    yield ('maude_analysis_cache_coalesced_total', 'counter',
+           'Requests that waited for an identical analysis already in flight.', [({}, cache['coalesced'])])
+    yield ('maude_analysis_cache_entries', 'gauge', 'Entries in the analysis cache, by tier.',
+           [({'tier': 'memory'}, cache['memory_entries']), ({'tier': 'disk'}, cache['disk_entries'])])
+    
+    models = get_usage_tracker().stats()['models']
+    yield ('maude_api_tokens_total', 'counter', 'Tokens used by completed API requests, by model and kind.',
+           [({'model': model, 'kind': kind}, totals[f'{kind}_tokens'])
+            for model, totals in sorted(models.items())
+            for kind in ('input', 'cache_creation_input', 'cache_read_input', 'output')])
+    yield ('maude_api_completed_requests_total', 'counter', 'Completed API requests, by model.',
+           [({'model': model}, totals['requests']) for model, totals in sorted(models.items())])
+    
+    client = get_api_client_stats()
+    if client is not None:
+        for name, help in (('requests', 'API call attempts, including retries.'),
+                           ('retries', 'API calls retried after a retryable error.'),
+                           ('failures', 'API calls that failed after all retries or with a non-retryable error.'),
+                           ('rejected', 'API calls rejected without trying because the circuit was open.'),
+                           ('throttled', 'API calls turned away because the rate limit would have held them '
+                                         'longer than ANTHROPIC_RATE_LIMIT_MAX_WAIT.')):
+            yield (f'maude_api_{name}_total', 'counter', help, [({}, client[name])])
+        yield ('maude_api_circuit_state', 'gauge', 'Circuit breaker state (1 for the current state).',
+               [({'state': state}, int(client['circuit'] == state)) for state in ('closed', 'half-open', 'open')])
+    
+    admission = get_admission_controller(MAX_CONCURRENCY).stats()
+    yield ('maude_admission_in_flight', 'gauge', 'Analysis requests admitted and running.',
+           [({}, admission['in_flight'])])
+    yield ('maude_admission_queued', 'gauge', 'Analysis requests waiting for a slot.', [({}, admission['queued'])])
+    yield ('maude_admission_service_seconds', 'gauge',
+           'Moving average of the time an admitted analysis request holds its slot.',
+           [({}, admission['service_seconds'])])
+
+REGISTRY.add_collector(collect_runtime_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Report request, stage, cache, token, and API client metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import Body, build_environ
+from flask import Response, jsonify, session, url_for
+
+from app.admission import Overloaded, get_admission_controller
+from app.app import (admission_client, app as flask_app, extract_text, get_upload, history_owner,
+                     overloaded_response, release_when_sent)
+from app.analyzer import MedicalAnalyzer
+from app.client import ASYNC_MAX_CONCURRENCY, RateLimitTimeout, close_async_api_client
+from app.history import record_analysis
+from app.metrics import StageTimer, timed_stage
+from app.result_store import get_result_store
+from app.streaming import sse_event
+
+# Threads extracting uploaded documents; large PDFs also use their own process pool
+ASYNC_EXTRACT_WORKERS = int(os.environ.get("ASYNC_EXTRACT_WORKERS", 4))
+# Threads serving the routes that are handed to the Flask app and reading analysis uploads
+ASYNC_WSGI_THREADS = int(os.environ.get("ASYNC_WSGI_THREADS", 16))
+
+logger = logging.getLogger(__name__)
+
+
+class ASGIApp:
+    """
+    An ASGI application serving analyses on an event loop.
+
+    POST /analyze and POST /analyze/stream are dispatched by the Flask app
+    like any other request: its request context, before- and after-request
+    hooks, error handlers, upload validation and session all apply. Only
+    the view itself is a coroutine awaited on the event loop, so the API
+    call uses the asyncio client and one process can hold hundreds of
+    analyses in flight without a thread for each. They are admitted by the
+    same controller as the Flask routes, with its in-flight bound
+    defaulting to the asyncio client's concurrency. Every other route,
+    including job and batch uploads, is served by the Flask app on a
+    thread pool.
+    """
+
+    def __init__(self, wsgi_app, extract_workers=ASYNC_EXTRACT_WORKERS, wsgi_threads=ASYNC_WSGI_THREADS):
+        """
+        Initialize the application.
+
+        Args:
+            wsgi_app (flask.Flask): The Flask app serving the site
+            extract_workers (int): Number of text extraction threads
+            wsgi_threads (int): Number of threads running Flask requests and reading uploads
+        """
+        self.wsgi_app = wsgi_app
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=wsgi_threads)
+        self.extract_pool = ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix='async-extract')
+        self.admission = get_admission_controller(ASYNC_MAX_CONCURRENCY)
+        self.views = {
+            ('POST', '/analyze'): self._analyze,
+            ('POST', '/analyze/stream'): self._analyze_stream,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        view = self.views.get((scope['method'], scope['path']))
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        if view is None or query.get('mode') == ['job']:
+            await self.wsgi(scope, receive, send)
+            return
+        await self._dispatch(view, scope, receive, send)
+
+    async def _dispatch(self, view, scope, receive, send):
+        """
+        Handle a request the way Flask's full_dispatch_request does, awaiting view.
+
+        The upload is read from the connection as Flask parses it, on one of
+        the threads serving Flask, so an invalid file is still rejected at
+        its first chunk.
+        """
+        app = self.wsgi_app
+        environ = build_environ(scope, Body(asyncio.get_running_loop(), receive))
+        # The body ends when the client says so, with or without a Content-Length
+        environ['wsgi.input_terminated'] = True
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await self._admitted(view)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+            await _send_response(send, response, environ)
+
+    async def _admitted(self, view):
+        """Run view once the admission controller has a slot for the request, or answer 429."""
+        try:
+            ticket = await self.admission.admit_async(admission_client())
+        except Overloaded as e:
+            logger.info("Rejected request: server busy", extra={'retry_after': e.retry_after})
+            return overloaded_response(e)
+        try:
+            response = self.wsgi_app.make_response(await view())
+        except BaseException:
+            ticket.release()
+            raise
+        return release_when_sent(response, ticket)
+
+    async def _analyze(self):
+        """The asyncio form of the /analyze view."""
+        timer = StageTimer()
+        with timer.activate():
+            file, error_response = await self._in_thread(self.wsgi.executor, get_upload)
+            if error_response:
+                return error_response
+
+            try:
+                with timed_stage('extract'):
+                    patient_data = await self._in_thread(self.extract_pool, extract_text, file.stream,
+                                                         file.filename, file.stream.sha256)
+                logger.info("Extracted text", extra={'chars': len(patient_data)})
+                with timed_stage('analyze'):
+                    analysis_result = await MedicalAnalyzer().analyze_patient_data_async(patient_data)
+                with timed_stage('store'):
+                    result_id = await asyncio.to_thread(get_result_store().save, analysis_result)
+                    await asyncio.to_thread(record_analysis, result_id, analysis_result, patient_data, history_owner(),
+                                            file.filename)
+                session['result_id'] = result_id
+                with timed_stage('parse'):
+                    parsed_result = json.loads(analysis_result)
+                with timed_stage('render'):
+                    response = jsonify({
+                        'success': True,
+                        'result': parsed_result,
+                        'result_id': result_id,
+                        'results_url': url_for('result_by_id', result_id=result_id)
+                    })
+                response.headers['Server-Timing'] = timer.server_timing()
+                return response
+            except RateLimitTimeout as e:
+                return overloaded_response(e)
+            except Exception as e:
+                logger.exception("Analysis request failed")
+                return jsonify({'error': str(e)}), 500
+
+    async def _analyze_stream(self):
+        """The asyncio form of the /analyze/stream view."""
+        timer = StageTimer()
+        with timer.activate():
+            file, error_response = await self._in_thread(self.wsgi.executor, get_upload)
+            if error_response:
+                return error_response
+
+            try:
+                with timed_stage('extract'):
+                    patient_data = await self._in_thread(self.extract_pool, extract_text, file.stream,
+                                                         file.filename, file.stream.sha256)
+                logger.info("Extracted text", extra={'chars': len(patient_data)})
+            except Exception as e:
+                logger.exception("Extracting streamed upload failed")
+                return jsonify({'error': str(e)}), 500
+
+        result_store = get_result_store()
+        result_id = result_store.new_id()
+        session['result_id'] = result_id
+        owner = history_owner()
+        results_url = url_for('result_by_id', result_id=result_id)
+        filename = file.filename
+
+        async def generate():
+            async for event, payload in MedicalAnalyzer().stream_patient_data_async(patient_data):
+                if event == 'diagnosis':
+                    yield sse_event('diagnosis', payload)
+                    continue
+
+                await asyncio.to_thread(result_store.save, payload, result_id=result_id)
+                await asyncio.to_thread(record_analysis, result_id, payload, patient_data, owner, filename)
+                result = json.loads(payload)
+                if result.get('error'):
+                    yield sse_event('error', {'error': result['error'], 'results_url': results_url})
+                else:
+                    yield sse_event('done', {'result_id': result_id, 'results_url': results_url})
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                     'Server-Timing': timer.server_timing()}
+        )
+
+    async def _in_thread(self, executor, func, *args):
+        """Run func on executor in the current context, which carries the Flask request, the request id and the stage timer."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_api_client()
+                self.extract_pool.shutdown(wait=False)
+                self.wsgi.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _send_response(send, response, environ):
+    """Send a Flask response, whose body may be an async iterable, over ASGI."""
+    body = response.response
+    try:
+        headers = response.get_wsgi_headers(environ).to_wsgi_list()
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        if hasattr(body, '__aiter__'):
+            async for chunk in body:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        else:
+            for chunk in response.iter_encoded():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'aclose'):
+            await body.aclose()
+        response.close()
+
+
+application = ASGIApp(flask_app)
@@ -0,0 +1,231 @@
+import io
+import json
+import logging
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from werkzeug.utils import secure_filename
+
+from app.file_processor import FileProcessor
+from app.analyzer import MedicalAnalyzer
+from app.history import record_analysis
+from app.result_store import get_result_store
+from app.metrics import STAGE_SECONDS
+from app.uploads import InvalidUpload, ValidatingStream
+
+logger = logging.getLogger(__name__)
+
+_STAGE_TIMINGS = {'extract': 'extraction_seconds', 'analyze': 'analysis_seconds'}
+
+
+def expand_zip(archive_source, dest_dir, is_allowed, max_members=50, max_total_bytes=64 * 1024 * 1024,
+               memory_limit=4 * 1024 * 1024):
+    """
+    Extract the supported documents from a ZIP archive.
+
+    Members that are directories, unsupported, or beyond max_members are
+    skipped, and extraction stops once max_total_bytes of uncompressed data
+    would be exceeded, so a small archive cannot expand without bound.
+    Each member is checked against its file type as it is extracted, like
+    an upload, and skipped with the validator's message if it fails.
+    Members up to memory_limit bytes are kept in memory; larger ones are
+    written to dest_dir.
+
+    Args:
+        archive_source: Path or seekable binary stream of the uploaded archive
+        dest_dir (str): Directory to extract large documents into
+        is_allowed (callable): Returns True for filenames that can be analyzed
+        max_members (int): Maximum number of documents taken from the archive
+        max_total_bytes (int): Maximum total uncompressed size
+        memory_limit (int): Largest member kept in memory
+
+    Returns:
+        tuple: (documents, skipped) where documents is a list of
+            (name, source) pairs, source being bytes or a file path, and
+            skipped a list of (name, reason) pairs
+
+    Raises:
+        ValueError: If the file is not a valid ZIP archive
+    """
+    documents = []
+    skipped = []
+    total_bytes = 0
+    try:
+        archive = zipfile.ZipFile(archive_source)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid ZIP archive: {str(e)}")
+
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/'):
+                continue
+            if not is_allowed(name):
+                skipped.append((name, 'File type not allowed'))
+                continue
+            if len(documents) >= max_members:
+                skipped.append((name, f'Archive holds more than {max_members} documents'))
+                continue
+            if total_bytes + info.file_size > max_total_bytes:
+                skipped.append((name, 'Archive exceeds the uncompressed size limit'))
+                continue
+            total_bytes += info.file_size
+
+            path = None
+            if info.file_size > memory_limit:
+                path = os.path.join(dest_dir, f"{len(documents)}-{secure_filename(os.path.basename(name))}")
+            try:
+                documents.append((name, _extract_member(archive, info, path)))
+            except InvalidUpload as e:
+                skipped.append((name, str(e)))
+    return documents, skipped
+
+
+def _extract_member(archive, info, path=None):
+    """
+    Extract one archive member through the upload validator.
+
+    Args:
+        archive (zipfile.ZipFile): The open archive
+        info (zipfile.ZipInfo): The member to extract
+        path (str): File to write the member to, or None to keep it in memory
+
+    Returns:
+        bytes or str: The member's contents, or path once they are written there
+
+    Raises:
+        InvalidUpload: If the contents do not match the member's file type
+    """
+    target = io.BytesIO() if path is None else open(path, 'wb')
+    stream = ValidatingStream(target, info.filename)
+    try:
+        with archive.open(info) as source:
+            shutil.copyfileobj(source, stream)
+        stream.verify()
+    except InvalidUpload:
+        if path is not None:
+            target.close()
+            os.remove(path)
+        raise
+    finally:
+        if path is not None:
+            target.close()
+    return target.getvalue() if path is None else path
+
+
+def failed_entry(name, error, timings=None, result_id=None):
+    """
+    Build the per-file result reported for a document that could not be analyzed.
+
+    Args:
+        name (str): Name of the file within the batch
+        error (str): Why it failed
+        timings (dict): Stage timings recorded before the failure
+        result_id (str): Id of the stored error result, if one was saved
+
+    Returns:
+        dict: Per-file result with status "failed"
+    """
+    return {
+        'filename': name,
+        'status': 'failed',
+        'result_id': result_id,
+        'result': None,
+        'error': error,
+        'timings': timings or {},
+    }
+
+
+class BatchAnalyzer:
+    """
+    Analyzes several documents at once, extracting them in parallel and
+    running at most ``concurrency`` LLM calls at a time.
+    """
+
+    def __init__(self, concurrency=4, extraction_workers=4):
+        """
+        Initialize the batch analyzer.
+
+        Args:
+            concurrency (int): Maximum number of simultaneous analyses
+            extraction_workers (int): Number of threads extracting text
+        """
+        self.concurrency = concurrency
+        self.extraction_workers = extraction_workers
+
+    def run(self, documents, owner=None):
+        """
+        Extract and analyze documents, yielding each result as it finishes.
+
+        A failure in one document is reported in its own result and does not
+        affect the others.
+
+        Args:
+            documents (list): (name, source) pairs, source being the
+                document's bytes or the path of a saved file
+            owner (str): History key of the session the results are recorded for
+
+        Yields:
+            dict: Per-file result with filename, status ("done" or "failed"),
+                result_id, result, error, and timings
+        """
+        analyzer = MedicalAnalyzer()
+        result_store = get_result_store()
+
+        extract_pool = ThreadPoolExecutor(max_workers=self.extraction_workers, thread_name_prefix='batch-extract')
+        analyze_pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch-analyze')
+        finished = False
+        try:
+            pending = {}
+            for name, source in documents:
+                future = extract_pool.submit(self._timed, FileProcessor.process_file, source, name)
+                pending[future] = ('extract', name, {}, None)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, name, timings, document = pending.pop(future)
+                    try:
+                        value, seconds = future.result()
+                    except Exception as e:
+                        logger.warning("Batch document failed", extra={'stage': stage, 'document': name, 'error': str(e)})
+                        yield failed_entry(name, str(e), timings)
+                        continue
+
+                    timings[_STAGE_TIMINGS[stage]] = seconds
+                    STAGE_SECONDS.observe(seconds, stage=stage)
+                    if stage == 'extract':
+                        future = analyze_pool.submit(self._timed, analyzer.analyze_patient_data, value)
+                        pending[future] = ('analyze', name, timings, value)
+                        continue
+
+                    result = json.loads(value)
+                    result_id = result_store.save(value)
+                    record_analysis(result_id, value, document, owner, name)
+                    if result.get('error'):
+                        yield failed_entry(name, result['error'], timings, result_id)
+                    else:
+                        yield {
+                            'filename': name,
+                            'status': 'done',
+                            'result_id': result_id,
+                            'result': result,
+                            'error': None,
+                            'timings': timings,
+                        }
+            finished = True
+        finally:
+            # If the generator was closed early, as when a streaming client
+            # goes away, or failed, drop the queued extractions and analyses
+            # rather than wait for them and pay for them
+            for pool in (extract_pool, analyze_pool):
+                pool.shutdown(wait=finished, cancel_futures=not finished)
+
+    @staticmethod
+    def _timed(func, *args):
+        start = time.time()
+        value = func(*args)
+        return value, round(time.time() - start, 3)
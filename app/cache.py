@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe, in-process LRU cache with an optional time-to-live.
+    """
+
+    def __init__(self, max_entries=128, ttl=None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries kept in memory
+            ttl (float): Seconds an entry stays valid, or None for no expiry
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries."""
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key from the cache if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    A disk-backed cache stored in a single SQLite file.
+
+    Entries expire after ``ttl`` seconds and the least recently used entries
+    are evicted once the stored values exceed ``max_bytes``.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize the cache, creating the database file if needed.
+
+        Args:
+            path (str): Path to the SQLite database file
+            ttl (float): Seconds an entry stays valid, or None for no expiry
+            max_bytes (int): Upper bound on the total size of stored values
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key, value):
+        """Store value under key and prune expired or excess entries."""
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now),
+            )
+            self._prune(now)
+
+    def delete(self, key):
+        """Remove key from the cache if present."""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _prune(self, now):
+        """Drop expired entries, then the oldest ones until under max_bytes."""
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class _Flight:
+    """An in-flight computation that concurrent callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class AnalysisCache:
+    """
+    A two-tier cache for analysis results with single-flight deduplication.
+
+    Lookups check the in-process LRU tier first and then the optional disk
+    tier. Concurrent misses for the same key share one computation instead
+    of each calling the API.
+    """
+
+    def __init__(self, memory, disk=None):
+        """
+        Initialize the cache.
+
+        Args:
+            memory (LRUCache): The in-process tier
+            disk (SQLiteCache): The optional persistent tier
+        """
+        self.memory = memory
+        self.disk = disk
+        self._inflight = {}
+        self._async_inflight = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+        }
+
+    @staticmethod
+    def make_key(text, model, prompt_version):
+        """
+        Build a cache key from the normalized text, model, and prompt version.
+
+        Whitespace is collapsed so that re-extractions of the same document
+        with different line wrapping map to the same key.
+
+        Args:
+            text (str): Extracted patient data
+            model (str): Model identifier used for the analysis
+            prompt_version (str): Version of the prompt template
+
+        Returns:
+            str: Hex digest identifying the analysis
+        """
+        normalized = ' '.join(text.split())
+        digest = hashlib.sha256()
+        for part in (model, prompt_version, normalized):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached value for key from either tier, or None."""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('hits', 'memory_hits')
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                self._count('hits', 'disk_hits')
+                return value
+        return None
+
+    def set(self, key, value):
+        """Store value in every tier."""
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing and storing it on a miss.
+
+        Only one caller computes a given key at a time; others arriving while
+        it runs wait for its result. Exceptions raised by compute propagate
+        to every waiting caller and nothing is cached.
+
+        Args:
+            key (str): Cache key from make_key
+            compute (callable): Zero-argument function producing the value
+
+        Returns:
+            str: The cached or freshly computed value
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not leader:
+            self._count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self._count('misses')
+        try:
+            flight.value = compute()
+            self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    async def get_or_compute_async(self, key, compute):
+        """
+        The asyncio form of get_or_compute, for callers on one event loop.
+
+        Tier lookups and writes run in a worker thread so a slow disk never
+        blocks the loop. Concurrent misses on the loop share one computation;
+        they are not coalesced with threaded callers of get_or_compute.
+
+        Args:
+            key (str): Cache key from make_key
+            compute (callable): Zero-argument coroutine function producing the value
+
+        Returns:
+            str: The cached or freshly computed value
+        """
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            return value
+
+        flight = self._async_inflight.get(key)
+        if flight is not None:
+            self._count('coalesced')
+            return await asyncio.shield(flight)
+
+        flight = asyncio.get_running_loop().create_future()
+        self._async_inflight[key] = flight
+        self._count('misses')
+        try:
+            value = await compute()
+            await asyncio.to_thread(self.set, key, value)
+            flight.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Marks the error as retrieved, so it is not logged when no one else was waiting
+            flight.exception()
+            raise
+        finally:
+            del self._async_inflight[key]
+
+    def stats(self):
+        """Return a snapshot of the hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._inflight) + len(self._async_inflight)
+        stats['memory_entries'] = len(self.memory)
+        stats['disk_entries'] = len(self.disk) if self.disk is not None else 0
+        return stats
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+
+def create_analysis_cache():
+    """
+    Build an AnalysisCache from environment configuration.
+
+    ANALYSIS_CACHE_SIZE sets the number of in-memory entries (0 disables
+    the memory tier), ANALYSIS_CACHE_TTL the lifetime in seconds, and
+    ANALYSIS_CACHE_DB enables the SQLite tier at the given path, capped at
+    ANALYSIS_CACHE_MAX_BYTES.
+
+    Returns:
+        AnalysisCache: The configured cache
+    """
+    ttl = float(os.environ.get("ANALYSIS_CACHE_TTL", 24 * 60 * 60)) or None
+    memory = LRUCache(int(os.environ.get("ANALYSIS_CACHE_SIZE", 128)), ttl=ttl)
+    disk = None
+    db_path = os.environ.get("ANALYSIS_CACHE_DB", "")
+    if db_path:
+        disk = SQLiteCache(
+            db_path,
+            ttl=ttl,
+            max_bytes=int(os.environ.get("ANALYSIS_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+        )
+    return AnalysisCache(memory, disk)
@@ -0,0 +1,152 @@
+import math
+import re
+
+# Clinical text is dense with numbers, units, and abbreviations, which
+# tokenize worse than prose; 3.5 characters per token errs on the safe side
+CHARS_PER_TOKEN = 3.5
+
+_LIKELIHOOD_RANK = {'high': 0, 'medium': 1, 'low': 2}
+
+# Lines that look like section headings: "HISTORY OF PRESENT ILLNESS", "Medications:"
+_HEADING = re.compile(r'\n(?=[ \t]*(?:[A-Z][A-Z0-9 /&,()-]{3,60}|[A-Z][A-Za-z0-9 /&,()-]{2,60}:)[ \t]*\n)')
+
+# Boundaries tried in order, from the most to the least natural place to split
+_SEPARATORS = [
+    re.compile(r'\f'),
+    _HEADING,
+    re.compile(r'\n[ \t]*\n'),
+    re.compile(r'\n'),
+    re.compile(r'(?<=[.!?])\s+'),
+]
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in text without calling the API.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Approximate token count
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_into_chunks(text, max_tokens):
+    """
+    Split text into chunks of at most max_tokens estimated tokens.
+
+    Splits prefer page breaks, then section headings, then blank lines,
+    then lines and sentences; text with none of those is cut at the size
+    limit. Neighbouring pieces are packed together up to the budget.
+
+    Args:
+        text (str): Text to split
+        max_tokens (int): Token budget per chunk
+
+    Returns:
+        list: The chunks, in document order
+    """
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    chunks = []
+    current = []
+    current_size = 0
+    for piece in _pieces(text, max_chars, 0):
+        if current and current_size + len(piece) > max_chars:
+            chunks.append(''.join(current))
+            current = []
+            current_size = 0
+        current.append(piece)
+        current_size += len(piece)
+    if current:
+        chunks.append(''.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _pieces(text, max_chars, level):
+    """Yield pieces of text no longer than max_chars, splitting on ever finer boundaries."""
+    if len(text) <= max_chars:
+        yield text
+        return
+    if level >= len(_SEPARATORS):
+        for start in range(0, len(text), max_chars):
+            yield text[start:start + max_chars]
+        return
+
+    start = 0
+    for match in _SEPARATORS[level].finditer(text):
+        # Keep each separator with the piece before it so no text is lost
+        yield from _pieces(text[start:match.end()], max_chars, level + 1)
+        start = match.end()
+    yield from _pieces(text[start:], max_chars, level + 1)
+
+
+def merge_analyses(analyses):
+    """
+    Merge the analyses of several parts of one record into a single result.
+
+    Diagnoses with the same condition are combined: the highest likelihood
+    wins, distinct reasoning is concatenated, and medications and tests are
+    de-duplicated. Diagnoses are ordered by likelihood, then by first
+    appearance. Warnings are de-duplicated and the first disclaimer is kept.
+
+    Args:
+        analyses (list): Parsed analysis dicts, one per part, in document order
+
+    Returns:
+        dict: A result with the same structure as a single analysis
+    """
+    merged = {}
+    order = []
+    warnings = []
+    disclaimer = None
+
+    for analysis in analyses:
+        for diagnosis in analysis.get('diagnoses', []):
+            condition = (diagnosis.get('condition') or '').strip()
+            key = condition.lower()
+            if key not in merged:
+                merged[key] = {
+                    'condition': condition,
+                    'likelihood': diagnosis.get('likelihood'),
+                    'reasoning': diagnosis.get('reasoning') or '',
+                    'medications': [],
+                    'additional_tests': [],
+                }
+                order.append(key)
+            else:
+                _merge_diagnosis(merged[key], diagnosis)
+            target = merged[key]
+            known = {(med.get('name') or '').lower() for med in target['medications']}
+            for medication in diagnosis.get('medications', []):
+                name = (medication.get('name') or '').lower()
+                if name not in known:
+                    target['medications'].append(medication)
+                    known.add(name)
+            for test in diagnosis.get('additional_tests', []):
+                if test not in target['additional_tests']:
+                    target['additional_tests'].append(test)
+
+        for warning in analysis.get('warnings', []):
+            if warning not in warnings:
+                warnings.append(warning)
+        disclaimer = disclaimer or analysis.get('disclaimer')
+
+    diagnoses = [merged[key] for key in order]
+    diagnoses.sort(key=lambda d: _LIKELIHOOD_RANK.get((d.get('likelihood') or '').lower(), len(_LIKELIHOOD_RANK)))
+    return {
+        'diagnoses': diagnoses,
+        'warnings': warnings,
+        'disclaimer': disclaimer or "This analysis is not a substitute for professional medical advice.",
+    }
+
+
+def _merge_diagnosis(target, diagnosis):
+    likelihood = diagnosis.get('likelihood')
+    current_rank = _LIKELIHOOD_RANK.get((target.get('likelihood') or '').lower(), len(_LIKELIHOOD_RANK))
+    if _LIKELIHOOD_RANK.get((likelihood or '').lower(), len(_LIKELIHOOD_RANK)) < current_rank:
+        target['likelihood'] = likelihood
+    reasoning = diagnosis.get('reasoning')
+    if reasoning and reasoning not in target['reasoning']:
+        target['reasoning'] = f"{target['reasoning']} {reasoning}".strip()
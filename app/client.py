@@ -0,0 +1,631 @@
+import asyncio
+import email.utils
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from app.usage import get_usage_tracker
+
+API_KEY = os.environ.get("ANTHROPIC_API_KEY_MAUDE", "")
+# Point the client at a different Messages API endpoint, e.g. a local test server
+BASE_URL = os.environ.get("ANTHROPIC_BASE_URL") or None
+
+MAX_CONNECTIONS = int(os.environ.get("ANTHROPIC_MAX_CONNECTIONS", 20))
+MAX_CONCURRENCY = int(os.environ.get("ANTHROPIC_MAX_CONCURRENCY", 8))
+# Calls in flight on the asyncio client; waiting costs it no thread, so this can be much higher
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("ANTHROPIC_ASYNC_MAX_CONCURRENCY", 200))
+# Requests per minute allowed by our API tier; the bucket allows short bursts up to BURST
+REQUESTS_PER_MINUTE = float(os.environ.get("ANTHROPIC_REQUESTS_PER_MINUTE", 50))
+BURST = int(os.environ.get("ANTHROPIC_BURST", 10))
+# Longest a call waits for the rate limiter before it is turned away; 0 waits as long as it takes
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("ANTHROPIC_RATE_LIMIT_MAX_WAIT", 30))
+TIMEOUT = float(os.environ.get("ANTHROPIC_TIMEOUT", 120))
+MAX_RETRIES = int(os.environ.get("ANTHROPIC_MAX_RETRIES", 3))
+BACKOFF_BASE = float(os.environ.get("ANTHROPIC_BACKOFF_BASE", 1))
+BACKOFF_MAX = float(os.environ.get("ANTHROPIC_BACKOFF_MAX", 20))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", 30))
+
+
+def retryable_errors():
+    """Return the SDK errors that say nothing about the request itself, so trying again may succeed."""
+    import anthropic
+    return (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class RateLimitTimeout(Exception):
+    """Raised when no request slot becomes available within the wait limit; retry_after is the wait in whole seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    A thread-safe token-bucket rate limiter.
+
+    Tokens are added continuously at ``rate`` per second up to ``capacity``;
+    each request takes one.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Initialize the bucket full.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (int): Maximum number of tokens, i.e. the largest burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token, possibly borrowing against the future.
+
+        Args:
+            max_wait (float): Longest acceptable wait in seconds, or None
+
+        Returns:
+            float: Seconds the caller must wait before using the token
+
+        Raises:
+            RateLimitTimeout: If the wait would exceed max_wait; no token is taken
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitTimeout(f"Request rate limit reached; next slot in {wait:.1f} seconds",
+                                       math.ceil(wait))
+            self._tokens -= 1
+            return wait
+
+    def available(self):
+        """Return the tokens available now, without taking one; below 1, a request would have to wait."""
+        with self._lock:
+            return min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    def acquire(self, max_wait=None):
+        """
+        Block until a token is available.
+
+        Args:
+            max_wait (float): Longest acceptable wait in seconds, or None
+
+        Raises:
+            RateLimitTimeout: If the wait would exceed max_wait
+        """
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing dependency so that callers fail fast.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    every call is rejected for ``reset_timeout`` seconds. Then a single trial
+    call is let through: success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Initialize a closed circuit.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            reset_timeout (float): Seconds the circuit stays open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Return "closed", "open", or "half-open"."""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def before_call(self):
+        """
+        Check that a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a
+                trial call already in flight
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_flight:
+                raise CircuitOpenError(
+                    f"The analysis service is temporarily unavailable. Please try again in {max(remaining, 1):.0f} seconds."
+                )
+            self._trial_in_flight = True
+
+    def record_success(self):
+        """Close the circuit after a successful call."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit at the threshold."""
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def abandon_call(self):
+        """End a call that says nothing about the dependency, such as a cancelled one, letting another trial through."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def retry_after_seconds(error):
+    """
+    Return the server's requested retry delay for an API error, if any.
+
+    Honours ``retry-after-ms`` and ``retry-after`` (seconds or an HTTP date).
+
+    Args:
+        error (Exception): The error raised by the SDK
+
+    Returns:
+        float: Seconds to wait, or None if the server gave no hint
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        return float(headers.get('retry-after-ms')) / 1000
+    except (TypeError, ValueError):
+        pass
+    value = headers.get('retry-after')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def backoff_delay(attempt, error=None):
+    """
+    Return how long to wait before retry number ``attempt`` (starting at 0).
+
+    Uses full-jitter exponential backoff, so that callers failing together do
+    not retry together, but never waits less than the server asked for.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    hint = retry_after_seconds(error) if error is not None else None
+    if hint is not None:
+        delay = max(delay, min(hint, BACKOFF_MAX))
+    return delay
+
+
+_guards = None
+_guards_lock = threading.Lock()
+
+
+def _get_guards():
+    """Return the process-wide rate limiter and circuit breaker, shared by the sync and async clients."""
+    global _guards
+    if _guards is None:
+        with _guards_lock:
+            if _guards is None:
+                _guards = (TokenBucket(REQUESTS_PER_MINUTE / 60.0, BURST),
+                           CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS))
+    return _guards
+
+
+class APIClient:
+    """
+    A process-wide gateway to the Anthropic Messages API.
+
+    One SDK client with a pooled, keep-alive HTTP connection pool is shared
+    by all requests. Calls are limited by a concurrency semaphore and a
+    token-bucket rate limiter, retried with jittered backoff that honours
+    ``retry-after``, and guarded by a circuit breaker.
+    """
+
+    def __init__(self, api_key, base_url=None):
+        """
+        Initialize the client.
+
+        Args:
+            api_key (str): Anthropic API key
+            base_url (str): Alternative API endpoint, or None for the default
+        """
+        # The SDK takes a large share of cold-start time, so it is only
+        # imported once the first API call creates the client
+        import anthropic
+
+        self.http_client, self.sdk = self._create_sdk(api_key, base_url)
+        self.semaphore = self._create_semaphore()
+        self.rate_limiter, self.breaker = _get_guards()
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'throttled': 0}
+        self._counters_lock = threading.Lock()
+        self._retryable_errors = retryable_errors()
+        self._status_error = anthropic.APIStatusError
+
+    def _create_sdk(self, api_key, base_url):
+        """Return the pooled HTTP client and the SDK client that uses it."""
+        import anthropic
+        import httpx
+
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+        )
+        # Retries are handled here, where they can see the circuit breaker
+        sdk = anthropic.Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=http_client,
+        )
+        return http_client, sdk
+
+    def _create_semaphore(self):
+        return threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+    def create_message(self, **kwargs):
+        """
+        Call messages.create with rate limiting, retries, and circuit breaking.
+
+        Args:
+            **kwargs: Arguments for the SDK's messages.create
+
+        Returns:
+            anthropic.types.Message: The API response
+
+        Raises:
+            CircuitOpenError: If the API is currently considered unavailable
+            RateLimitTimeout: If the rate limiter would hold the call longer than RATE_LIMIT_MAX_WAIT
+            anthropic.APIError: If the call fails after all retries
+        """
+        start = time.monotonic()
+        response = self._call(lambda: self.sdk.messages.create(**kwargs))
+        get_usage_tracker().record(kwargs.get('model'), response.usage, time.monotonic() - start)
+        return response
+
+    @contextmanager
+    def stream(self, on_send=None, **kwargs):
+        """
+        Open a streaming messages call with the same protections as create_message.
+
+        Opening the stream is retried; errors once text has started to
+        arrive are not, since the caller may already have used it.
+
+        Args:
+            on_send (callable): Called with no arguments each time the request
+                is actually sent, once it has its slot and rate-limit token
+            **kwargs: Arguments for the SDK's messages.stream
+
+        Yields:
+            anthropic.MessageStream: The open stream
+        """
+        manager = None
+
+        def open_stream():
+            nonlocal manager
+            if on_send is not None:
+                on_send()
+            manager = self.sdk.messages.stream(**kwargs)
+            return manager.__enter__()
+
+        start = time.monotonic()
+        with self._slot():
+            stream = self._call(open_stream, hold_slot=False)
+            try:
+                yield stream
+                # Usage is only final once the caller has consumed the whole stream
+                get_usage_tracker().record(kwargs.get('model'), stream.get_final_message().usage,
+                                           time.monotonic() - start)
+            except self._retryable_errors:
+                self.breaker.record_failure()
+                raise
+            finally:
+                manager.__exit__(None, None, None)
+
+    def stats(self):
+        """Return request, retry, failure, and rejection counters and the breaker state."""
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def saturated(self):
+        """Return whether a new request would have to wait for a concurrency slot or a rate-limit token."""
+        if self.rate_limiter.available() < 1:
+            return True
+        if not self.semaphore.acquire(blocking=False):
+            return True
+        self.semaphore.release()
+        return False
+
+    @contextmanager
+    def _slot(self):
+        self.semaphore.acquire()
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+    def _call(self, func, hold_slot=True):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count('rejected')
+                raise
+            try:
+                self.rate_limiter.acquire(RATE_LIMIT_MAX_WAIT or None)
+            except RateLimitTimeout:
+                self._throttled()
+                raise
+            self._count('requests')
+            try:
+                if hold_slot:
+                    with self._slot():
+                        result = func()
+                else:
+                    result = func()
+            except self._retryable_errors as e:
+                self.breaker.record_failure()
+                if attempt >= MAX_RETRIES:
+                    self._count('failures')
+                    raise
+                delay = backoff_delay(attempt, e)
+                logger.warning("API call failed, retrying", extra={
+                    'attempt': attempt + 1, 'error': type(e).__name__, 'retry_in_seconds': round(delay, 2)})
+                self._count('retries')
+                time.sleep(delay)
+                continue
+            except self._status_error:
+                # The request itself was rejected; the API is healthy
+                self.breaker.record_success()
+                self._count('failures')
+                raise
+            except Exception:
+                # Any other error still ends the call, so a half-open circuit
+                # is not left waiting for a trial that never reports back
+                self.breaker.record_failure()
+                self._count('failures')
+                raise
+            except BaseException:
+                self.breaker.abandon_call()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def _throttled(self):
+        # A half-open circuit's trial call is not going to be made
+        self.breaker.abandon_call()
+        self._count('throttled')
+        logger.warning("API call turned away: rate limit wait too long",
+                       extra={'max_wait_seconds': RATE_LIMIT_MAX_WAIT})
+
+
+class AsyncAPIClient(APIClient):
+    """
+    The asyncio counterpart of APIClient, used by the ASGI entry point.
+
+    Waiting on the API holds no thread, so one process can keep hundreds of
+    calls in flight. The rate limiter and circuit breaker are shared with
+    the threaded client.
+    """
+
+    def _create_sdk(self, api_key, base_url):
+        import anthropic
+        import httpx
+
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONCURRENCY,
+                max_keepalive_connections=ASYNC_MAX_CONCURRENCY,
+                keepalive_expiry=60,
+            ),
+        )
+        sdk = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=http_client,
+        )
+        return http_client, sdk
+
+    def _create_semaphore(self):
+        return asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+
+    async def create_message(self, **kwargs):
+        """
+        Call messages.create with rate limiting, retries, and circuit breaking.
+
+        Args:
+            **kwargs: Arguments for the SDK's messages.create
+
+        Returns:
+            anthropic.types.Message: The API response
+        """
+        start = time.monotonic()
+        response = await self._call(lambda: self.sdk.messages.create(**kwargs))
+        get_usage_tracker().record(kwargs.get('model'), response.usage, time.monotonic() - start)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, on_send=None, **kwargs):
+        """
+        Open a streaming messages call; only opening the stream is retried.
+
+        Args:
+            on_send (callable): Called with no arguments each time the request
+                is actually sent, once it has its slot and rate-limit token
+            **kwargs: Arguments for the SDK's messages.stream
+
+        Yields:
+            anthropic.AsyncMessageStream: The open stream
+        """
+        manager = None
+
+        async def open_stream():
+            nonlocal manager
+            if on_send is not None:
+                on_send()
+            manager = self.sdk.messages.stream(**kwargs)
+            return await manager.__aenter__()
+
+        start = time.monotonic()
+        async with self.semaphore:
+            stream = await self._call(open_stream, hold_slot=False)
+            try:
+                yield stream
+                final = await stream.get_final_message()
+                get_usage_tracker().record(kwargs.get('model'), final.usage, time.monotonic() - start)
+            except self._retryable_errors:
+                self.breaker.record_failure()
+                raise
+            finally:
+                await manager.__aexit__(None, None, None)
+
+    def saturated(self):
+        """Return whether a new request would have to wait for a concurrency slot or a rate-limit token."""
+        return self.rate_limiter.available() < 1 or self.semaphore.locked()
+
+    async def aclose(self):
+        """Close the connection pool."""
+        await self.http_client.aclose()
+
+    async def _call(self, func, hold_slot=True):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count('rejected')
+                raise
+            try:
+                wait = self.rate_limiter.reserve(RATE_LIMIT_MAX_WAIT or None)
+            except RateLimitTimeout:
+                self._throttled()
+                raise
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._count('requests')
+            try:
+                if hold_slot:
+                    async with self.semaphore:
+                        result = await func()
+                else:
+                    result = await func()
+            except self._retryable_errors as e:
+                self.breaker.record_failure()
+                if attempt >= MAX_RETRIES:
+                    self._count('failures')
+                    raise
+                delay = backoff_delay(attempt, e)
+                logger.warning("API call failed, retrying", extra={
+                    'attempt': attempt + 1, 'error': type(e).__name__, 'retry_in_seconds': round(delay, 2)})
+                self._count('retries')
+                await asyncio.sleep(delay)
+                continue
+            except self._status_error:
+                self.breaker.record_success()
+                self._count('failures')
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                self._count('failures')
+                raise
+            except BaseException:
+                # Cancelled, as a hedged call that lost is; no verdict on the API
+                self.breaker.abandon_call()
+                raise
+            self.breaker.record_success()
+            return result
+
+
+_api_client = None
+_async_api_client = None
+_api_client_lock = threading.Lock()
+
+
+def get_api_client():
+    """Return the process-wide API client, creating it on first use."""
+    global _api_client
+    if _api_client is None:
+        with _api_client_lock:
+            if _api_client is None:
+                _api_client = APIClient(API_KEY, BASE_URL)
+    return _api_client
+
+
+def get_async_api_client():
+    """Return the process-wide asyncio API client, creating it on first use."""
+    global _async_api_client
+    if _async_api_client is None:
+        with _api_client_lock:
+            if _async_api_client is None:
+                _async_api_client = AsyncAPIClient(API_KEY, BASE_URL)
+    return _async_api_client
+
+
+async def close_async_api_client():
+    """Close the asyncio client's connections, if it was created."""
+    global _async_api_client
+    client, _async_api_client = _async_api_client, None
+    if client is not None:
+        await client.aclose()
+
+
+def get_api_client_stats():
+    """Return the counters of the shared clients combined, or None if no call has created one yet."""
+    clients = [client for client in (_api_client, _async_api_client) if client is not None]
+    if not clients:
+        return None
+    stats = clients[0].stats()
+    for client in clients[1:]:
+        for name, value in client.stats().items():
+            if name != 'circuit':
+                stats[name] += value
+    return stats
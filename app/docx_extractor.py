@@ -0,0 +1,125 @@
+import io
+import zipfile
+from xml.etree.ElementTree import ParseError, iterparse
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_BODY = _W + 'body'
+_PARAGRAPH = _W + 'p'
+_TEXT = _W + 't'
+_TAB = _W + 'tab'
+_BREAKS = (_W + 'br', _W + 'cr')
+_TABLE = _W + 'tbl'
+_ROW = _W + 'tr'
+_CELL = _W + 'tc'
+
+# Cells of a table row are emitted on one line, separated like a text table
+CELL_SEPARATOR = ' | '
+
+
+class _TableState:
+    """The row and cell being collected for one (possibly nested) table."""
+
+    def __init__(self):
+        self.row = []
+        self.cell = []
+
+
+def iter_docx_blocks(source):
+    """
+    Yield the paragraphs and table rows of a DOCX file in document order.
+
+    ``word/document.xml`` is stream-parsed straight out of the archive and
+    each top-level block is discarded once emitted, so memory use stays
+    roughly constant regardless of document size. Each table row is yielded
+    as one line with its cells separated by CELL_SEPARATOR; a table nested in
+    a cell becomes part of that cell's text.
+
+    Args:
+        source: Path to the DOCX file, its contents as bytes, or a binary stream
+
+    Yields:
+        str: The text of one paragraph or table row
+
+    Raises:
+        ValueError: If the file is not a ZIP archive with a parseable
+            word/document.xml
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        archive = zipfile.ZipFile(source)
+        document = archive.open('word/document.xml')
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"Not a readable DOCX file: {str(e)}")
+
+    body = None
+    depth = 0
+    body_depth = None
+    parts = []
+    tables = []
+    try:
+        for event, elem in iterparse(document, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if elem.tag == _BODY:
+                    body = elem
+                    body_depth = depth
+                elif elem.tag == _TABLE:
+                    tables.append(_TableState())
+                continue
+
+            tag = elem.tag
+            if tag == _TEXT:
+                if elem.text:
+                    parts.append(elem.text)
+            elif tag == _TAB:
+                parts.append('\t')
+            elif tag in _BREAKS:
+                parts.append('\n')
+            elif tag == _PARAGRAPH:
+                text = ''.join(parts)
+                parts = []
+                if tables:
+                    tables[-1].cell.append(text)
+                else:
+                    yield text
+            elif tag == _CELL:
+                state = tables[-1]
+                state.row.append(' '.join(p for p in state.cell if p))
+                state.cell = []
+            elif tag == _ROW:
+                state = tables[-1]
+                row = CELL_SEPARATOR.join(state.row)
+                state.row = []
+                if len(tables) > 1:
+                    tables[-2].cell.append(row)
+                elif row.strip(CELL_SEPARATOR + ' '):
+                    yield row
+            elif tag == _TABLE:
+                tables.pop()
+
+            # Drop every finished top-level block so the tree never grows
+            if body is not None and depth == body_depth + 1:
+                body.clear()
+            depth -= 1
+    except ParseError as e:
+        raise ValueError(f"Malformed DOCX document: {str(e)}")
+    finally:
+        document.close()
+        archive.close()
+
+
+def extract_docx_text(source):
+    """
+    Extract the text of a DOCX file, including table rows, one block per line.
+
+    Args:
+        source: Path to the DOCX file, its contents as bytes, or a binary stream
+
+    Returns:
+        str: The paragraphs and table rows separated by newlines
+
+    Raises:
+        ValueError: If the file cannot be stream-parsed
+    """
+    return '\n'.join(iter_docx_blocks(source))
@@ -1,6 +1,11 @@
+import io
+import logging
 import os
-import PyPDF2
-import docx
+
+from app.docx_extractor import extract_docx_text
+from app.pdf_extractor import extract_pdf_text
+
+logger = logging.getLogger(__name__)
 
 class FileProcessor:
     """
@@ -9,12 +14,15 @@ class FileProcessor:
     """
     
     @staticmethod
-    def process_file(file_path):
+    def process_file(source, filename=None):
         """
         Process a file and extract its content based on file extension.
         
         Args:
-            file_path (str): Path to the file
+            source: Path to the file, or its contents as bytes, a memoryview,
+                or a binary file-like object such as a Werkzeug upload stream
+            filename (str): Name used to determine the file type; required
+                unless source is a path
             
         Returns:
             str: Extracted text content from the file
@@ -23,41 +31,60 @@ class FileProcessor:
             ValueError: If file format is not supported
             FileNotFoundError: If file does not exist
         """
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
+        if isinstance(source, (str, os.PathLike)):
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"File not found: {source}")
+            filename = filename or os.fspath(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        elif not hasattr(source, 'read'):
+            raise ValueError(f"Unsupported source type: {type(source).__name__}")
+        
+        if not filename:
+            raise ValueError("A filename is required to process in-memory files")
         
-        file_extension = os.path.splitext(file_path)[1].lower()
+        file_extension = os.path.splitext(filename)[1].lower()
         
         if file_extension == '.txt':
-            return FileProcessor._process_txt(file_path)
+            return FileProcessor._process_txt(source)
         elif file_extension == '.pdf':
-            return FileProcessor._process_pdf(file_path)
+            return FileProcessor._process_pdf(source)
         elif file_extension == '.docx':
-            return FileProcessor._process_docx(file_path)
+            return FileProcessor._process_docx(source)
         else:
             raise ValueError(f"Unsupported file format: {file_extension}")
     
     @staticmethod
-    def _process_txt(file_path):
+    def _process_txt(source):
         """Process a text file."""
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'r', encoding='utf-8') as file:
+                return file.read()
+        return source.read().decode('utf-8')
     
     @staticmethod
-    def _process_pdf(file_path):
-        """Process a PDF file."""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
-        return text
+    def _process_pdf(source):
+        """Process a PDF file, splitting large documents across processes."""
+        return extract_pdf_text(source)
     
     @staticmethod
-    def _process_docx(file_path):
-        """Process a DOCX file."""
-        doc = docx.Document(file_path)
+    def _process_docx(source):
+        """Process a DOCX file, including its tables, without building the document model."""
+        try:
+            return extract_docx_text(source)
+        except ValueError as e:
+            logger.warning("Streaming DOCX extraction failed, falling back to python-docx", extra={'error': str(e)})
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return FileProcessor._process_docx_model(source)
+    
+    @staticmethod
+    def _process_docx_model(source):
+        """Process a DOCX file with python-docx."""
+        # Only needed when the streaming extractor fails, so loaded on demand
+        import docx
+        
+        doc = docx.Document(source)
         full_text = []
         for para in doc.paragraphs:
             full_text.append(para.text)
@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from app.metrics import FIRST_TOKEN_SECONDS, HEDGE_EXTRA_TOKENS, HEDGE_SAVED_SECONDS, HEDGES
+from app.usage import get_usage_tracker
+
+# A call that has had no token by this percentile (0-100) of recent
+# first-token times gets a second, hedge request; 0 disables hedging
+HEDGE_PERCENTILE = float(os.environ.get("ANALYSIS_HEDGE_PERCENTILE", 0))
+# First-token times needed before hedging starts, and how many are kept
+HEDGE_MIN_SAMPLES = int(os.environ.get("ANALYSIS_HEDGE_MIN_SAMPLES", 20))
+HEDGE_WINDOW = int(os.environ.get("ANALYSIS_HEDGE_WINDOW", 500))
+
+logger = logging.getLogger(__name__)
+
+_PRIMARY, _HEDGE = 0, 1
+_ATTEMPT_NAMES = ('primary', 'hedge')
+# Token kinds, labelled as in maude_api_tokens_total; each is read from the usage field <kind>_tokens
+_TOKEN_KINDS = ('input', 'cache_creation_input', 'cache_read_input', 'output')
+
+# Losing async attempts run on until their first token; the loop only holds weak references to tasks
+_background_tasks = set()
+
+
+class _Abandoned(Exception):
+    """Raised inside an attempt's stream so the client closes it without reading the rest."""
+
+
+class Hedger:
+    """
+    Decides when an API call gets a hedge request.
+
+    Keeps the first-token times of recent requests, measured from when each
+    was sent, so time spent waiting for our own concurrency slots and rate
+    limit is not mistaken for API latency. Once it has min_samples of them,
+    a call with no token by the chosen percentile of those times is sent a
+    second time, and whichever request produces a token first is used. The
+    other is abandoned at its own first token, so it costs its prompt but
+    almost no output. No hedge is sent while the client is saturated, as it
+    would only queue behind the requests already waiting.
+    """
+
+    def __init__(self, percentile, min_samples=20, window=500):
+        """
+        Initialize the hedger.
+
+        Args:
+            percentile (float): Percentile (0-100) of first-token times to hedge at, or 0 never to hedge
+            min_samples (int): First-token times needed before hedging starts
+            window (int): Number of recent first-token times kept
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.percentile > 0
+
+    def record(self, seconds):
+        """Add the first-token time of one request."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def deadline(self):
+        """Return the seconds to wait for a first token before hedging, or None not to hedge."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1)]
+
+
+class _Race:
+    """The shared state of one call's primary and hedge requests."""
+
+    def __init__(self, hedger, model):
+        self.hedger = hedger
+        self.model = model
+        # When each attempt was last sent, once it had its slot and rate-limit token
+        self.sent = [None, None]
+        self.winner = None
+        self.effective = None
+        self.hedged = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def send(self, index):
+        """Record that an attempt is being sent."""
+        self.sent[index] = time.perf_counter()
+
+    def first_token(self, index):
+        """
+        Record the first token of an attempt.
+
+        Returns:
+            bool: Whether this attempt is the one whose text is used
+        """
+        now = time.perf_counter()
+        seconds = now - self.sent[index]
+        self.hedger.record(seconds)
+        FIRST_TOKEN_SECONDS.observe(seconds, attempt=_ATTEMPT_NAMES[index])
+        # The caller's wait, from when the primary request was sent
+        elapsed = now - self.sent[_PRIMARY]
+        with self._lock:
+            if self.winner is None:
+                self.winner = index
+                self.effective = elapsed
+                won = True
+            else:
+                won = False
+        if won:
+            FIRST_TOKEN_SECONDS.observe(elapsed, attempt='effective')
+            if self.hedged:
+                HEDGES.inc(outcome='won' if index == _HEDGE else 'lost')
+        elif index == _PRIMARY:
+            # The hedge answered first; this is how long the caller would have waited
+            HEDGE_SAVED_SECONDS.inc(elapsed - self.effective)
+        return won
+
+    def abandon(self, stream, index):
+        """Account for the tokens of a losing attempt that is about to be closed."""
+        usage = stream.current_message_snapshot.usage
+        for kind in _TOKEN_KINDS:
+            HEDGE_EXTRA_TOKENS.inc(getattr(usage, f'{kind}_tokens', None) or 0, model=self.model, kind=kind)
+        get_usage_tracker().record(self.model, usage, time.perf_counter() - self.sent[index])
+
+    def should_hedge(self, client, deadline):
+        """Decide, at the deadline, whether to send the hedge request."""
+        if client.saturated():
+            HEDGES.inc(outcome='skipped')
+            logger.info("No first token by the deadline, but the client is saturated; not hedging",
+                        extra={'deadline_seconds': round(deadline, 3)})
+            return False
+        self.hedged = True
+        logger.info("No first token by the deadline, sending a hedge request",
+                    extra={'deadline_seconds': round(deadline, 3)})
+        return True
+
+    def timeout(self, deadline, waiting):
+        """Return the seconds left before the hedge decision, or None while there is none to wait for."""
+        if not waiting or self.winner is not None or self.sent[_PRIMARY] is None:
+            return None
+        return max(0.0, deadline - (time.perf_counter() - self.sent[_PRIMARY]))
+
+
+def stream_text(client, hedger, **kwargs):
+    """
+    Yield the text of a streamed messages call, hedging it when it is slow to start.
+
+    Args:
+        client (APIClient): Client to send the requests with
+        hedger (Hedger): Decides whether and when to hedge
+        **kwargs: Arguments for the SDK's messages.stream
+
+    Yields:
+        str: Text as it arrives from the request that produced a token first
+
+    Raises:
+        Exception: The error of the request being read, or of both requests if neither produced a token
+    """
+    race = _Race(hedger, kwargs.get('model'))
+    deadline = hedger.deadline()
+    if deadline is None:
+        with client.stream(on_send=lambda: race.send(_PRIMARY), **kwargs) as stream:
+            first = True
+            for text in stream.text_stream:
+                if first:
+                    first = False
+                    race.first_token(_PRIMARY)
+                yield text
+        return
+
+    events = queue.Queue()
+
+    def attempt(index):
+        def sent():
+            race.send(index)
+            events.put((index, 'sent', None))
+
+        try:
+            with client.stream(on_send=sent, **kwargs) as stream:
+                first = True
+                for text in stream.text_stream:
+                    if first:
+                        first = False
+                        if not race.first_token(index):
+                            race.abandon(stream, index)
+                            raise _Abandoned
+                    if race.closed:
+                        raise _Abandoned
+                    events.put((index, 'text', text))
+            events.put((index, 'done', None))
+        except _Abandoned:
+            pass
+        except Exception as e:
+            events.put((index, 'error', e))
+
+    def launch(index):
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(attempt, index), daemon=True,
+                         name=f"api-{_ATTEMPT_NAMES[index]}").start()
+
+    launch(_PRIMARY)
+    failed = set()
+    waiting = True
+    try:
+        while True:
+            try:
+                index, kind, payload = events.get(timeout=race.timeout(deadline, waiting))
+            except queue.Empty:
+                waiting = False
+                if race.should_hedge(client, deadline):
+                    launch(_HEDGE)
+                continue
+            if kind == 'sent':
+                continue
+            if kind == 'error':
+                failed.add(index)
+                if index == race.winner or len(failed) == (2 if race.hedged else 1):
+                    raise payload
+            elif kind == 'done':
+                return
+            else:
+                yield payload
+    finally:
+        race.closed = True
+
+
+async def stream_text_async(client, hedger, **kwargs):
+    """The asyncio form of stream_text, for AsyncAPIClient."""
+    race = _Race(hedger, kwargs.get('model'))
+    deadline = hedger.deadline()
+    if deadline is None:
+        async with client.stream(on_send=lambda: race.send(_PRIMARY), **kwargs) as stream:
+            first = True
+            async for text in stream.text_stream:
+                if first:
+                    first = False
+                    race.first_token(_PRIMARY)
+                yield text
+        return
+
+    events = asyncio.Queue()
+
+    async def attempt(index):
+        def sent():
+            race.send(index)
+            events.put_nowait((index, 'sent', None))
+
+        try:
+            async with client.stream(on_send=sent, **kwargs) as stream:
+                first = True
+                async for text in stream.text_stream:
+                    if first:
+                        first = False
+                        if not race.first_token(index):
+                            race.abandon(stream, index)
+                            raise _Abandoned
+                    if race.closed:
+                        raise _Abandoned
+                    events.put_nowait((index, 'text', text))
+            events.put_nowait((index, 'done', None))
+        except _Abandoned:
+            pass
+        except Exception as e:
+            events.put_nowait((index, 'error', e))
+
+    def launch(index):
+        task = asyncio.ensure_future(attempt(index))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    launch(_PRIMARY)
+    failed = set()
+    waiting = True
+    try:
+        while True:
+            try:
+                index, kind, payload = await asyncio.wait_for(events.get(), race.timeout(deadline, waiting))
+            except asyncio.TimeoutError:
+                waiting = False
+                if race.should_hedge(client, deadline):
+                    launch(_HEDGE)
+                continue
+            if kind == 'sent':
+                continue
+            if kind == 'error':
+                failed.add(index)
+                if index == race.winner or len(failed) == (2 if race.hedged else 1):
+                    raise payload
+            elif kind == 'done':
+                return
+            else:
+                yield payload
+    finally:
+        race.closed = True
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """Return the process-wide hedger, configured from the environment."""
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_WINDOW)
+    return _hedger
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS history ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " result_id TEXT NOT NULL UNIQUE,"
+    " created_at REAL NOT NULL,"
+    " filename TEXT,"
+    " conditions TEXT NOT NULL,"
+    " medications TEXT NOT NULL,"
+    " document TEXT NOT NULL,"
+    " result TEXT NOT NULL,"
+    " owner TEXT)",
+    "CREATE INDEX IF NOT EXISTS history_created ON history (created_at)",
+    "CREATE INDEX IF NOT EXISTS history_owner ON history (owner, id)",
+    # Full-text index over the history table's own columns (external content)
+    "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+    " document, conditions, medications, content='history', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS history_insert AFTER INSERT ON history BEGIN"
+    " INSERT INTO history_fts (rowid, document, conditions, medications)"
+    " VALUES (new.id, new.document, new.conditions, new.medications); END",
+    "CREATE TRIGGER IF NOT EXISTS history_delete AFTER DELETE ON history BEGIN"
+    " INSERT INTO history_fts (history_fts, rowid, document, conditions, medications)"
+    " VALUES ('delete', old.id, old.document, old.conditions, old.medications); END",
+)
+
+_ENTRY_COLUMNS = "h.id, h.result_id, h.created_at, h.filename, h.conditions, h.medications"
+
+
+class AnalysisHistory:
+    """
+    A persistent, searchable record of completed analyses in SQLite.
+
+    Each entry keeps the analysis result with the extracted document text,
+    the condition and medication names, when it was made, and its owner,
+    the session that made it. Entries are only ever read back for their
+    owner. The text fields are indexed with FTS5 for search. Listing and
+    search page backwards from a cursor on the row id, so every page is an
+    index range scan however deep it is. Entries older than ``ttl``
+    seconds, or beyond the newest ``max_entries``, are removed.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=10000):
+        """
+        Initialize the history, creating the database file if needed.
+
+        Args:
+            path (str): Path to the SQLite database file
+            ttl (float): Seconds an entry is kept, or None for no expiry
+            max_entries (int): Maximum number of entries kept
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA[0])
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(history)")}
+        if 'owner' not in columns:
+            # Entries recorded before owners existed belong to no one and are never returned
+            self._conn.execute("ALTER TABLE history ADD COLUMN owner TEXT")
+        for statement in _SCHEMA[1:]:
+            self._conn.execute(statement)
+
+    def record(self, result_id, analysis_result, document, owner, filename=None):
+        """
+        Add a completed analysis to the history.
+
+        Results that report an error are not recorded.
+
+        Args:
+            result_id (str): Id the result was stored under
+            analysis_result (str): JSON string produced by MedicalAnalyzer
+            document (str): Extracted text the analysis was made from
+            owner (str): Key of the session the analysis was made for
+            filename (str): Name of the uploaded file, if known
+
+        Returns:
+            bool: Whether the analysis was recorded
+        """
+        result = json.loads(analysis_result)
+        if result.get('error'):
+            return False
+        diagnoses = result.get('diagnoses') or []
+        conditions = _unique(diagnosis.get('condition') for diagnosis in diagnoses)
+        medications = _unique(medication.get('name') for diagnosis in diagnoses
+                              for medication in diagnosis.get('medications') or [])
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO history"
+                    " (result_id, created_at, filename, conditions, medications, document, result, owner)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (result_id) DO NOTHING",
+                    (result_id, now, filename, '\n'.join(conditions), '\n'.join(medications), document,
+                     analysis_result, owner),
+                )
+                self._prune(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def load(self, result_id, owner):
+        """Return the stored analysis result for result_id, or None if it is not in owner's history."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM history WHERE result_id = ? AND owner = ?",
+                                     (result_id, owner)).fetchone()
+        return row[0] if row else None
+
+    def list(self, owner, limit=20, before=None, since=None, until=None):
+        """
+        Return a page of owner's entries, newest first.
+
+        Args:
+            owner (str): Key of the session whose entries are listed
+            limit (int): Maximum number of entries
+            before (int): Cursor returned with the previous page
+            since (float): Only entries made at or after this Unix time
+            until (float): Only entries made before this Unix time
+
+        Returns:
+            tuple: (entries, cursor for the next page or None)
+        """
+        where, params = _page_filter('h', owner, before, since, until)
+        query = f"SELECT {_ENTRY_COLUMNS} FROM history h {where} ORDER BY h.id DESC LIMIT ?"
+        return self._page(query, params, limit)
+
+    def search(self, owner, text, limit=20, before=None, since=None, until=None):
+        """
+        Return a page of owner's entries matching text, newest first.
+
+        Every word of text must occur in the document, a condition, or a
+        medication; words match as prefixes, so "pneum" finds "pneumonia".
+
+        Args:
+            owner (str): Key of the session whose entries are searched
+            text (str): Words to search for
+            limit (int): Maximum number of entries
+            before (int): Cursor returned with the previous page
+            since (float): Only entries made at or after this Unix time
+            until (float): Only entries made before this Unix time
+
+        Returns:
+            tuple: (entries with a "snippet" of the matching text, cursor for the next page or None)
+
+        Raises:
+            ValueError: If text contains no words
+        """
+        words = re.findall(r'\w+', text)
+        if not words:
+            raise ValueError("Search text contains no words")
+        match = ' '.join(f'"{word}"*' for word in words)
+        where, params = _page_filter('history_fts', owner, before, since, until)
+        # Ordering by the index's own rowid lets FTS5 walk matches newest
+        # first and stop after one page, instead of sorting every match
+        query = (
+            f"SELECT {_ENTRY_COLUMNS}, snippet(history_fts, -1, '[', ']', '...', 16)"
+            f" FROM history_fts JOIN history h ON h.id = history_fts.rowid"
+            f" {where} AND history_fts MATCH ? ORDER BY history_fts.rowid DESC LIMIT ?"
+        )
+        return self._page(query, params + [match], limit)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def _page(self, query, params, limit):
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit + 1]).fetchall()
+        entries = [_entry(row) for row in rows[:limit]]
+        cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return entries, cursor
+
+    def _prune(self, now):
+        """Drop expired entries and those older than the newest max_entries."""
+        if self.ttl:
+            self._conn.execute("DELETE FROM history WHERE created_at < ?", (now - self.ttl,))
+        # Ids only grow, so the newest max_entries entries are those within
+        # max_entries of the largest id; this avoids counting the table
+        self._conn.execute(
+            "DELETE FROM history WHERE id <= (SELECT MAX(id) FROM history) - ?", (self.max_entries,))
+
+
+def _unique(names):
+    seen = {}
+    for name in names:
+        if name and name.lower() not in seen:
+            seen[name.lower()] = name
+    return list(seen.values())
+
+
+def _page_filter(id_table, owner, before, since, until):
+    clauses, params = ["h.owner = ?"], [owner]
+    id_column = 'h.id' if id_table == 'h' else f'{id_table}.rowid'
+    for clause, value in ((f"{id_column} < ?", before), ("h.created_at >= ?", since),
+                          ("h.created_at < ?", until)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    return "WHERE " + " AND ".join(clauses), params
+
+
+def _entry(row):
+    entry = {
+        'result_id': row[1],
+        'created_at': row[2],
+        'filename': row[3],
+        'conditions': row[4].split('\n') if row[4] else [],
+        'medications': row[5].split('\n') if row[5] else [],
+    }
+    if len(row) > 6:
+        entry['snippet'] = row[6]
+    return entry
+
+
+def create_analysis_history():
+    """
+    Build an AnalysisHistory from environment configuration.
+
+    ANALYSIS_HISTORY_DB is the database file; the history is disabled
+    unless it is set. ANALYSIS_HISTORY_TTL is how long entries are kept
+    in seconds (0 keeps them until evicted) and ANALYSIS_HISTORY_MAX_ENTRIES
+    bounds their number.
+
+    Returns:
+        AnalysisHistory: The configured history, or None if it is disabled
+    """
+    path = os.environ.get("ANALYSIS_HISTORY_DB", "")
+    if not path:
+        return None
+    return AnalysisHistory(
+        path,
+        ttl=float(os.environ.get("ANALYSIS_HISTORY_TTL", 30 * 24 * 60 * 60)) or None,
+        max_entries=int(os.environ.get("ANALYSIS_HISTORY_MAX_ENTRIES", 10000)),
+    )
+
+
+_analysis_history = None
+_analysis_history_created = False
+_analysis_history_lock = threading.Lock()
+
+
+def get_analysis_history():
+    """Return the process-wide analysis history, or None if it is disabled."""
+    global _analysis_history, _analysis_history_created
+    if not _analysis_history_created:
+        with _analysis_history_lock:
+            if not _analysis_history_created:
+                _analysis_history = create_analysis_history()
+                _analysis_history_created = True
+    return _analysis_history
+
+
+def record_analysis(result_id, analysis_result, document, owner, filename=None):
+    """
+    Record an analysis in owner's history, if the history is enabled.
+
+    A failure to open the history or to record is logged rather than
+    raised, so the history can never fail an analysis that has already
+    succeeded.
+    """
+    try:
+        history = get_analysis_history()
+        if history is not None:
+            history.record(result_id, analysis_result, document, owner, filename)
+    except (OSError, sqlite3.Error, ValueError):
+        logger.exception("Recording analysis history failed")
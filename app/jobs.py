@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.file_processor import FileProcessor
+from app.analyzer import MedicalAnalyzer
+from app.history import record_analysis
+from app.result_store import get_result_store
+from app.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """
+    The state of one queued analysis: its status and per-stage timings.
+    """
+
+    def __init__(self, filename, result_id, owner=None):
+        """
+        Initialize a queued job.
+
+        Args:
+            filename (str): Name of the uploaded file
+            result_id (str): Result store id the analysis will be saved under
+            owner (str): History key of the session that submitted the job
+        """
+        self.id = secrets.token_urlsafe(16)
+        self.filename = filename
+        self.result_id = result_id
+        self.owner = owner
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.extraction_seconds = None
+        self.analysis_seconds = None
+        self.finished = threading.Event()
+
+    def to_dict(self):
+        """Return the job state as a JSON-serializable dict."""
+        now = time.time()
+        started = self.started_at or now
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'error': self.error,
+            'result_id': self.result_id if self.status == 'done' else None,
+            'timings': {
+                'queued_seconds': round(started - self.created_at, 3),
+                'extraction_seconds': self.extraction_seconds,
+                'analysis_seconds': self.analysis_seconds,
+                'total_seconds': round((self.finished_at or now) - self.created_at, 3),
+            },
+        }
+
+
+class JobQueue:
+    """
+    Runs uploads through extraction and analysis on a bounded worker pool.
+
+    LLM calls run on a thread pool, since they spend their time waiting on
+    the network. Extraction optionally runs on a process pool so that large
+    PDFs do not hold the GIL while other jobs are being analyzed.
+    """
+
+    def __init__(self, analysis_workers=4, extraction_processes=0, max_pending=64, max_jobs=1000):
+        """
+        Initialize the queue and its worker pools.
+
+        Args:
+            analysis_workers (int): Number of threads running jobs
+            extraction_processes (int): Size of the extraction process pool,
+                or 0 to extract in the job's own thread
+            max_pending (int): Maximum number of queued or running jobs
+            max_jobs (int): Number of finished jobs remembered for status lookups
+        """
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self._threads = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix='analysis')
+        self._processes = None
+        if extraction_processes > 0:
+            from concurrent.futures import ProcessPoolExecutor
+            self._processes = ProcessPoolExecutor(max_workers=extraction_processes)
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, source, filename, result_id, owner=None):
+        """
+        Queue an uploaded file for analysis.
+
+        If source is a path, the job takes ownership of the file and removes
+        it once extracted.
+
+        Args:
+            source (bytes or str): The upload's contents, or the path of the saved upload
+            filename (str): Original name of the uploaded file
+            result_id (str): Result store id the analysis will be saved under
+            owner (str): History key of the session submitting the job
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already queued or running
+        """
+        job = Job(filename, result_id, owner)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"Analysis queue is full ({self.max_pending} jobs pending)")
+            self._pending += 1
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.finished.is_set():
+                    break
+                del self._jobs[oldest_id]
+        self._threads.submit(self._run, job, source)
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given id, or None if it is unknown."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, source):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            stage_start = time.time()
+            try:
+                if self._processes is not None:
+                    patient_data = self._processes.submit(FileProcessor.process_file, source, job.filename).result()
+                else:
+                    patient_data = FileProcessor.process_file(source, job.filename)
+            finally:
+                if isinstance(source, str) and os.path.exists(source):
+                    os.remove(source)
+            job.extraction_seconds = round(time.time() - stage_start, 3)
+            STAGE_SECONDS.observe(job.extraction_seconds, stage='extract')
+
+            stage_start = time.time()
+            analysis_result = MedicalAnalyzer().analyze_patient_data(patient_data)
+            job.analysis_seconds = round(time.time() - stage_start, 3)
+            STAGE_SECONDS.observe(job.analysis_seconds, stage='analyze')
+
+            get_result_store().save(analysis_result, result_id=job.result_id)
+            record_analysis(job.result_id, analysis_result, patient_data, job.owner, job.filename)
+            error = json.loads(analysis_result).get('error')
+            if error:
+                job.error = error
+                job.status = 'failed'
+            else:
+                job.status = 'done'
+        except Exception as e:
+            logger.exception("Analysis job failed", extra={'job_id': job.id})
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            job.finished.set()
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Return the process-wide job queue, creating it on first use.
+
+    JOB_WORKERS sets the number of analysis threads, JOB_EXTRACT_PROCESSES
+    the extraction process pool size (0 extracts in the analysis thread),
+    and JOB_MAX_PENDING the queue bound.
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    analysis_workers=int(os.environ.get("JOB_WORKERS", 4)),
+                    extraction_processes=int(os.environ.get("JOB_EXTRACT_PROCESSES", 0)),
+                    max_pending=int(os.environ.get("JOB_MAX_PENDING", 64)),
+                )
+    return _job_queue
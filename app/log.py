@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import sys
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats records as one line of text followed by their fields as key=value pairs."""
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the id of the current HTTP request, if any, to every record."""
+
+    def filter(self, record):
+        if hasattr(record, 'request_id'):
+            return True
+        from flask import g, has_request_context
+        if has_request_context():
+            request_id = g.get('request_id')
+            if request_id:
+                record.request_id = request_id
+        return True
+
+
+def configure_logging():
+    """
+    Configure the ``app`` loggers from the environment.
+
+    LOG_LEVEL sets the level (default INFO) and LOG_FORMAT selects ``text``
+    (key=value fields) or ``json`` output. Records go to stderr.
+    """
+    logger = logging.getLogger('app')
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(KeyValueFormatter())
+    handler.addFilter(RequestContextFilter())
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
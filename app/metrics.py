@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds, from in-memory stages up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the count for the given label values."""
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """Return (name, labels, value) tuples in exposition order."""
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, optionally split by labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one observation for the given label values."""
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        """Return (name, labels, value) tuples in exposition order."""
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(float(bound))), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Holds metrics and renders them in the Prometheus text exposition format.
+
+    Besides metrics updated as events happen, collectors can be added:
+    callables returning ``(name, type, help, samples)`` tuples, where samples
+    is a list of ``(labels, value)`` pairs read from existing counters at
+    scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric and return it."""
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Add a callable producing metrics at scrape time."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Return all metrics as Prometheus exposition text."""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}"
+                         for name, labels, value in metric.samples())
+        for collector in collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'maude_stage_duration_seconds', 'Time spent in each stage of handling an upload.', ['stage']))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'maude_http_requests_total', 'HTTP requests handled, by endpoint and status code.', ['endpoint', 'status']))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'maude_http_request_duration_seconds', 'Time to produce a response, by endpoint.', ['endpoint']))
+ANALYSIS_ERRORS = REGISTRY.register(Counter(
+    'maude_analysis_errors_total', 'Analyses that ended in an error result, by error type.', ['error']))
+MODEL_ROUTES = REGISTRY.register(Counter(
+    'maude_model_routes_total', 'Analysis calls routed to each model.', ['model']))
+FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    'maude_api_first_token_seconds',
+    'Time to the first streamed token: of each primary and hedge request from when it was sent, '
+    'and "effective", to the first token of either, from when the primary request was sent.', ['attempt']))
+HEDGES = REGISTRY.register(Counter(
+    'maude_hedged_requests_total',
+    'Hedge decisions: requests sent, by whether the hedge answered first, and hedges skipped '
+    'because the client was saturated.', ['outcome']))
+HEDGE_SAVED_SECONDS = REGISTRY.register(Counter(
+    'maude_hedge_saved_seconds_total',
+    'Time to first token saved by hedges that answered first, where the primary request later answered.'))
+HEDGE_EXTRA_TOKENS = REGISTRY.register(Counter(
+    'maude_hedge_extra_tokens_total',
+    'Tokens billed for the abandoned request of each hedged pair, by model and kind as in maude_api_tokens_total.',
+    ['model', 'kind']))
+
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'maude_admission_rejected_total', 'Analysis requests turned away with 429, by reason.', ['reason']))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'maude_admission_wait_seconds', 'Time admitted analysis requests waited for a slot.'))
+
+_current_timer = ContextVar('stage_timer', default=None)
+
+
+class StageTimer:
+    """
+    Collects the stage durations of one request.
+
+    While a timer is active, every ``timed_stage`` block in the same context
+    adds its duration to it, so stages timed deep inside the analyzer are
+    reported with the request that caused them.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def activate(self):
+        """Make this the timer that timed_stage blocks report to."""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+    def add(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        """Format the durations as a Server-Timing header value."""
+        return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.timings.items())
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Time a block as the named stage.
+
+    The duration is recorded in the stage histogram and added to the active
+    StageTimer, if any, whether or not the block raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.add(stage, seconds)
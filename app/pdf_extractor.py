@@ -0,0 +1,220 @@
+import io
+import logging
+import os
+import threading
+
+# Pages are joined with a form feed, the conventional page break in
+# extracted text, so later stages can still split on page boundaries
+PAGE_SEPARATOR = '\f'
+
+logger = logging.getLogger(__name__)
+
+# Defaults bounding the work done for a single PDF
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 1000))
+PDF_MAX_CHARS = int(os.environ.get("PDF_MAX_CHARS", 2000000))
+# Smaller documents are extracted in-process; shipping them to a pool costs more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 32))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ExtractedText(str):
+    """Extracted text together with warnings about how it was extracted, such as truncation."""
+
+    def __new__(cls, text, warnings=()):
+        self = super().__new__(cls, text)
+        self.warnings = tuple(warnings)
+        return self
+
+    def __reduce__(self):
+        # Keeps the warnings when the text is returned from a worker process
+        return ExtractedText, (str(self), self.warnings)
+
+
+def _get_pool(workers):
+    """Return the shared extraction process pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # multiprocessing is only loaded once a large PDF needs it
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Forking a server that runs threads can copy a lock another
+                # thread holds into the child, so workers start from a fresh
+                # interpreter instead
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def _discard_pool(pool):
+    """Stop using a broken pool, so the next large PDF creates a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_range(data, start, stop):
+    """
+    Extract the text of pages [start, stop) in a worker process.
+
+    Args:
+        data (bytes): Contents of the PDF
+
+    Returns:
+        list: The text of each page in the range
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [reader.pages[index].extract_text() for index in range(start, stop)]
+
+
+def iter_pdf_pages(source, workers=None, max_pages=None, max_chars=None, warnings=None):
+    """
+    Yield the text of each page of a PDF, in order, as it is extracted.
+
+    Extraction stops after max_pages pages or once max_chars characters
+    have been produced, truncating the final page, so huge documents are
+    bounded in both time and memory. The PAGE_SEPARATOR that joins each
+    page to the one before it counts towards max_chars. Truncation is logged and described in
+    warnings. Documents with at least PDF_PARALLEL_MIN_PAGES pages are
+    split into page ranges extracted on a shared process pool.
+
+    Args:
+        source: Path to the PDF, its contents as bytes, or a binary stream
+        workers (int): Number of extraction processes (1 extracts in-process)
+        max_pages (int): Maximum number of pages to extract
+        max_chars (int): Maximum number of characters to produce
+        warnings (list): If given, a description of any truncation is appended to it
+
+    Yields:
+        str: The text of one page
+    """
+    workers = workers or PDF_EXTRACT_WORKERS
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    remaining = PDF_MAX_CHARS if max_chars is None else max_chars
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            yield from iter_pdf_pages(file, workers, max_pages, remaining, warnings)
+        return
+
+    # Imported on first use, so that starting the app does not pay for it
+    import PyPDF2
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    reader = PyPDF2.PdfReader(source)
+    total_pages = len(reader.pages)
+    page_count = min(total_pages, max_pages)
+
+    pages = None
+    if workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+        pages = _submit_ranges(source, reader, page_count, workers)
+    if pages is None:
+        pages = (reader.pages[index].extract_text() for index in range(page_count))
+
+    max_chars = remaining
+    for number, text in enumerate(pages, 1):
+        separator = len(PAGE_SEPARATOR) if number > 1 else 0
+        if separator + len(text) > remaining:
+            if remaining > separator:
+                yield text[:remaining - separator]
+            _truncated(warnings, f"The document was too long to analyze in full; only its first {max_chars} "
+                                 f"characters, up to page {number} of {total_pages}, were analyzed.",
+                       pages=number, total_pages=total_pages, chars=max_chars)
+            return
+        remaining -= separator + len(text)
+        yield text
+
+    if total_pages > page_count:
+        _truncated(warnings, f"The document was too long to analyze in full; only its first {page_count} "
+                             f"of {total_pages} pages were analyzed.",
+                   pages=page_count, total_pages=total_pages, chars=max_chars - remaining)
+
+
+def _truncated(warnings, message, **fields):
+    """Log that extraction stopped at a limit and add message to warnings."""
+    logger.warning("PDF extraction truncated", extra=fields)
+    if warnings is not None:
+        warnings.append(message)
+
+
+def _submit_ranges(source, reader, page_count, workers):
+    """
+    Split the pages into one contiguous range per worker and submit them.
+
+    Returns:
+        generator: Page texts in order, or None if no process pool is
+            available (as on serverless platforms without /dev/shm)
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    source.seek(0)
+    data = source.read()
+    # One range per worker, since each range ships a copy of the document
+    range_size = -(-page_count // workers)
+    ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+
+    pool = None
+    try:
+        pool = _get_pool(workers)
+        futures = [pool.submit(_extract_range, data, start, stop) for start, stop in ranges]
+    except BrokenProcessPool as e:
+        # A worker died since the last document; the next one gets a new pool
+        logger.warning("PDF process pool broke, extracting serially", extra={'error': str(e)})
+        _discard_pool(pool)
+        return None
+    except (OSError, NotImplementedError, RuntimeError) as e:
+        logger.warning("PDF process pool unavailable, extracting serially", extra={'error': str(e)})
+        return None
+    return _collect(pool, futures, ranges, reader)
+
+
+def _collect(pool, futures, ranges, reader):
+    """
+    Yield the page texts of each range future in submission order.
+
+    If a worker dies, the pool is discarded and the pages not yet yielded
+    are extracted in-process.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    try:
+        for future, (start, stop) in zip(futures, ranges):
+            try:
+                texts = future.result()
+            except BrokenProcessPool as e:
+                logger.warning("PDF process pool broke, extracting serially", extra={'error': str(e)})
+                _discard_pool(pool)
+                texts = (reader.pages[index].extract_text() for index in range(start, stop))
+            yield from texts
+    finally:
+        # Stopping early (for example at max_chars) should not leave work queued
+        for future in futures:
+            future.cancel()
+
+
+def extract_pdf_text(source, workers=None, max_pages=None, max_chars=None):
+    """
+    Extract the text of a PDF, joining the pages once at the end.
+
+    Args:
+        source: Path to the PDF, its contents as bytes, or a binary stream
+        workers (int): Number of extraction processes (1 extracts in-process)
+        max_pages (int): Maximum number of pages to extract
+        max_chars (int): Maximum number of characters to produce
+
+    Returns:
+        str: The text of all extracted pages separated by form feeds; an
+            ExtractedText carrying a warning if the document was truncated
+    """
+    warnings = []
+    text = PAGE_SEPARATOR.join(iter_pdf_pages(source, workers, max_pages, max_chars, warnings))
+    return ExtractedText(text, warnings) if warnings else text
@@ -0,0 +1,214 @@
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from app.cache import LRUCache, SQLiteCache
+
+# Result ids are generated by secrets.token_urlsafe, so anything else is rejected
+# before it reaches a backend (and, for the filesystem store, a path)
+_RESULT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class DirectoryStore:
+    """
+    A filesystem-backed key/value store holding one file per entry.
+
+    Entries expire ``ttl`` seconds after they were written and the oldest
+    files are removed once more than ``max_entries`` are stored. Write
+    times are kept in an index, oldest first, so a write prunes without
+    listing the directory. The index is built from the directory at
+    startup and rebuilt every ``rescan_interval`` seconds, which picks up
+    the entries other processes sharing the directory have written.
+    """
+
+    def __init__(self, directory, ttl=None, max_entries=1000, rescan_interval=60):
+        """
+        Initialize the store, creating the directory if needed.
+
+        Args:
+            directory (str): Directory holding the entry files
+            ttl (float): Seconds an entry stays valid, or None for no expiry
+            max_entries (int): Maximum number of files kept
+            rescan_interval (float): Seconds between rebuilds of the index from the directory
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def get(self, key):
+        """Return the stored value for key, or None if missing or expired."""
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl <= time.time():
+                self.delete(key)
+                return None
+            with open(path, 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        """Write value under key and prune expired or excess entries."""
+        path = self._path(key)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(value)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._index.pop(path, None)
+            self._index[path] = time.time()
+            if time.monotonic() - self._scanned_at >= self.rescan_interval:
+                self._scan()
+            self._prune()
+
+    def delete(self, key):
+        """Remove key from the store if present."""
+        path = self._path(key)
+        with self._lock:
+            self._index.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _scan(self):
+        """Rebuild the index of write times from the directory; the lock must be held once the store is shared."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        self._index = OrderedDict((path, mtime) for mtime, path in entries)
+        self._scanned_at = time.monotonic()
+
+    def _prune(self):
+        """Drop expired files, then the oldest ones until under max_entries; the lock must be held."""
+        now = time.time()
+        while self._index:
+            path, mtime = next(iter(self._index.items()))
+            expired = self.ttl and mtime + self.ttl <= now
+            if not expired and len(self._index) <= self.max_entries:
+                break
+            del self._index[path]
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class ResultStore:
+    """
+    Holds analysis results server-side under opaque ids, so that only the id
+    needs to travel in the session cookie.
+    """
+
+    def __init__(self, backend):
+        """
+        Initialize the store.
+
+        Args:
+            backend: An LRUCache, SQLiteCache, or DirectoryStore
+        """
+        self.backend = backend
+
+    def new_id(self):
+        """Return a fresh result id, for callers that must hand it out before saving."""
+        return secrets.token_urlsafe(16)
+
+    def save(self, analysis_result, result_id=None):
+        """
+        Store an analysis result.
+
+        Args:
+            analysis_result (str): JSON string produced by MedicalAnalyzer
+            result_id (str): Id from new_id to store under, or None for a new one
+
+        Returns:
+            str: The id under which the result can be loaded
+        """
+        result_id = result_id or self.new_id()
+        self.backend.set(result_id, analysis_result)
+        return result_id
+
+    def load(self, result_id):
+        """
+        Load a stored analysis result.
+
+        Args:
+            result_id (str): Id returned by save
+
+        Returns:
+            str: The JSON result, or None if it is unknown or has expired
+        """
+        if not result_id or not _RESULT_ID_PATTERN.match(result_id):
+            return None
+        return self.backend.get(result_id)
+
+
+def create_result_store():
+    """
+    Build a ResultStore from environment configuration.
+
+    RESULT_STORE selects the backend: "memory" (default), "sqlite", or
+    "filesystem". RESULT_STORE_PATH is the database file or directory for the
+    persistent backends, RESULT_STORE_TTL the lifetime in seconds, and
+    RESULT_STORE_MAX_ENTRIES / RESULT_STORE_MAX_BYTES bound the footprint.
+
+    Returns:
+        ResultStore: The configured store
+
+    Raises:
+        ValueError: If RESULT_STORE names an unknown backend
+    """
+    kind = os.environ.get("RESULT_STORE", "memory").lower()
+    ttl = float(os.environ.get("RESULT_STORE_TTL", 60 * 60)) or None
+    max_entries = int(os.environ.get("RESULT_STORE_MAX_ENTRIES", 1000))
+
+    if kind == "memory":
+        backend = LRUCache(max_entries, ttl=ttl)
+    elif kind == "sqlite":
+        backend = SQLiteCache(
+            os.environ.get("RESULT_STORE_PATH", "/tmp/maude/results.db"),
+            ttl=ttl,
+            max_bytes=int(os.environ.get("RESULT_STORE_MAX_BYTES", 64 * 1024 * 1024)),
+        )
+    elif kind == "filesystem":
+        backend = DirectoryStore(
+            os.environ.get("RESULT_STORE_PATH", "/tmp/maude/results"),
+            ttl=ttl,
+            max_entries=max_entries,
+        )
+    else:
+        raise ValueError(f"Unsupported result store: {kind}")
+    return ResultStore(backend)
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Return the process-wide result store, creating it on first use."""
+    global _result_store
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                _result_store = create_result_store()
+    return _result_store
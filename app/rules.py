@@ -0,0 +1,223 @@
+import json
+import re
+import threading
+
+# Phrases that indicate each symptom; matched case-insensitively anywhere in the text
+SYMPTOMS = {
+    'fever': ('fever', 'temperature'),
+    'headache': ('headache',),
+    'cough': ('cough',),
+    'sore_throat': ('sore throat', 'throat pain'),
+    'fatigue': ('fatigue', 'tired'),
+}
+
+# Each rule fires when every group in "requires" has at least one of its symptoms
+# present. Diagnoses are reported in table order.
+RULES = [
+    {
+        'requires': (('fever',), ('cough', 'sore_throat')),
+        'diagnosis': {
+            "condition": "Common Cold or Upper Respiratory Infection",
+            "likelihood": "High",
+            "reasoning": "Patient reports symptoms consistent with viral upper respiratory infection including fever and respiratory symptoms.",
+            "medications": [
+                {
+                    "name": "Acetaminophen (Tylenol)",
+                    "dosage": "500-1000 mg",
+                    "frequency": "Every 6 hours as needed",
+                    "duration": "Until symptoms resolve",
+                    "notes": "For fever and pain relief. Do not exceed 4000 mg per day."
+                },
+                {
+                    "name": "Guaifenesin (Mucinex)",
+                    "dosage": "400 mg",
+                    "frequency": "Every 12 hours as needed",
+                    "duration": "Until symptoms resolve",
+                    "notes": "To help thin mucus secretions. Drink plenty of fluids."
+                }
+            ],
+            "additional_tests": ["If symptoms worsen or persist beyond 7 days, consider COVID-19 testing"]
+        },
+    },
+    {
+        'requires': (('headache',), ('fatigue',)),
+        'diagnosis': {
+            "condition": "Tension Headache",
+            "likelihood": "Medium",
+            "reasoning": "Patient reports headache with fatigue, consistent with tension headache possibly due to stress or dehydration.",
+            "medications": [
+                {
+                    "name": "Ibuprofen (Advil, Motrin)",
+                    "dosage": "400-600 mg",
+                    "frequency": "Every 6-8 hours as needed",
+                    "duration": "Until symptoms resolve",
+                    "notes": "Take with food to minimize gastrointestinal side effects."
+                }
+            ],
+            "additional_tests": ["If headaches are recurrent or worsening, consider neurological evaluation"]
+        },
+    },
+]
+
+# Reported when no rule fires
+FALLBACK_DIAGNOSIS = {
+    "condition": "Nonspecific Symptoms",
+    "likelihood": "Medium",
+    "reasoning": "Based on the limited information provided, a specific diagnosis cannot be determined with certainty.",
+    "medications": [
+        {
+            "name": "Supportive care",
+            "dosage": "N/A",
+            "frequency": "As needed",
+            "duration": "Until symptoms resolve",
+            "notes": "Rest, hydration, and monitoring of symptoms"
+        }
+    ],
+    "additional_tests": [
+        "Complete blood count (CBC)",
+        "Basic metabolic panel (BMP)",
+        "Follow up with primary care physician for further evaluation"
+    ]
+}
+
+OFFLINE_WARNINGS = [
+    "This is a mock response for testing only. No actual medical analysis was performed.",
+    "Development mode active: No API key provided or using test mode.",
+]
+OFFLINE_DISCLAIMER = "This analysis is not a substitute for professional medical advice. API key was not provided or invalid."
+
+
+class SymptomMatcher:
+    """
+    Finds which symptoms of a lexicon a text mentions, in one pass.
+
+    The phrases are compiled into one regular expression shaped as a trie
+    (``t(?:ired|hroat pain)`` rather than ``tired|throat pain``), so each
+    position of the document is tested against the lexicon's first letters
+    once rather than against every phrase in turn, and the cost of a scan
+    barely grows with the size of the lexicon. Phrases match anywhere, as
+    substrings, and the scan stops once every symptom has been seen.
+    """
+
+    def __init__(self, lexicon):
+        """
+        Compile the matcher.
+
+        Args:
+            lexicon (dict): Maps each symptom name to the phrases indicating it
+        """
+        phrases = {}
+        for symptom, symptom_phrases in lexicon.items():
+            for phrase in symptom_phrases:
+                phrases.setdefault(phrase.lower(), set()).add(symptom)
+        # A match also implies every phrase it contains ("sore throat" contains "sore")
+        self._implies = {
+            phrase: frozenset().union(*(symptoms for other, symptoms in phrases.items() if other in phrase))
+            for phrase in phrases
+        }
+        self.symptoms = frozenset(lexicon)
+        self.pattern = re.compile(_trie_pattern(phrases))
+
+    def find(self, text):
+        """
+        Return the set of symptoms mentioned in text.
+
+        Args:
+            text (str): Document to scan
+
+        Returns:
+            set: Names of the symptoms found
+        """
+        text = text.lower()
+        found = set()
+        for match in self.pattern.finditer(text):
+            found.update(self._implies[match.group()])
+            # Matches do not overlap, so look for phrases starting inside this one
+            for start in range(match.start() + 1, match.end()):
+                inner = self.pattern.match(text, start)
+                if inner:
+                    found.update(self._implies[inner.group()])
+            if len(found) == len(self.symptoms):
+                break
+        return found
+
+
+def _trie_pattern(phrases):
+    """Build a regular expression matching the longest of phrases, with shared prefixes factored out."""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+
+class RuleEngine:
+    """
+    A deterministic offline analysis driven by the symptom and rule tables.
+
+    Used when no API key is configured, and as a fast stand-in for the model
+    in development and load testing. Runs in time linear in the document.
+    """
+
+    def __init__(self, lexicon=SYMPTOMS, rules=RULES, fallback=FALLBACK_DIAGNOSIS):
+        """
+        Initialize the engine.
+
+        Args:
+            lexicon (dict): Maps each symptom name to the phrases indicating it
+            rules (list): Rules with "requires" symptom groups and a "diagnosis"
+            fallback (dict): Diagnosis reported when no rule fires
+        """
+        unknown = {symptom for rule in rules for group in rule['requires'] for symptom in group} - set(lexicon)
+        if unknown:
+            raise ValueError(f"Rules refer to symptoms missing from the lexicon: {', '.join(sorted(unknown))}")
+        self.matcher = SymptomMatcher(lexicon)
+        self.rules = rules
+        self.fallback = fallback
+
+    def diagnoses(self, text):
+        """Return the diagnoses of every rule the text satisfies, or the fallback."""
+        found = self.matcher.find(text)
+        matched = [rule['diagnosis'] for rule in self.rules
+                   if all(found.intersection(group) for group in rule['requires'])]
+        return matched or [self.fallback]
+
+    def analyze(self, text):
+        """
+        Analyze text and return the result in the format of a model analysis.
+
+        Args:
+            text (str): Patient data
+
+        Returns:
+            str: JSON analysis with diagnoses, warnings, and a disclaimer
+        """
+        return json.dumps({
+            "diagnoses": self.diagnoses(text),
+            "warnings": list(OFFLINE_WARNINGS),
+            "disclaimer": OFFLINE_DISCLAIMER,
+        })
+
+
+_rule_engine = None
+_rule_engine_lock = threading.Lock()
+
+
+def get_rule_engine():
+    """Return the process-wide rule engine, compiling it on first use."""
+    global _rule_engine
+    if _rule_engine is None:
+        with _rule_engine_lock:
+            if _rule_engine is None:
+                _rule_engine = RuleEngine()
+    return _rule_engine
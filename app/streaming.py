@@ -0,0 +1,99 @@
+import json
+
+
+class IncrementalJSONParser:
+    """
+    An incremental parser that picks complete objects out of one array in a
+    JSON document while the document is still being streamed.
+
+    Text is fed in arbitrary chunks. Each time an object inside the array
+    under ``array_key`` (at the top level of the document) closes, it is
+    decoded and returned from feed(). Anything before the first "{", such as
+    a ```json code fence, is ignored.
+    """
+
+    def __init__(self, array_key):
+        """
+        Initialize the parser.
+
+        Args:
+            array_key (str): Top-level key of the array whose items to emit
+        """
+        self.array_key = array_key
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars = None
+        self._last_key = None
+        self._array_depth = None
+        self._capture = None
+
+    def feed(self, text):
+        """
+        Consume the next chunk of the document.
+
+        Args:
+            text (str): The next piece of streamed text
+
+        Returns:
+            list: Objects from the array that were completed by this chunk
+        """
+        completed = []
+        for ch in text:
+            if self._capture is not None:
+                self._capture.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_chars is not None:
+                        self._last_key = ''.join(self._string_chars)
+                        self._string_chars = None
+                elif self._string_chars is not None:
+                    self._string_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                # Only top-level strings can be the key we are looking for
+                self._string_chars = [] if self._depth == 1 else None
+            elif ch == '{' or ch == '[':
+                if ch == '[' and self._depth == 1 and self._last_key == self.array_key:
+                    self._array_depth = self._depth + 1
+                elif ch == '{' and self._array_depth is not None and self._depth == self._array_depth:
+                    self._capture = ['{']
+                self._depth += 1
+            elif ch == '}' or ch == ']':
+                self._depth -= 1
+                if self._array_depth is None:
+                    continue
+                if ch == '}' and self._capture is not None and self._depth == self._array_depth:
+                    item = ''.join(self._capture)
+                    self._capture = None
+                    try:
+                        completed.append(json.loads(item))
+                    except ValueError:
+                        pass
+                elif ch == ']' and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+            elif ch == ',' and self._depth == 1:
+                self._last_key = None
+        return completed
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Events message.
+
+    Args:
+        event (str): Event name
+        data: JSON-serializable payload
+
+    Returns:
+        str: The encoded event, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
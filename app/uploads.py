@@ -0,0 +1,209 @@
+import codecs
+import hashlib
+import os
+import secrets
+import shutil
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+
+
+# Leading bytes of each binary format, and how far into the file they may start
+SIGNATURES = {
+    'pdf': (b'%PDF-', 1024),
+    'docx': (b'PK\x03\x04', 0),
+    'zip': (b'PK\x03\x04', 0),
+}
+
+
+class InvalidUpload(Exception):
+    """An upload whose contents do not match its file type."""
+
+
+class UploadValidator:
+    """
+    Checks an upload against its file type while it streams in.
+
+    PDF and DOCX uploads must start with their format's signature, and TXT
+    uploads must be valid UTF-8, so a mislabeled or corrupt file is caught
+    in its first chunk instead of by the parser after the whole body has
+    been received. The SHA-256 of the contents is computed along the way.
+    Other extensions are only hashed.
+    """
+
+    def __init__(self, filename):
+        """
+        Initialize the validator.
+
+        Args:
+            filename (str): Name of the uploaded file, which sets the expected format
+        """
+        self.extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._signature = SIGNATURES.get(self.extension)
+        self._head = b''
+        self._decoder = codecs.getincrementaldecoder('utf-8')() if self.extension == 'txt' else None
+
+    def feed(self, data):
+        """
+        Check and hash the next chunk of the upload.
+
+        Raises:
+            InvalidUpload: If the contents so far cannot be a file of this type
+        """
+        self.size += len(data)
+        self._hash.update(data)
+        if self._signature is not None:
+            self._head += data
+            self._check_signature(final=False)
+        if self._decoder is not None:
+            try:
+                self._decoder.decode(data)
+            except UnicodeDecodeError:
+                raise InvalidUpload("Text file is not valid UTF-8") from None
+
+    def finish(self):
+        """
+        Run the checks that need the whole upload.
+
+        Raises:
+            InvalidUpload: If the upload is empty or ends before its format allows
+        """
+        if self.size == 0:
+            raise InvalidUpload("Uploaded file is empty")
+        if self._signature is not None:
+            self._check_signature(final=True)
+        if self._decoder is not None:
+            try:
+                self._decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                raise InvalidUpload("Text file is not valid UTF-8") from None
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of the contents received so far."""
+        return self._hash.hexdigest()
+
+    def _check_signature(self, final):
+        magic, search_limit = self._signature
+        window = self._head[:search_limit + len(magic)]
+        if magic in window:
+            self._signature = None
+            self._head = b''
+        elif final or len(window) == search_limit + len(magic):
+            raise InvalidUpload(f"File is not a valid {self.extension.upper()} document")
+
+
+class ValidatingStream:
+    """
+    The container Werkzeug writes an uploaded file into, validating it on the way.
+
+    Writes are checked with an UploadValidator before they reach the spool.
+    With reject_early, the first invalid chunk raises InvalidUpload out of
+    form parsing, so the rest of the body is never read. Otherwise the
+    error is kept, later data is discarded, and verify() reports it, which
+    lets a batch fail one file without failing the others.
+    """
+
+    def __init__(self, spool, filename, reject_early=True):
+        self.spool = spool
+        self.validator = UploadValidator(filename or '')
+        self.reject_early = reject_early
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        try:
+            self.validator.feed(data)
+        except InvalidUpload as e:
+            if self.reject_early:
+                raise
+            self.error = e
+            return len(data)
+        return self.spool.write(data)
+
+    def verify(self):
+        """
+        Check the complete upload.
+
+        Raises:
+            InvalidUpload: If the upload is invalid
+        """
+        if self.error is None:
+            try:
+                self.validator.finish()
+            except InvalidUpload as e:
+                self.error = e
+        if self.error is not None:
+            raise self.error
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of the upload."""
+        return self.validator.sha256
+
+    def __getattr__(self, name):
+        return getattr(self.spool, name)
+
+    def __iter__(self):
+        return iter(self.spool)
+
+
+class SpooledRequest(Request):
+    """
+    A request class that keeps uploaded files in memory up to
+    UPLOAD_MEMORY_LIMIT bytes and only then spills them to an anonymous
+    temporary file in UPLOAD_FOLDER.
+
+    Werkzeug's default spills anything over 500 KB, which sends ordinary
+    PDFs to disk on every request.
+
+    Each file is validated as it is received (see ValidatingStream). Views
+    that report invalid files individually set reject_invalid_uploads to
+    False before reading request.files.
+    """
+
+    reject_invalid_uploads = True
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = SpooledTemporaryFile(
+            max_size=current_app.config['UPLOAD_MEMORY_LIMIT'],
+            mode='rb+',
+            dir=current_app.config['UPLOAD_FOLDER']
+        )
+        return ValidatingStream(spool, filename, reject_early=self.reject_invalid_uploads)
+
+
+def stream_size(stream):
+    """Return the size of a seekable stream, leaving it positioned at the start."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def detach_upload(stream, filename, directory, memory_limit):
+    """
+    Copy an upload out of the request so it can outlive it.
+
+    Small uploads are returned as bytes. Larger ones are written to a
+    uniquely named file so that concurrent uploads with the same name
+    cannot overwrite each other.
+
+    Args:
+        stream: Seekable binary stream holding the upload
+        filename (str): Sanitized name of the uploaded file
+        directory (str): Directory for uploads that are too large to keep in memory
+        memory_limit (int): Largest upload returned as bytes
+
+    Returns:
+        bytes or str: The upload contents, or the path of the file holding them
+    """
+    if stream_size(stream) <= memory_limit:
+        return stream.read()
+    path = os.path.join(directory, f"{secrets.token_hex(8)}-{filename}")
+    with open(path, 'wb') as target:
+        shutil.copyfileobj(stream, target)
+    return path
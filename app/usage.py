@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = ('input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'output_tokens')
+
+
+class UsageTracker:
+    """
+    Records the token usage and latency of every API request.
+
+    Keeps running totals per model and the most recent requests, so the
+    effect of prompt caching on cost and latency can be measured.
+    """
+
+    def __init__(self, max_recent=200):
+        """
+        Initialize the tracker.
+
+        Args:
+            max_recent (int): Number of individual requests kept
+        """
+        self._totals = {}
+        self._recent = deque(maxlen=max_recent)
+        self._lock = threading.Lock()
+
+    def record(self, model, usage, latency):
+        """
+        Record one completed request.
+
+        Args:
+            model (str): Model that served the request
+            usage: The ``usage`` object of the API response
+            latency (float): Seconds the request took
+
+        Returns:
+            dict: The recorded request
+        """
+        entry = {field: getattr(usage, field, None) or 0 for field in _FIELDS}
+        entry['model'] = model
+        entry['latency_seconds'] = round(latency, 3)
+        entry['timestamp'] = time.time()
+        with self._lock:
+            totals = self._totals.setdefault(model, dict.fromkeys(_FIELDS + ('requests', 'latency_seconds'), 0))
+            for field in _FIELDS:
+                totals[field] += entry[field]
+            totals['requests'] += 1
+            totals['latency_seconds'] += latency
+            self._recent.append(entry)
+        logger.info("Token usage", extra={field: entry[field] for field in _FIELDS})
+        return entry
+
+    def stats(self):
+        """
+        Return per-model totals and the most recent requests.
+
+        Each model's totals include ``cache_hit_ratio``, the share of prompt
+        tokens served from the provider's prompt cache.
+        """
+        with self._lock:
+            totals = {model: dict(values) for model, values in self._totals.items()}
+            recent = list(self._recent)
+        for values in totals.values():
+            prompt_tokens = (values['input_tokens'] + values['cache_creation_input_tokens']
+                             + values['cache_read_input_tokens'])
+            values['cache_hit_ratio'] = round(values['cache_read_input_tokens'] / prompt_tokens, 4) if prompt_tokens else 0.0
+            values['latency_seconds'] = round(values['latency_seconds'], 3)
+        return {'models': totals, 'recent': recent}
+
+
+_usage_tracker = None
+_usage_tracker_lock = threading.Lock()
+
+
+def get_usage_tracker():
+    """Return the process-wide usage tracker, creating it on first use."""
+    global _usage_tracker
+    if _usage_tracker is None:
+        with _usage_tracker_lock:
+            if _usage_tracker is None:
+                _usage_tracker = UsageTracker()
+    return _usage_tracker
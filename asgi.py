@@ -0,0 +1,4 @@
+from app.asgi import application
+
+# ASGI servers look for "app" by default, e.g. uvicorn asgi:app
+app = application
@@ -0,0 +1,190 @@
+"""
+Compare how many analyses one process can hold in flight, sync vs async.
+
+For each concurrency level, a fresh worker process sends that many
+simultaneous uploads to /analyze, either through the Flask app with one
+thread per request (as under a threaded WSGI server) or through the ASGI
+app on one event loop (see app.asgi). Both talk to the same fake Messages
+API (benchmarks.fake_anthropic), so model latency is fixed and only the
+serving model differs. Reports wall time, throughput, peak RSS and peak
+thread count per run.
+
+    python -m benchmarks.async_vs_sync --levels 10,50,200,500 --latency fixed:2
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.corpus import make_text
+from benchmarks.fake_anthropic import FakeAnthropicServer, add_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOUNDARY = 'benchmarkboundary'
+
+
+def _multipart(filename, data):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode('utf-8') + data + f'\r\n--{BOUNDARY}--\r\n'.encode('utf-8')
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _ThreadSampler:
+    """Records the highest thread count seen while active."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_sync(bodies):
+    """Send every upload at once through the Flask app, one thread per request."""
+    from app.app import app
+
+    def post(body):
+        response = app.test_client().post('/analyze', data=body,
+                                          content_type=f'multipart/form-data; boundary={BOUNDARY}')
+        return response.status_code == 200 and not response.get_json()['result'].get('error')
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as executor:
+        return list(executor.map(post, bodies))
+
+
+def run_async(bodies):
+    """Send every upload at once through the ASGI app on one event loop."""
+    from app.asgi import application
+
+    async def post(body):
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop() if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await application({
+            'type': 'http', 'http_version': '1.1', 'method': 'POST', 'path': '/analyze', 'query_string': b'',
+            'root_path': '', 'client': ('127.0.0.1', 0),
+            'headers': [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode('latin-1')),
+                        (b'content-length', str(len(body)).encode('latin-1'))],
+        }, receive, send)
+        body = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+        return sent[0]['status'] == 200 and not json.loads(body)['result'].get('error')
+
+    async def main():
+        return await asyncio.gather(*(post(body) for body in bodies))
+
+    return asyncio.run(main())
+
+
+def worker(mode, concurrency, pages):
+    """Run one measurement in this process and print it as JSON."""
+    run_id = uuid.uuid4().hex[:8]
+    bodies = [_multipart(f'record-{index}.txt', make_text(pages, record_id=f'{run_id}-{index}'))
+              for index in range(concurrency)]
+    # Import the app before measuring, so both modes start from the same baseline
+    if mode == 'sync':
+        import app.app  # noqa: F401
+    else:
+        import app.asgi  # noqa: F401
+    baseline_rss = _peak_rss_mb()
+
+    start = time.perf_counter()
+    with _ThreadSampler() as threads:
+        results = run_sync(bodies) if mode == 'sync' else run_async(bodies)
+    wall = time.perf_counter() - start
+    print(json.dumps({
+        'mode': mode,
+        'concurrency': concurrency,
+        'succeeded': sum(results),
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(sum(results) / wall, 2),
+        'baseline_rss_mb': round(baseline_rss, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'peak_threads': threads.peak,
+    }))
+
+
+def measure(mode, concurrency, pages, base_url):
+    """Run the worker for one mode and concurrency level in a fresh interpreter."""
+    env = dict(os.environ,
+               ANTHROPIC_BASE_URL=base_url,
+               ANTHROPIC_API_KEY_MAUDE=os.environ.get('ANTHROPIC_API_KEY_MAUDE') or 'fake-key',
+               # Lift the client-side limits so the serving model is the only bottleneck
+               ANTHROPIC_MAX_CONCURRENCY=str(concurrency),
+               ANTHROPIC_MAX_CONNECTIONS=str(concurrency),
+               ANTHROPIC_ASYNC_MAX_CONCURRENCY=str(concurrency),
+               ANTHROPIC_REQUESTS_PER_MINUTE='1000000',
+               ANTHROPIC_BURST=str(concurrency),
+               LOG_LEVEL='WARNING')
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.async_vs_sync', '--worker', mode,
+         '--concurrency', str(concurrency), '--pages', str(pages)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sync and async serving at increasing concurrency.")
+    parser.add_argument('--levels', default='10,50,200',
+                        help="comma-separated numbers of simultaneous requests")
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--pages', type=int, default=1, help="pages per generated document")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--worker', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--concurrency', type=int, help=argparse.SUPPRESS)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args.worker, args.concurrency, args.pages)
+        return 0
+
+    results = []
+    with FakeAnthropicServer(latency=args.latency, error_rate=args.error_rate,
+                             rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                             seed=args.seed) as fake:
+        print(f"{'mode':<6} {'in flight':>9} {'ok':>5} {'wall (s)':>9} {'req/s':>8} "
+              f"{'base RSS (MB)':>14} {'peak RSS (MB)':>14} {'threads':>8}")
+        for concurrency in (int(level) for level in args.levels.split(',')):
+            for mode in args.modes.split(','):
+                result = measure(mode, concurrency, args.pages, fake.base_url)
+                results.append(result)
+                print(f"{mode:<6} {concurrency:>9} {result['succeeded']:>5} {result['wall_seconds']:>9.2f} "
+                      f"{result['throughput_rps']:>8.1f} {result['baseline_rss_mb']:>14.1f} "
+                      f"{result['peak_rss_mb']:>14.1f} {result['peak_threads']:>8}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Synthetic patient documents for benchmarks and load tests.
+
+Run as a script to write a corpus of fixtures to a directory:
+
+    python -m benchmarks.corpus --out /tmp/corpus --pages 1,10,100,500
+"""
+import argparse
+import io
+import os
+import sys
+import zipfile
+
+import docx
+
+SAMPLE_PARAGRAPHS = [
+    "Patient is a 54-year-old presenting with fever of 38.9 C, productive cough and sore throat for four days.",
+    "History of type 2 diabetes managed with metformin 500 mg twice daily. No known drug allergies.",
+    "Reports fatigue and intermittent headache, worse in the evenings. Sleep has been poor.",
+    "On examination: pharyngeal erythema, bilateral crackles at the lung bases, no lymphadenopathy.",
+]
+
+# Non-ASCII text in Western European languages; these also fit the
+# WinAnsi encoding of the standard PDF fonts
+LATIN_PARAGRAPHS = [
+    "Température 39,2 °C, toux sèche et céphalées depuis trois jours; naïve aux AINS.",
+    "Blutdruck 135/85 mmHg, Größe 178 cm, Ödeme an beiden Knöcheln – Dosis 250 µg geprüft.",
+]
+# Text in other scripts, for the formats that can carry it
+SCRIPT_PARAGRAPHS = [
+    "Пациент жалуется на кашель и боль в горле. Ο ασθενής έχει πυρετό 38,5 °C.",
+    "患者は発熱と咳を訴えている。体温は三十九度。 ‘Follow-up’ in 7 days → re-check CRP ≤ 5 mg/L.",
+]
+
+LAB_ROWS = [
+    ("Hemoglobin", "13.2", "g/dL", "13.5-17.5"),
+    ("White cell count", "12.8", "x10^9/L", "4.0-11.0"),
+    ("C-reactive protein", "48", "mg/L", "<5"),
+    ("Creatinine", "88", "umol/L", "62-106"),
+]
+
+
+def make_text(pages, record_id=None, non_ascii=False):
+    """
+    Build a plain-text document of roughly the given number of pages.
+
+    Args:
+        pages (int): Number of page-sized sections to generate
+        record_id: Optional identifier written at the top, making the document unique
+        non_ascii (bool): Whether each section includes accented and non-Latin text
+
+    Returns:
+        bytes: The UTF-8 encoded text
+    """
+    paragraphs = SAMPLE_PARAGRAPHS * 3 + (LATIN_PARAGRAPHS + SCRIPT_PARAGRAPHS if non_ascii else [])
+    lines = [] if record_id is None else [f"Record number: {record_id}"]
+    for page in range(pages):
+        lines.append(f"Visit note {page + 1}")
+        lines.extend(paragraphs)
+        lines.append("Test | Result | Units | Reference")
+        lines.extend(' | '.join(row) for row in LAB_ROWS)
+        lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def make_pdf(pages, record_id=None, non_ascii=False):
+    """
+    Build a PDF document with the given number of pages of text.
+
+    The file is written directly, with one Helvetica text line per
+    paragraph, so no PDF library is needed. The standard fonts only cover
+    Western European characters, so non-ASCII pages use LATIN_PARAGRAPHS.
+
+    Args:
+        pages (int): Number of pages to generate
+        record_id: Optional identifier written at the top, making the document unique
+        non_ascii (bool): Whether each page includes accented text
+
+    Returns:
+        bytes: The PDF file contents
+    """
+    # Objects 1-3 are the catalog, page tree and font; each page adds a page and a content stream
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>"
+         % (' '.join(f"{4 + 2 * page} 0 R" for page in range(pages)), pages)).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for page in range(pages):
+        lines = [f"Visit note {page + 1}"] + SAMPLE_PARAGRAPHS * 2 + (LATIN_PARAGRAPHS if non_ascii else [])
+        lines += [' | '.join(row) for row in LAB_ROWS]
+        if page == 0 and record_id is not None:
+            lines.insert(0, f"Record number: {record_id}")
+        text = ' T* '.join('(%s) Tj' % _pdf_escape(line) for line in lines)
+        content = f"BT /F1 9 Tf 11 TL 40 750 Td {text} ET".encode('cp1252')
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                        "/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * page)).encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    output.write(b''.join(b"%010d 00000 n \n" % offset for offset in offsets))
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_docx(pages, tables=True, record_id=None, non_ascii=False):
+    """
+    Build a DOCX document of roughly the given number of pages.
+
+    Args:
+        pages (int): Number of page-sized sections to generate
+        tables (bool): Whether each section includes a lab results table
+        record_id: Optional identifier written at the top, making the document unique
+        non_ascii (bool): Whether each section includes accented and non-Latin text
+
+    Returns:
+        bytes: The DOCX file contents
+    """
+    paragraphs = SAMPLE_PARAGRAPHS * 3 + (LATIN_PARAGRAPHS + SCRIPT_PARAGRAPHS if non_ascii else [])
+    document = docx.Document()
+    if record_id is not None:
+        document.add_paragraph(f"Record number: {record_id}")
+    for page in range(pages):
+        document.add_heading(f"Visit note {page + 1}", level=2)
+        for paragraph in paragraphs:
+            document.add_paragraph(paragraph)
+        if tables:
+            table = document.add_table(rows=1, cols=4)
+            for cell, title in zip(table.rows[0].cells, ("Test", "Result", "Units", "Reference")):
+                cell.text = title
+            for row in LAB_ROWS:
+                for cell, value in zip(table.add_row().cells, row):
+                    cell.text = value
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_docx_fallback(pages, record_id=None, non_ascii=False):
+    """
+    Build a DOCX document whose main part is not at word/document.xml.
+
+    Some editors name the part differently; the package relationships
+    still point to it, so python-docx reads the file, but the streaming
+    extractor cannot and FileProcessor falls back to python-docx.
+
+    Args:
+        pages (int): Number of page-sized sections to generate
+        record_id: Optional identifier written at the top, making the document unique
+        non_ascii (bool): Whether each section includes accented and non-Latin text
+
+    Returns:
+        bytes: The DOCX file contents
+    """
+    renamed = {'word/document.xml': 'word/document2.xml',
+               'word/_rels/document.xml.rels': 'word/_rels/document2.xml.rels'}
+    source = zipfile.ZipFile(io.BytesIO(make_docx(pages, record_id=record_id, non_ascii=non_ascii)))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename in ('[Content_Types].xml', '_rels/.rels'):
+                data = data.replace(b'/word/document.xml', b'/word/document2.xml')
+                data = data.replace(b'"word/document.xml"', b'"word/document2.xml"')
+            target.writestr(renamed.get(item.filename, item.filename), data)
+    return buffer.getvalue()
+
+
+BUILDERS = {'txt': make_text, 'pdf': make_pdf, 'docx': make_docx, 'docx-fallback': make_docx_fallback}
+# File extension of the formats not named after one
+EXTENSIONS = {'docx-fallback': 'docx'}
+
+
+def write_corpus(directory, page_counts, formats=tuple(BUILDERS)):
+    """
+    Write a fixture for every format, page count, and ASCII or non-ASCII text.
+
+    Fixtures already in directory are kept, so a corpus is only built once.
+
+    Args:
+        directory (str): Directory to write the fixtures to
+        page_counts (list): Page counts to generate
+        formats (tuple): File extensions to generate
+
+    Returns:
+        list: One dict per fixture with its name, format, pages, non_ascii flag and path
+    """
+    os.makedirs(directory, exist_ok=True)
+    fixtures = []
+    for format in formats:
+        for pages in page_counts:
+            for non_ascii in (False, True):
+                name = f"{format}/{pages}p" + ('-non-ascii' if non_ascii else '')
+                path = os.path.join(directory, name.replace('/', '-') + f'.{EXTENSIONS.get(format, format)}')
+                if not os.path.exists(path):
+                    with open(path, 'wb') as file:
+                        file.write(BUILDERS[format](pages, non_ascii=non_ascii))
+                fixtures.append({'name': name, 'format': format, 'pages': pages,
+                                 'non_ascii': non_ascii, 'path': path})
+    return fixtures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic patient documents to a directory.")
+    parser.add_argument('--out', required=True, help="directory to write the fixtures to")
+    parser.add_argument('--pages', default='1,10,100,500', help="comma-separated page counts")
+    parser.add_argument('--formats', default=','.join(BUILDERS), help="comma-separated file types")
+    args = parser.parse_args(argv)
+
+    fixtures = write_corpus(args.out, [int(pages) for pages in args.pages.split(',')], args.formats.split(','))
+    for fixture in fixtures:
+        print(f"{fixture['name']:<24} {os.path.getsize(fixture['path']):>10} bytes  {fixture['path']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
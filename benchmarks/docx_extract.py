@@ -0,0 +1,47 @@
+"""
+Compare the streaming DOCX extractor with the python-docx object model.
+
+Usage:
+    python -m benchmarks.docx_extract [pages ...]
+"""
+import io
+import sys
+import time
+import tracemalloc
+
+from app.docx_extractor import extract_docx_text
+from app.file_processor import FileProcessor
+from benchmarks.corpus import make_docx
+
+EXTRACTORS = [
+    ("python-docx", FileProcessor._process_docx_model),
+    ("streaming", extract_docx_text),
+]
+
+
+def measure(extract, data, repeat=3):
+    """Return (best wall time in seconds, peak traced memory in bytes, text length)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = extract(io.BytesIO(data))
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    extract(io.BytesIO(data))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(text)
+
+
+def main(page_counts):
+    print(f"{'pages':>6} {'extractor':<12} {'time (ms)':>10} {'peak (MB)':>10} {'chars':>9}")
+    for pages in page_counts:
+        data = make_docx(pages)
+        for name, extract in EXTRACTORS:
+            seconds, peak, chars = measure(extract, data)
+            print(f"{pages:>6} {name:<12} {seconds * 1000:>10.1f} {peak / 1e6:>10.1f} {chars:>9}")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500])
@@ -0,0 +1,266 @@
+"""
+Benchmark FileProcessor.process_file for every format over a synthetic corpus.
+
+Each fixture (see benchmarks.corpus) is extracted in a fresh worker process,
+as an upload would be: from an in-memory stream, or from a path with
+--source path. Reports wall time (the best of at least --repeat runs, and
+of as many as fit in --min-time seconds), throughput in MB and pages per
+second, and peak RSS growth, plus the peak RSS of PDF worker processes when
+a document is large enough to use them. The number of PDF workers is set
+with --pdf-workers rather than taken from the machine, so that the
+parallel path is measured on a one-CPU runner too.
+
+Results are compared with a stored baseline, and the run exits with status
+1 when any extractor is slower or larger than its baseline by more than
+--threshold. A case that looks regressed is measured again, up to
+--confirm times, so that one noisy measurement does not fail the run.
+Timings depend on the machine, so record a baseline on the machine that
+runs the comparison:
+
+    python -m benchmarks.extractors --save-baseline
+    python -m benchmarks.extractors --threshold 0.4
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import BUILDERS, EXTENSIONS, write_corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'extractors.json')
+
+# Differences below these are noise whatever the threshold says
+MIN_SECONDS_REGRESSION = 0.005
+MIN_RSS_MB_REGRESSION = 4.0
+# Upper bound on the runs of one fixture, however fast it is
+MAX_REPEAT = 1000
+# Measurements compared with the baseline
+COMPARED = (('seconds', MIN_SECONDS_REGRESSION, 's'),
+            ('rss_mb', MIN_RSS_MB_REGRESSION, 'MB'),
+            ('worker_rss_mb', MIN_RSS_MB_REGRESSION, 'MB'))
+
+
+def _status_mb(field, pid='self'):
+    """Return a memory field of /proc/<pid>/status in MB, or None where it is unavailable."""
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """
+    Start measuring peak RSS from now and return the current RSS in MB.
+
+    On Linux the peak is reset through /proc/self/clear_refs. Elsewhere the
+    process peak so far is used, which can only overstate the growth.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return _status_mb('VmRSS')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _peak_rss_mb():
+    peak = _status_mb('VmHWM')
+    if peak is None:
+        # ru_maxrss is in KB on Linux; on Linux it can also include the parent before exec
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return peak
+
+
+def _worker_peak_rss_mb():
+    """Return the highest peak RSS of the live child processes, such as the PDF extraction pool."""
+    peaks = [_status_mb('VmHWM', child.pid) for child in multiprocessing.active_children()]
+    return max([peak for peak in peaks if peak is not None], default=0.0)
+
+
+def worker(path, format, pages, source, repeat, min_time):
+    """Extract one fixture in this process and print the measurements as JSON."""
+    from app.file_processor import FileProcessor
+
+    filename = f'fixture.{EXTENSIONS.get(format, format)}'
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    def extract():
+        return FileProcessor.process_file(path if source == 'path' else io.BytesIO(data), filename=filename)
+
+    # Load the parser libraries on a one-page document, outside the measurement
+    FileProcessor.process_file(io.BytesIO(BUILDERS[format](1)), filename=filename)
+    baseline_rss = _reset_peak_rss()
+
+    timings = []
+    while len(timings) < repeat or (sum(timings) < min_time and len(timings) < MAX_REPEAT):
+        start = time.perf_counter()
+        text = extract()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(json.dumps({
+        'seconds': round(best, 6),
+        'mb_per_second': round(len(data) / 2 ** 20 / best, 2),
+        'pages_per_second': round(pages / best, 1),
+        'rss_mb': round(max(0.0, _peak_rss_mb() - baseline_rss), 1),
+        'worker_rss_mb': round(_worker_peak_rss_mb(), 1),
+        'runs': len(timings),
+        'bytes': len(data),
+        'chars': len(text),
+    }))
+
+
+def measure(fixture, source, repeat, min_time, pdf_workers):
+    """Run the worker for one fixture in a fresh interpreter and return its measurements."""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.extractors', '--worker', fixture['path'],
+         '--format', fixture['format'], '--worker-pages', str(fixture['pages']),
+         '--source', source, '--repeat', str(repeat), '--min-time', str(min_time)],
+        cwd=ROOT, env=dict(os.environ, LOG_LEVEL='WARNING', PDF_EXTRACT_WORKERS=str(pdf_workers)),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return dict(json.loads(output.strip().splitlines()[-1]), name=fixture['name'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline.
+
+    A case regresses when its time or RSS growth exceeds the baseline by
+    more than threshold, and by more than the noise floor.
+
+    Args:
+        results (list): Measurements from this run
+        baseline (dict): Stored measurements by case name
+        threshold (float): Allowed relative increase, e.g. 0.4 for 40%
+
+    Returns:
+        list: (case name, description) of each regression
+    """
+    failures = []
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        for metric, floor, unit in COMPARED:
+            old, new = before.get(metric, 0), result[metric]
+            if new > old * (1 + threshold) and new - old > floor:
+                failures.append((result['name'], f"{metric} {new:g} {unit}, baseline {old:g} {unit} "
+                                                 f"(+{(new / old - 1) if old else float('inf'):.0%})"))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark text extraction for each file format.")
+    parser.add_argument('--pages', default='1,10,100,300', help="comma-separated page counts")
+    parser.add_argument('--formats', default=','.join(BUILDERS), help="comma-separated file types")
+    parser.add_argument('--corpus', help="directory holding the fixtures; generated there if missing "
+                                         "(default: a temporary directory)")
+    parser.add_argument('--source', choices=['stream', 'path'], default='stream',
+                        help="hand the extractor an in-memory stream, as for uploads, or a file path")
+    parser.add_argument('--pdf-workers', type=int, default=2,
+                        help="PDF extraction processes; large PDFs use the parallel path when this is above 1")
+    parser.add_argument('--repeat', type=int, default=5, help="least extractions per fixture; the best is reported")
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help="keep extracting a fixture until this many seconds have been spent on it")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file to compare with or save to")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.4,
+                        help="relative slowdown or RSS growth that counts as a regression")
+    parser.add_argument('--confirm', type=int, default=2,
+                        help="times a case that looks regressed is measured again before it fails the run")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--format', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-pages', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args.worker, args.format, args.worker_pages, args.source, args.repeat, args.min_time)
+        return 0
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        recorded = baseline.get('_environment', {}).get('pdf_workers')
+        if recorded != args.pdf_workers:
+            print(f"Note: the baseline was recorded with --pdf-workers {recorded}, this run uses {args.pdf_workers}")
+
+    page_counts = [int(pages) for pages in args.pages.split(',')]
+    failures = []
+    with tempfile.TemporaryDirectory() as scratch:
+        fixtures = write_corpus(args.corpus or scratch, page_counts, args.formats.split(','))
+        print(f"{'case':<30} {'size (KB)':>10} {'time (ms)':>10} {'MB/s':>8} {'pages/s':>9} "
+              f"{'RSS (MB)':>9} {'workers (MB)':>13}")
+        results = []
+        for fixture in fixtures:
+            result = measure(fixture, args.source, args.repeat, args.min_time, args.pdf_workers)
+            results.append(result)
+            _print_result(result)
+
+        if baseline is not None:
+            failures = compare(results, baseline, args.threshold)
+            by_name = {fixture['name']: fixture for fixture in fixtures}
+            for _ in range(args.confirm):
+                if not failures:
+                    break
+                # Keep the better of the measurements of each suspect case and compare again
+                suspects = {name for name, _ in failures}
+                for index, result in enumerate(results):
+                    if result['name'] in suspects:
+                        again = measure(by_name[result['name']], args.source, args.repeat, args.min_time,
+                                        args.pdf_workers)
+                        print(f"remeasured {result['name']}: {again['seconds'] * 1000:.3f} ms, "
+                              f"RSS {again['rss_mb']:.1f} MB")
+                        results[index] = dict(result, **{metric: min(result[metric], again[metric])
+                                                         for metric, _, _ in COMPARED})
+                failures = compare(results, baseline, args.threshold)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            stored = {result['name']: {metric: result[metric] for metric, _, _ in COMPARED} for result in results}
+            stored['_environment'] = {'python': platform.python_version(), 'machine': platform.machine(),
+                                      'cpus': os.cpu_count(), 'source': args.source,
+                                      'pdf_workers': args.pdf_workers}
+            json.dump(stored, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    for name, description in failures:
+        print(f"REGRESSION {name}: {description}")
+    if failures:
+        return 1
+    print(f"No extractor regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+def _print_result(result):
+    print(f"{result['name']:<30} {result['bytes'] / 1024:>10.1f} {result['seconds'] * 1000:>10.3f} "
+          f"{result['mb_per_second']:>8.2f} {result['pages_per_second']:>9.1f} "
+          f"{result['rss_mb']:>9.1f} {result['worker_rss_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
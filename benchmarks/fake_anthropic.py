@@ -0,0 +1,340 @@
+"""
+A local stand-in for the Anthropic Messages API, for load and failure testing.
+
+Serves POST /v1/messages with a canned analysis after a configurable
+latency, injects 5xx errors and 429 rate limits at configurable rates, and
+supports streaming (``"stream": true``) with the same Server-Sent Events
+as the real API. GET /stats reports how many requests each outcome got.
+
+Point the app at it with ANTHROPIC_BASE_URL and any non-empty API key:
+
+    python -m benchmarks.fake_anthropic --port 8765 --latency lognormal:1.5:0.4 --rate-limit-rate 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY_MAUDE=fake python index.py
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE_ANALYSIS = {
+    "diagnoses": [
+        {
+            "condition": "Community-acquired pneumonia",
+            "likelihood": "High",
+            "reasoning": "Fever, productive cough, basal crackles and raised inflammatory markers.",
+            "medications": [
+                {"name": "Amoxicillin", "dosage": "500 mg", "frequency": "Three times daily",
+                 "duration": "5 days", "notes": "Review if no improvement in 48 hours."}
+            ],
+            "additional_tests": ["Chest X-ray", "Sputum culture"]
+        },
+        {
+            "condition": "Acute pharyngitis",
+            "likelihood": "Medium",
+            "reasoning": "Sore throat with pharyngeal erythema.",
+            "medications": [
+                {"name": "Paracetamol", "dosage": "1 g", "frequency": "Every 6 hours as needed",
+                 "duration": "Until symptoms resolve", "notes": "Do not exceed 4 g per day."}
+            ],
+            "additional_tests": ["Rapid strep test"]
+        }
+    ],
+    "warnings": ["Check blood glucose closely while unwell; the patient takes metformin."],
+    "disclaimer": "This analysis is not a substitute for professional medical advice."
+}
+
+# Share of a streamed response's latency spent before the first token
+FIRST_TOKEN_FRACTION = 0.2
+STREAM_PIECE_CHARS = 40
+
+
+class LatencyDistribution:
+    """
+    Samples response latencies in seconds from a named distribution.
+
+    Specs are ``name:param[:param]``:
+
+    - ``fixed:S`` always S
+    - ``uniform:LOW:HIGH``
+    - ``normal:MEAN:STDDEV`` (clipped at zero)
+    - ``lognormal:MEDIAN:SIGMA``, the usual shape of API latency
+    - ``exponential:MEAN``
+    """
+
+    def __init__(self, spec, rng=None):
+        name, _, params = spec.partition(':')
+        try:
+            values = [float(value) for value in params.split(':')] if params else []
+        except ValueError:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        samplers = {
+            'fixed': (1, lambda s: s),
+            'uniform': (2, lambda low, high: self.rng.uniform(low, high)),
+            'normal': (2, lambda mean, stddev: max(0.0, self.rng.gauss(mean, stddev))),
+            'lognormal': (2, lambda median, sigma: self.rng.lognormvariate(math.log(median), sigma)),
+            'exponential': (1, lambda mean: self.rng.expovariate(1 / mean)),
+        }
+        if name not in samplers or len(values) != samplers[name][0]:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        self.spec = spec
+        self.rng = rng or random.Random()
+        self._sample = samplers[name][1]
+        self._params = values
+
+    def sample(self):
+        """Return one latency in seconds."""
+        return self._sample(*self._params)
+
+
+class _Server(ThreadingHTTPServer):
+    # Hundreds of clients may connect at once; the default backlog of 5 drops connections
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeAnthropicServer:
+    """
+    A threaded HTTP server imitating the Messages API.
+
+    Usable as a context manager, which serves from a background thread.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency='fixed:0.5', error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, seed=None):
+        """
+        Initialize the server.
+
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on (0 picks a free port)
+            latency (str): Latency distribution spec, see LatencyDistribution
+            error_rate (float): Share of requests answered with a 500 error
+            rate_limit_rate (float): Share of requests answered with a 429
+            retry_after (float): Seconds sent in the retry-after header of a 429
+            seed (int): Seed for latency and failure sampling, for repeatable runs
+        """
+        self.rng = random.Random(seed)
+        self.latency = LatencyDistribution(latency, self.rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.counts = {'ok': 0, 'streamed': 0, 'disconnected': 0, 'error': 0, 'rate_limited': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = _Server((host, port), self._handler_class())
+
+    @property
+    def base_url(self):
+        """The URL to use as ANTHROPIC_BASE_URL."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the base URL."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """Return the number of requests per outcome."""
+        with self._lock:
+            return dict(self.counts)
+
+    def plan(self):
+        """Draw the outcome and latency of one request."""
+        with self._lock:
+            draw = self.rng.random()
+            latency = self.latency.sample()
+            if draw < self.rate_limit_rate:
+                outcome = 'rate_limited'
+            elif draw < self.rate_limit_rate + self.error_rate:
+                outcome = 'error'
+            else:
+                outcome = 'ok'
+            return outcome, latency
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(_MessagesHandler):
+            fake = server
+
+        return Handler
+
+
+class _MessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.fake.stats())
+        else:
+            self._send_json(404, _error_body('not_found_error', 'Not found'))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('content-length') or 0))
+        if self.path.split('?')[0].rstrip('/') != '/v1/messages':
+            self._send_json(404, _error_body('not_found_error', 'Not found'))
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send_json(400, _error_body('invalid_request_error', 'Body is not valid JSON'))
+            return
+
+        outcome, latency = self.fake.plan()
+        if outcome == 'rate_limited':
+            # Rejections are fast, as with the real API
+            self.fake.count(outcome)
+            self._send_json(429, _error_body('rate_limit_error', 'Rate limit exceeded'),
+                            {'retry-after': f"{self.fake.retry_after:g}"})
+            return
+        if outcome == 'error':
+            time.sleep(latency)
+            self.fake.count(outcome)
+            self._send_json(500, _error_body('api_error', 'Internal server error'))
+            return
+
+        text = json.dumps(RESPONSE_ANALYSIS, indent=2)
+        usage = {
+            'input_tokens': _prompt_chars(payload) // 4,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'output_tokens': len(text) // 4,
+        }
+        if payload.get('stream'):
+            self.fake.count('streamed' if self._stream(payload, text, usage, latency) else 'disconnected')
+            return
+        time.sleep(latency)
+        self.fake.count(outcome)
+        self._send_json(200, {
+            'id': f"msg_{uuid.uuid4().hex}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': payload.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': usage,
+        })
+
+    def _stream(self, payload, text, usage, latency):
+        """Send the response as server-sent events; return False if the client went away first."""
+        try:
+            self._send_events(payload, text, usage, latency)
+        except (BrokenPipeError, ConnectionResetError):
+            # Hedged calls that lost and timed-out clients hang up mid-stream by design
+            self.close_connection = True
+            return False
+        return True
+
+    def _send_events(self, payload, text, usage, latency):
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('cache-control', 'no-cache')
+        self.send_header('connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        pieces = [text[start:start + STREAM_PIECE_CHARS] for start in range(0, len(text), STREAM_PIECE_CHARS)]
+        piece_delay = latency * (1 - FIRST_TOKEN_FRACTION) / len(pieces)
+        time.sleep(latency * FIRST_TOKEN_FRACTION)
+        self._event('message_start', {'type': 'message_start', 'message': {
+            'id': f"msg_{uuid.uuid4().hex}", 'type': 'message', 'role': 'assistant',
+            'model': payload.get('model'), 'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': dict(usage, output_tokens=1),
+        }})
+        self._event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                            'content_block': {'type': 'text', 'text': ''}})
+        for piece in pieces:
+            self._event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                'delta': {'type': 'text_delta', 'text': piece}})
+            time.sleep(piece_delay)
+        self._event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._event('message_delta', {'type': 'message_delta',
+                                      'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                      'usage': {'output_tokens': usage['output_tokens']}})
+        self._event('message_stop', {'type': 'message_stop'})
+
+    def _event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _prompt_chars(payload):
+    """Count the characters of the system prompt and messages of a request."""
+    def text_of(content):
+        if isinstance(content, str):
+            return len(content)
+        return sum(len(block.get('text', '')) for block in content or [])
+    return text_of(payload.get('system')) + sum(text_of(m.get('content')) for m in payload.get('messages', []))
+
+
+def _error_body(error_type, message):
+    return {'type': 'error', 'error': {'type': error_type, 'message': message}}
+
+
+def add_arguments(parser):
+    """Add the server's options to an argument parser."""
+    parser.add_argument('--latency', default='lognormal:1.5:0.4',
+                        help="latency distribution, e.g. fixed:0.5, uniform:0.5:2, lognormal:1.5:0.4")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests failing with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="share of requests rejected with a 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="retry-after seconds sent with a 429")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for repeatable runs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Anthropic Messages API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(args.host, args.port, args.latency, args.error_rate,
+                                 args.rate_limit_rate, args.retry_after, args.seed)
+    print(f"Fake Messages API on {server.base_url} (latency {args.latency})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
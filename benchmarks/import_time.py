@@ -0,0 +1,95 @@
+"""
+Measure the cold-start cost of the app: importing it and serving a first request.
+
+Each measurement runs in a fresh interpreter, as a serverless cold start
+would. Also reports which heavy dependencies were loaded up front; the
+PDF and DOCX parsers and the Anthropic SDK should only load on first use.
+
+Usage:
+    python -m benchmarks.import_time [--repeat 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Dependencies that must not be imported until a request needs them
+DEFERRED_MODULES = ('anthropic', 'httpx', 'PyPDF2', 'docx', 'multiprocessing')
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{module}.app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_seconds': imported - start,
+    'first_request_seconds': served - imported,
+    'loaded': [name for name in {deferred!r} if name in sys.modules],
+}}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module='app.app', repeat=5):
+    """
+    Import module and serve GET / in fresh interpreters.
+
+    Args:
+        module (str): Module defining the Flask ``app``
+        repeat (int): Number of interpreters to start
+
+    Returns:
+        dict: Best import_seconds and first_request_seconds over the runs, and
+            the deferred modules that were loaded
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_seconds': min(run['import_seconds'] for run in runs),
+        'first_request_seconds': min(run['first_request_seconds'] for run in runs),
+        'loaded': sorted({name for run in runs for name in run['loaded']}),
+    }
+
+
+def slowest_imports(module='app.app', top=15):
+    """Return the (cumulative microseconds, module) pairs of the slowest imports, via -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), name.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app cold-start import time.")
+    parser.add_argument('--module', default='app.app')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    result = measure(args.module, args.repeat)
+    print(f"import {args.module}: {result['import_seconds'] * 1000:.1f} ms (best of {args.repeat})")
+    print(f"first GET /: {result['first_request_seconds'] * 1000:.1f} ms")
+    print(f"deferred modules loaded at startup: {', '.join(result['loaded']) or 'none'}")
+    print(f"\n{'cumulative (ms)':>15}  module")
+    for cumulative, name in slowest_imports(args.module, args.top):
+        print(f"{cumulative / 1000:>15.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
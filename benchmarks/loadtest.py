@@ -0,0 +1,258 @@
+"""
+Load-test the upload pipeline end to end against a fake Messages API.
+
+Sends a mix of TXT, PDF and DOCX uploads to /analyze from concurrent
+clients and reports throughput and p50/p95/p99 latency per stage. Stage
+timings come from the app's Server-Timing header; ``request`` is the
+latency seen by the client. Every document is unique, so the analysis
+cache never answers for the API.
+
+By default the app and a fake Messages API (see benchmarks.fake_anthropic)
+are started in this process:
+
+    python -m benchmarks.loadtest --requests 200 --concurrency 16 --latency lognormal:1.5:0.4
+
+To test an app that is already running, start it with ANTHROPIC_BASE_URL
+pointing at a fake server and pass its URL:
+
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --requests 100
+
+With --max-p95 STAGE=SECONDS (repeatable) or --max-error-rate the run exits
+with status 1 when a limit is exceeded, so it can gate a CI job.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.corpus import make_docx, make_pdf, make_text
+from benchmarks.fake_anthropic import FakeAnthropicServer, add_arguments
+
+FIXTURES = {
+    'txt': (make_text, 'text/plain'),
+    'pdf': (make_pdf, 'application/pdf'),
+    'docx': (make_docx, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+}
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {stage: seconds}."""
+    timings = {}
+    for metric in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, *params = metric.split(';')
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name.strip()] = float(value) / 1000
+    return timings
+
+
+def parse_mix(spec):
+    """Turn "txt:2,pdf:1,docx:1" into a repeating sequence of file types."""
+    sequence = []
+    for part in spec.split(','):
+        kind, _, weight = part.strip().partition(':')
+        if kind not in FIXTURES:
+            raise argparse.ArgumentTypeError(f"Unknown file type in mix: {kind}")
+        sequence.extend([kind] * int(weight or 1))
+    return sequence
+
+
+def run_request(client, base_url, path, kind, pages, record_id):
+    """Upload one generated document and return its measurements."""
+    build, mimetype = FIXTURES[kind]
+    data = build(pages, record_id=record_id)
+    sample = {'kind': kind, 'stages': {}, 'error': None}
+
+    start = time.perf_counter()
+    try:
+        with client.stream('POST', base_url + path,
+                           files={'file': (f"record-{record_id}.{kind}", data, mimetype)}) as response:
+            body = []
+            for chunk in response.iter_text():
+                if not body and 'event: diagnosis' in chunk:
+                    sample['stages']['first_diagnosis'] = time.perf_counter() - start
+                body.append(chunk)
+        body = ''.join(body)
+    except httpx.HTTPError as e:
+        sample['error'] = type(e).__name__
+        return sample
+    sample['stages']['request'] = time.perf_counter() - start
+    sample['stages'].update(parse_server_timing(response.headers.get('server-timing')))
+
+    if response.status_code != 200:
+        sample['error'] = f"HTTP {response.status_code}"
+    elif path.endswith('/stream'):
+        if 'event: error' in body or 'event: done' not in body:
+            sample['error'] = 'analysis error'
+    elif json.loads(body).get('result', {}).get('error'):
+        sample['error'] = 'analysis error'
+    return sample
+
+
+def run(base_url, path, requests, concurrency, mix, pages):
+    """
+    Send the requests from concurrent clients.
+
+    Returns:
+        tuple: (samples, wall time in seconds)
+    """
+    run_id = uuid.uuid4().hex[:8]
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    samples = []
+
+    def client_loop():
+        with httpx.Client(timeout=600) as client:
+            while True:
+                with counter_lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                samples.append(run_request(client, base_url, path, mix[index % len(mix)], pages,
+                                           f"{run_id}-{index}"))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client_loop) for _ in range(concurrency)]:
+            future.result()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, wall_time):
+    """Compute throughput, error counts, and latency percentiles per stage."""
+    stages = {}
+    for sample in samples:
+        for stage, seconds in sample['stages'].items():
+            stages.setdefault(stage, []).append(seconds)
+            if stage in ('extract', 'request'):
+                stages.setdefault(f"{stage}[{sample['kind']}]", []).append(seconds)
+    errors = {}
+    for sample in samples:
+        if sample['error']:
+            errors[sample['error']] = errors.get(sample['error'], 0) + 1
+    succeeded = len(samples) - sum(errors.values())
+    return {
+        'requests': len(samples),
+        'succeeded': succeeded,
+        'errors': errors,
+        'error_rate': round(1 - succeeded / len(samples), 4) if samples else 0.0,
+        'wall_seconds': round(wall_time, 3),
+        'throughput_rps': round(succeeded / wall_time, 3) if wall_time else 0.0,
+        'stages': {
+            stage: {
+                'count': len(values),
+                'p50': round(percentile(values, 0.50), 4),
+                'p95': round(percentile(values, 0.95), 4),
+                'p99': round(percentile(values, 0.99), 4),
+                'max': round(max(values), 4),
+            }
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+
+def print_report(summary):
+    print(f"requests {summary['requests']}, succeeded {summary['succeeded']}, "
+          f"wall {summary['wall_seconds']:.1f} s, throughput {summary['throughput_rps']:.2f} req/s")
+    for error, count in sorted(summary['errors'].items()):
+        print(f"  {count} x {error}")
+    print(f"{'stage':<18} {'count':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+    for stage, values in summary['stages'].items():
+        print(f"{stage:<18} {values['count']:>6} {values['p50'] * 1000:>10.1f} {values['p95'] * 1000:>10.1f} "
+              f"{values['p99'] * 1000:>10.1f} {values['max'] * 1000:>10.1f}")
+
+
+def check_limits(summary, max_p95, max_error_rate):
+    """Return a list of the limits the run exceeded."""
+    failures = []
+    for limit in max_p95:
+        stage, _, seconds = limit.partition('=')
+        observed = summary['stages'].get(stage, {}).get('p95')
+        if observed is not None and observed > float(seconds):
+            failures.append(f"p95 of {stage} is {observed:.3f} s, limit {float(seconds):.3f} s")
+    if max_error_rate is not None and summary['error_rate'] > max_error_rate:
+        failures.append(f"error rate is {summary['error_rate']:.2%}, limit {max_error_rate:.2%}")
+    return failures
+
+
+def start_local_app(args):
+    """Start the fake API and the app in this process; return (app URL, fake server, app server)."""
+    fake = FakeAnthropicServer(latency=args.latency, error_rate=args.error_rate,
+                               rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                               seed=args.seed)
+    os.environ['ANTHROPIC_BASE_URL'] = fake.start()
+    os.environ.setdefault('ANTHROPIC_API_KEY_MAUDE', 'fake-key')
+    # The account-level limits are not what is under test
+    os.environ.setdefault('ANTHROPIC_REQUESTS_PER_MINUTE', '1000000')
+    os.environ.setdefault('ANTHROPIC_BURST', str(max(10, args.concurrency)))
+
+    # Imported only now, since the app reads its configuration at import time
+    from werkzeug.serving import make_server
+    from app.app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", fake, server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /analyze end to end.")
+    parser.add_argument('--url', help="base URL of a running app; by default one is started in-process")
+    parser.add_argument('--path', default='/analyze', choices=['/analyze', '/analyze/stream'])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('txt:1,pdf:1,docx:1'),
+                        help="weighted file types, e.g. txt:2,pdf:1,docx:1")
+    parser.add_argument('--pages', type=int, default=2, help="pages per generated document")
+    parser.add_argument('--json', help="also write the summary to this file")
+    parser.add_argument('--max-p95', action='append', default=[], metavar='STAGE=SECONDS')
+    parser.add_argument('--max-error-rate', type=float)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    fake = server = None
+    base_url = args.url
+    if base_url is None:
+        base_url, fake, server = start_local_app(args)
+    try:
+        samples, wall_time = run(base_url.rstrip('/'), args.path, args.requests, args.concurrency,
+                                 args.mix, args.pages)
+    finally:
+        if server is not None:
+            server.shutdown()
+            fake.stop()
+
+    summary = summarize(samples, wall_time)
+    if fake is not None:
+        summary['upstream'] = fake.stats()
+    print_report(summary)
+    if fake is not None:
+        print(f"upstream: {summary['upstream']}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    failures = check_limits(summary, args.max_p95, args.max_error_rate)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,54 +1,270 @@
 document.addEventListener('DOMContentLoaded', function() {
     const analyzeForm = document.getElementById('analyzeForm');
     const loadingSpinner = document.getElementById('loadingSpinner');
+    const loadingStatus = document.getElementById('loadingStatus');
+    const loadingText = loadingStatus ? loadingStatus.textContent : '';
     const errorMessage = document.getElementById('errorMessage');
     const analyzeBtn = document.getElementById('analyzeBtn');
-    
+    const streamResults = document.getElementById('streamResults');
+    const diagnosisList = document.getElementById('diagnosisList');
+
+    function showError(message) {
+        // Hide loading spinner
+        loadingSpinner.classList.add('d-none');
+        analyzeBtn.disabled = false;
+
+        // Show error message
+        errorMessage.textContent = message;
+        errorMessage.classList.remove('d-none');
+    }
+
+    function showStatus(message) {
+        if (loadingStatus) {
+            loadingStatus.textContent = message;
+        }
+    }
+
+    // Retries of a request the server turns away as busy (429) before giving up
+    const MAX_BUSY_RETRIES = 5;
+
+    // POST formData to url, waiting and trying again while the server is busy.
+    // Each wait honours Retry-After, doubles with every attempt, and is
+    // stretched by a random amount so that turned-away clients spread out.
+    function postWithBackoff(url, formData, attempt) {
+        attempt = attempt || 0;
+        return fetch(url, {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => {
+            if (response.status !== 429 || attempt >= MAX_BUSY_RETRIES) {
+                showStatus(loadingText);
+                return response;
+            }
+            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+            const delay = retryAfter * Math.pow(2, attempt) * (1 + Math.random() * 0.5);
+            showStatus('The server is busy. Trying again in ' + Math.ceil(delay) + ' seconds...');
+            return new Promise(resolve => setTimeout(resolve, delay * 1000))
+                .then(() => postWithBackoff(url, formData, attempt + 1));
+        });
+    }
+
+    function element(tag, className, text) {
+        const el = document.createElement(tag);
+        if (className) {
+            el.className = className;
+        }
+        if (text !== undefined && text !== null) {
+            el.textContent = text;
+        }
+        return el;
+    }
+
+    // Build a diagnosis card with the same markup as results.html
+    function renderDiagnosis(diagnosis) {
+        const card = element('div', 'card mb-4');
+        const header = element('div', 'card-header d-flex justify-content-between align-items-center');
+        header.appendChild(element('h4', 'mb-0', diagnosis.condition));
+        if (diagnosis.likelihood) {
+            let badgeClass = 'bg-info';
+            if (diagnosis.likelihood === 'High') {
+                badgeClass = 'bg-danger';
+            } else if (diagnosis.likelihood === 'Medium') {
+                badgeClass = 'bg-warning text-dark';
+            }
+            header.appendChild(element('span', 'badge ' + badgeClass, diagnosis.likelihood + ' Likelihood'));
+        }
+        card.appendChild(header);
+
+        const body = element('div', 'card-body');
+        if (diagnosis.reasoning) {
+            body.appendChild(element('h5', null, 'Reasoning:'));
+            body.appendChild(element('p', null, diagnosis.reasoning));
+        }
+
+        if (diagnosis.medications && diagnosis.medications.length > 0) {
+            body.appendChild(element('h5', null, 'Recommended Medications:'));
+            const wrapper = element('div', 'table-responsive');
+            const table = element('table', 'table table-bordered');
+            const headRow = element('tr');
+            ['Medication', 'Dosage', 'Frequency', 'Duration', 'Notes'].forEach(function(title) {
+                headRow.appendChild(element('th', null, title));
+            });
+            const thead = element('thead', 'table-light');
+            thead.appendChild(headRow);
+            table.appendChild(thead);
+            const tbody = element('tbody');
+            diagnosis.medications.forEach(function(med) {
+                const row = element('tr');
+                const name = element('td');
+                name.appendChild(element('strong', null, med.name));
+                row.appendChild(name);
+                [med.dosage, med.frequency, med.duration, med.notes].forEach(function(value) {
+                    row.appendChild(element('td', null, value));
+                });
+                tbody.appendChild(row);
+            });
+            table.appendChild(tbody);
+            wrapper.appendChild(table);
+            body.appendChild(wrapper);
+        }
+
+        if (diagnosis.additional_tests && diagnosis.additional_tests.length > 0) {
+            body.appendChild(element('h5', null, 'Additional Tests Recommended:'));
+            const list = element('ul');
+            diagnosis.additional_tests.forEach(function(test) {
+                list.appendChild(element('li', null, test));
+            });
+            body.appendChild(list);
+        }
+        card.appendChild(body);
+        return card;
+    }
+
+    // Handle one server-sent event; returns true for the events that end the stream
+    function handleStreamEvent(event, data) {
+        if (event === 'diagnosis') {
+            streamResults.classList.remove('d-none');
+            diagnosisList.appendChild(renderDiagnosis(data));
+        } else if (event === 'done') {
+            // Redirect to the stored result for warnings and printing
+            window.location.href = data.results_url;
+            return true;
+        } else if (event === 'error') {
+            showError(data.error);
+            return true;
+        }
+        return false;
+    }
+
+    function submitStream(formData) {
+        diagnosisList.innerHTML = '';
+        streamResults.classList.add('d-none');
+
+        return postWithBackoff('/analyze/stream', formData)
+        .then(response => {
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.startsWith('text/event-stream')) {
+                // Validation errors come back as plain JSON
+                return response.json().then(data => showError(data.error || 'An error occurred. Please try again.'));
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let finished = false;
+
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        // A proxy timeout or a crashed worker ends the stream without a final event
+                        if (!finished) {
+                            showError('The connection to the server was lost before the analysis finished. Please try again.');
+                        }
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+
+                    // Events are separated by a blank line
+                    let boundary = buffer.indexOf('\n\n');
+                    while (boundary !== -1) {
+                        const rawEvent = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        let event = 'message';
+                        let data = '';
+                        rawEvent.split('\n').forEach(function(line) {
+                            if (line.startsWith('event: ')) {
+                                event = line.slice(7);
+                            } else if (line.startsWith('data: ')) {
+                                data += line.slice(6);
+                            }
+                        });
+                        let parsed;
+                        try {
+                            parsed = JSON.parse(data);
+                        } catch (error) {
+                            console.error('Malformed event:', error);
+                            showError('The server sent an unreadable response. Please try again.');
+                            return reader.cancel();
+                        }
+                        if (handleStreamEvent(event, parsed)) {
+                            finished = true;
+                        }
+                        boundary = buffer.indexOf('\n\n');
+                    }
+                    return read();
+                });
+            }
+            return read();
+        });
+    }
+
+    function pollJob(statusUrl) {
+        // Long-poll until the job has finished
+        return fetch(statusUrl + '?wait=25')
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'done') {
+                window.location.href = job.results_url;
+            } else if (job.status === 'failed' || job.error) {
+                showError(job.error || 'Analysis failed. Please try again.');
+            } else {
+                return pollJob(statusUrl);
+            }
+        });
+    }
+
+    function submitJob(formData) {
+        return fetch('/analyze?mode=job', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                showError(data.error);
+            } else {
+                return pollJob(data.status_url);
+            }
+        });
+    }
+
+    function submitSync(formData) {
+        return postWithBackoff('/analyze', formData)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                showError(data.error);
+            } else {
+                // Redirect to the stored result
+                window.location.href = data.results_url || '/results';
+            }
+        });
+    }
+
     if (analyzeForm) {
         analyzeForm.addEventListener('submit', function(e) {
             e.preventDefault();
-            
+
             // Clear previous errors
             errorMessage.classList.add('d-none');
             errorMessage.textContent = '';
-            
+
             // Show loading spinner
             loadingSpinner.classList.remove('d-none');
             analyzeBtn.disabled = true;
-            
+
             // Create form data
             const formData = new FormData(analyzeForm);
-            
+
             // Send request to analyze endpoint
-            fetch('/analyze', {
-                method: 'POST',
-                body: formData
-            })
-            .then(response => response.json())
-            .then(data => {
-                // Hide loading spinner
-                loadingSpinner.classList.add('d-none');
-                analyzeBtn.disabled = false;
-                
-                if (data.error) {
-                    // Show error message
-                    errorMessage.textContent = data.error;
-                    errorMessage.classList.remove('d-none');
-                } else {
-                    // Redirect to results page
-                    window.location.href = '/results';
-                }
-            })
+            const submitters = { stream: submitStream, job: submitJob };
+            const submit = submitters[analyzeForm.dataset.mode] || submitSync;
+            submit(formData)
             .catch(error => {
-                // Hide loading spinner
-                loadingSpinner.classList.add('d-none');
-                analyzeBtn.disabled = false;
-                
-                // Show error message
-                errorMessage.textContent = 'An error occurred. Please try again.';
-                errorMessage.classList.remove('d-none');
+                showError('An error occurred. Please try again.');
                 console.error('Error:', error);
             });
         });
     }
-});
\ No newline at end of file
+});
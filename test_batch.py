@@ -0,0 +1,80 @@
+"""
+Batch handling: closing a batch early, as when an NDJSON client
+disconnects, must return at once and leave the documents still queued
+unanalyzed, and ZIP members are validated like uploads.
+
+Run with pytest, or directly: python test_batch.py
+"""
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+
+from app.batch import BatchAnalyzer, expand_zip
+
+DOCUMENTS = 10
+# Seconds each fake analysis takes
+ANALYSIS_SECONDS = 0.1
+
+
+class _SlowAnalyzer:
+    """Counts the analyses started, each taking ANALYSIS_SECONDS."""
+
+    calls = 0
+    lock = threading.Lock()
+
+    def analyze_patient_data(self, patient_data):
+        with _SlowAnalyzer.lock:
+            _SlowAnalyzer.calls += 1
+        time.sleep(ANALYSIS_SECONDS)
+        return json.dumps({'diagnoses': []})
+
+
+def test_closing_a_batch_drops_pending_documents():
+    _SlowAnalyzer.calls = 0
+    documents = [(f'note-{index}.txt', f'Patient note {index}'.encode()) for index in range(DOCUMENTS)]
+    with mock.patch('app.batch.MedicalAnalyzer', _SlowAnalyzer):
+        results = BatchAnalyzer(concurrency=1, extraction_workers=1).run(documents)
+        assert next(results)['status'] == 'done'
+        start = time.perf_counter()
+        results.close()
+        assert time.perf_counter() - start < ANALYSIS_SECONDS * 2
+
+    # Give any analysis that was still queued time to start, were it going to
+    time.sleep(ANALYSIS_SECONDS * 3)
+    # The first analysis and at most the one running when the batch was closed
+    assert _SlowAnalyzer.calls <= 2
+
+
+def test_zip_members_are_validated():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('good.txt', 'Patient note')
+        zf.writestr('bad.txt', b'\xff\xfe not UTF-8')
+        zf.writestr('fake.pdf', b'Not a PDF at all')
+        zf.writestr('fake.docx', b'Not a ZIP either')
+        zf.writestr('large.pdf', b'%PDF-1.4' + b' ' * 200)
+        zf.writestr('large-fake.pdf', b' ' * 2000)
+    archive.seek(0)
+    with tempfile.TemporaryDirectory() as directory:
+        documents, skipped = expand_zip(archive, directory, lambda name: True, memory_limit=100)
+        assert [name for name, _ in documents] == ['good.txt', 'large.pdf']
+        assert documents[0][1] == b'Patient note'
+        assert dict(skipped) == {
+            'bad.txt': 'Text file is not valid UTF-8',
+            'fake.pdf': 'File is not a valid PDF document',
+            'fake.docx': 'File is not a valid DOCX document',
+            'large-fake.pdf': 'File is not a valid PDF document',
+        }
+        # A rejected member is not left behind on disk
+        assert os.listdir(directory) == [os.path.basename(documents[1][1])]
+
+
+if __name__ == '__main__':
+    test_closing_a_batch_drops_pending_documents()
+    test_zip_members_are_validated()
+    print("Batch tests passed")
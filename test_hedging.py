@@ -0,0 +1,151 @@
+"""
+Hedging must measure the API, not our own queues: a request held by the
+rate limiter is not slow, and a saturated client gets no hedge request.
+
+Run with pytest, or directly: python test_hedging.py
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app.client import APIClient, AsyncAPIClient, CircuitBreaker, TokenBucket
+from app.hedging import Hedger, stream_text, stream_text_async
+from app.metrics import HEDGES
+
+# First-token deadline the hedger is primed with, in seconds
+DEADLINE = 0.05
+
+
+def _usage():
+    return SimpleNamespace(input_tokens=10, output_tokens=1, cache_read_input_tokens=0,
+                           cache_creation_input_tokens=0)
+
+
+class _FakeStream:
+    """A messages stream whose first token arrives delay seconds after it was opened."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.current_message_snapshot = SimpleNamespace(usage=_usage())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class _SyncStream(_FakeStream):
+    @property
+    def text_stream(self):
+        time.sleep(self.delay)
+        yield 'ok'
+
+    def get_final_message(self):
+        return SimpleNamespace(usage=_usage())
+
+
+class _AsyncStream(_FakeStream):
+    @property
+    async def text_stream(self):
+        await asyncio.sleep(self.delay)
+        yield 'ok'
+
+    async def get_final_message(self):
+        return SimpleNamespace(usage=_usage())
+
+
+class _FakeMessages:
+    def __init__(self, stream_class, delay):
+        self.stream_class = stream_class
+        self.delay = delay
+        self.sent = 0
+
+    def stream(self, **kwargs):
+        self.sent += 1
+        return self.stream_class(self.delay)
+
+
+def _client(client_class, stream_class, delay, limiter):
+    """Build client_class talking to a fake API, limited by limiter."""
+    messages = _FakeMessages(stream_class, delay)
+
+    class Client(client_class):
+        def _create_sdk(self, api_key, base_url):
+            return None, SimpleNamespace(messages=messages)
+
+    client = Client('test-key')
+    client.rate_limiter = limiter
+    client.breaker = CircuitBreaker()
+    return client, messages
+
+
+def _hedges_sent():
+    return sum(value for _, labels, value in HEDGES.samples() if labels['outcome'] in ('won', 'lost'))
+
+
+def _hedger():
+    hedger = Hedger(50, min_samples=1)
+    hedger.record(DEADLINE)
+    return hedger
+
+
+def _held_client(client_class, stream_class):
+    """Build a client whose next rate-limit token is 0.25 s away, five times the hedge deadline."""
+    client, messages = _client(client_class, stream_class, 0.01, TokenBucket(rate=4, capacity=1))
+    client.rate_limiter.reserve()
+    return client, messages
+
+
+def test_no_hedge_while_held_by_the_rate_limiter():
+    hedger = _hedger()
+    client, messages = _held_client(APIClient, _SyncStream)
+    hedges = _hedges_sent()
+    assert ''.join(stream_text(client, hedger, model='test')) == 'ok'
+    assert messages.sent == 1
+    assert _hedges_sent() == hedges
+    # The recorded first-token time excludes the wait for the limiter
+    assert hedger._samples[-1] < DEADLINE
+
+
+def test_no_hedge_while_held_by_the_rate_limiter_async():
+    hedger = _hedger()
+    client, messages = _held_client(AsyncAPIClient, _AsyncStream)
+
+    async def run():
+        return ''.join([text async for text in stream_text_async(client, hedger, model='test')])
+
+    hedges = _hedges_sent()
+    assert asyncio.run(run()) == 'ok'
+    assert messages.sent == 1
+    assert _hedges_sent() == hedges
+    assert hedger._samples[-1] < DEADLINE
+
+
+def test_no_hedge_when_the_rate_limiter_has_no_token_to_spare():
+    # The primary request takes the only token; a slow first token is not hedged
+    client, messages = _client(APIClient, _SyncStream, 0.3, TokenBucket(rate=0.1, capacity=1))
+    hedges = _hedges_sent()
+    assert ''.join(stream_text(client, _hedger(), model='test')) == 'ok'
+    assert messages.sent == 1
+    assert _hedges_sent() == hedges
+
+
+def test_slow_first_token_is_hedged():
+    client, messages = _client(APIClient, _SyncStream, 0.3, TokenBucket(rate=100, capacity=10))
+    assert ''.join(stream_text(client, _hedger(), model='test')) == 'ok'
+    assert messages.sent == 2
+
+
+if __name__ == '__main__':
+    test_no_hedge_while_held_by_the_rate_limiter()
+    test_no_hedge_while_held_by_the_rate_limiter_async()
+    test_no_hedge_when_the_rate_limiter_has_no_token_to_spare()
+    test_slow_first_token_is_hedged()
+    print("Hedging tests passed")
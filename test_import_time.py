@@ -0,0 +1,26 @@
+"""
+Cold-start budget: fails when importing the app gets slower than the budget,
+or when a dependency that should load on first use is imported up front.
+
+Run with pytest, or directly: python test_import_time.py
+"""
+import os
+
+from benchmarks.import_time import measure
+
+# Seconds allowed for "import app.app" in a fresh interpreter. Flask itself
+# takes most of this; loading the SDK and parsers eagerly roughly tripled it.
+IMPORT_TIME_BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 0.4))
+
+
+def test_import_time_within_budget():
+    result = measure(repeat=3)
+    assert result['loaded'] == [], f"Loaded at startup: {', '.join(result['loaded'])}"
+    assert result['import_seconds'] <= IMPORT_TIME_BUDGET, (
+        f"import app.app took {result['import_seconds']:.3f} s, budget {IMPORT_TIME_BUDGET:.3f} s"
+    )
+
+
+if __name__ == '__main__':
+    test_import_time_within_budget()
+    print("Import time within budget")
@@ -0,0 +1,34 @@
+"""
+The PDF character cap bounds the extracted text as returned, page
+separators included, whether extracted in-process or on the worker pool.
+
+Run with pytest, or directly: python test_pdf_extractor.py
+"""
+from app.pdf_extractor import PAGE_SEPARATOR, PDF_PARALLEL_MIN_PAGES, extract_pdf_text
+from benchmarks.corpus import make_pdf
+
+
+def _check_cap(pdf, workers):
+    full = extract_pdf_text(pdf, workers=workers, max_chars=10 ** 9)
+    first_page = len(full.split(PAGE_SEPARATOR)[0])
+    # Mid-page, and exactly where the separator after the first page would go
+    for max_chars in (1000, first_page + 1, first_page, len(full) - 1):
+        text = extract_pdf_text(pdf, workers=workers, max_chars=max_chars)
+        assert len(text) <= max_chars
+        assert full.startswith(text)
+        assert text.warnings
+    assert extract_pdf_text(pdf, workers=workers, max_chars=len(full)) == full
+
+
+def test_max_chars_includes_page_separators():
+    _check_cap(make_pdf(5), workers=1)
+
+
+def test_max_chars_includes_page_separators_in_parallel():
+    _check_cap(make_pdf(PDF_PARALLEL_MIN_PAGES), workers=2)
+
+
+if __name__ == '__main__':
+    test_max_chars_includes_page_separators()
+    test_max_chars_includes_page_separators_in_parallel()
+    print("PDF extractor tests passed")